@@ -1,3 +1,8 @@
+import time
+# Start of the startup timeline; set before the imports, as they take a good
+# part of the startup time
+LAUNCH_TIME: float = time.perf_counter()
+
 import sys
 import logging as log
 import imgui
@@ -8,19 +13,12 @@ from collections.abc import Callable
 from __version__ import __version__
 from typing import NamedTuple
 from pathlib import Path
-from io import IOBase
 
 import dialog
 import project
 import editor
-import xmlproject
-import cProfile
-
-
-# Setup logging
-log.basicConfig(filename='lyra-tool.log', filemode='w',
-                format='%(asctime)s |%(levelname)s| (%(name)s) %(message)s',
-                level=log.INFO)
+import partition
+import filejob
 
 
 class ModalEntry(NamedTuple):
@@ -63,6 +61,41 @@ class Window:
         self.impl = GlfwRenderer(self.window)
         self.content_scale: float = 1.0
 
+        # Number of input and window events received since the last frame
+        self.events: int = 0
+        for setter in (glfw.set_key_callback, glfw.set_char_callback,
+                       glfw.set_cursor_pos_callback,
+                       glfw.set_cursor_enter_callback,
+                       glfw.set_mouse_button_callback,
+                       glfw.set_scroll_callback, glfw.set_drop_callback,
+                       glfw.set_window_size_callback,
+                       glfw.set_framebuffer_size_callback,
+                       glfw.set_window_content_scale_callback,
+                       glfw.set_window_focus_callback,
+                       glfw.set_window_refresh_callback):
+            self._count_events(setter)
+
+    # Installs a callback that counts events, chained in front of the
+    # callback already installed by the imgui integration (if any)
+    def _count_events(self, setter: Callable) -> None:
+        previous: Callable = None
+
+        def callback(*args) -> None:
+            self.events += 1
+            if previous is not None:
+                previous(*args)
+
+        previous = setter(self.window, callback)
+
+    # Blocks until an event arrives or the timeout (in seconds) expires
+    def wait_events(self, timeout: float) -> None:
+        glfw.wait_events_timeout(timeout)
+
+    def take_events(self) -> int:
+        events: int = self.events
+        self.events = 0
+        return events
+
     def update(self) -> None:
         glfw.poll_events()
         self.impl.process_inputs()
@@ -90,37 +123,69 @@ class Window:
         glfw.terminate()
 
 
+# Times of the steps of startup, logged as one timeline once the first frame
+# is drawn, to keep track of the time to the first frame
+class StartupTimeline:
+    def __init__(self, start: float) -> None:
+        self.start: float = start
+        self.marks: list[tuple[str, float]] = []
+
+    def mark(self, step: str) -> None:
+        self.marks.append((step, time.perf_counter()))
+
+    def log(self) -> None:
+        last: float = self.start
+        for step, at in self.marks:
+            log.info(f'Startup: {step:<12} {(at - last) * 1000.0:8.1f} ms, '
+                     f'{(at - self.start) * 1000.0:8.1f} ms since launch')
+            last = at
+
+
 class LyraToolApp:
-    def __init__(self) -> None:
+    # Longest time to sleep without producing a frame when idle (in seconds)
+    IDLE_TIMEOUT: float = 0.5
+    # Frames still produced after the last event, so imgui can settle
+    # hover states, popups and window layout
+    SETTLE_FRAMES: int = 3
+
+    def __init__(self, timeline: StartupTimeline = None) -> None:
+        timeline = timeline or StartupTimeline(time.perf_counter())
         imgui.create_context()
-        self.window = Window()
         self.io = imgui.get_io()
         self.font_size: int = 16
         self.font_mult: float = 2.0
-        # Loading x2 font size to look good on Hi-DPI screens
+        # Loading x2 font size to look good on Hi-DPI screens. Added before
+        # the window's renderer is made, which builds the font atlas and its
+        # texture, so that they are built once.
         self.font = self.io.fonts.add_font_from_file_ttf(
             'Roboto.ttf', int(self.font_size * self.font_mult))
-        self.window.impl.refresh_font_texture()
+        self.window = Window()
+        timeline.mark('window')
         self.editor = editor.Interface()
+        timeline.mark('editor')
         self.file_new: bool = False
         self.file_open: bool = False
         self.file_save: bool = False
         self.file_quit: bool = False
         self.modal_queue: list[ModalEntry] = []
         self.modal_entry: ModalEntry = None
+        # Load, save or export running on a worker thread, shown in a modal
+        self.file_job: filejob.FileJob = None
 
-    def _open_file(self, file: IOBase) -> None:
-        try:
-            Project = xmlproject.from_file()
-        except:
-            log.exception('Unhandled exception when opening file:')
+        # Only produce frames after input, project changes or pending modals
+        self.idle_mode: bool = True
+        self.settle_frames: int = self.SETTLE_FRAMES
 
     def _file_menu(self) -> None:
         has_open_proj: bool = (self.editor.project is not None)
-
-        file_new, _ = imgui.menu_item('New', None, False, True)
-        file_open, _ = imgui.menu_item('Open', None, False, True)
-        file_save, _ = imgui.menu_item('Save', None, False, has_open_proj)
+        idle: bool = self.file_job is None
+
+        file_new, _ = imgui.menu_item('New', None, False, idle)
+        file_open, _ = imgui.menu_item('Open', None, False, idle)
+        file_save, _ = imgui.menu_item('Save', None, False,
+                                       idle and has_open_proj)
+        file_export, _ = imgui.menu_item('Export Write Fields...', None, False,
+                                         idle and has_open_proj)
         imgui.separator()
         file_quit, _ = imgui.menu_item('Quit', None, False, True)
 
@@ -145,6 +210,9 @@ class LyraToolApp:
         if file_save:
             self._handle_file_save()
 
+        if file_export:
+            self._handle_file_export_fields()
+
         if file_quit:
             self._enqueue_modal('Quit?',
                                 ('Are you sure you want to quit?\n' +
@@ -176,35 +244,81 @@ class LyraToolApp:
         self.editor.set_project(new_proj)
 
     def _handle_file_open(self) -> None:
-        file = dialog.file_open()
-        if file is None:
-            log.info('None file returned from file open dialog, will ignore')
+        path = dialog.file_open_path()
+        if path is None:
+            log.info('None path returned from file open dialog, will ignore')
         else:
-            log.info(f'Loading using xmlproject reader from file: {file.name}')
-            try:
-                proj = xmlproject.from_file(file)
-                self.editor.set_project(proj)
-                file.close()
-            except:
-                log.exception('Exception occurred during file parse:')
-                self._enqueue_modal('Error!',
-                                ('Exception occurred during file load!\n' +
-                                 'Check the log file for more info.'))
+            self.file_job = filejob.load_project(path, editor.prepare_project)
 
     def _handle_file_save(self) -> None:
-        file = dialog.file_save()
-        if file is None:
-            log.info('None file returned from file save dialog, will ignore')
+        path = dialog.file_save_path()
+        if path is None:
+            log.info('None path returned from file save dialog, will ignore')
         else:
-            log.info(f'Saving using xmlproject writer to file: {file.name}')
-            try:
-                xmlproject.to_file(self.editor.project, file)
-                file.close()
-            except:
-                log.exception('Exception occurred during file save:')
-                self._enqueue_modal('Error!',
-                                ('Exception occurred during file save!\n' +
-                                 'Check the log file for more info.'))
+            self.file_job = filejob.save_project(path, self.editor.project)
+
+    # Shows the progress of the running file job in a modal, which also keeps
+    # the editor from changing the project meanwhile, and takes its outcome
+    # once it is done
+    def _handle_file_job(self) -> None:
+        job: filejob.FileJob = self.file_job
+        if job is None:
+            return
+
+        if not imgui.is_popup_open(job.title):
+            imgui.open_popup(job.title)
+        flags = imgui.WINDOW_ALWAYS_AUTO_RESIZE | imgui.WINDOW_NO_SAVED_SETTINGS
+        with imgui.begin_popup_modal(job.title, flags=flags) as modal:
+            if modal.opened:
+                imgui.progress_bar(job.progress, (300, 0))
+                if job.done():
+                    imgui.close_current_popup()
+                elif job.cancelling():
+                    imgui.text('Cancelling...')
+                elif imgui.button('Cancel', 100):
+                    log.info(f'{job.title} cancelled by the user')
+                    job.cancel()
+
+        if job.done():
+            self.file_job = None
+            self._finish_file_job(job)
+
+    def _finish_file_job(self, job: filejob.FileJob) -> None:
+        if job.cancelled:
+            log.info(f'{job.title} cancelled after {job.elapsed():.2f} s')
+            return
+        if job.error is not None:
+            log.error(f'{job.title} failed with an exception:',
+                      exc_info=job.error)
+            self._enqueue_modal('Error!',
+                            (f'{job.title} failed with an exception!\n' +
+                             'Check the log file for more info.'))
+            return
+
+        log.info(f'{job.title} done in {job.elapsed():.2f} s')
+        if isinstance(job.result, filejob.FieldExport):
+            self._finish_export_fields(job.result)
+        elif isinstance(job.result, tuple):
+            proj, prepared = job.result
+            self.editor.set_project(proj, prepared)
+
+    def _handle_file_export_fields(self) -> None:
+        base = dialog.file_save_path()
+        if base is None:
+            log.info('None path returned from file save dialog, will ignore')
+            return
+        shapes = self.editor.shapes
+        self.file_job = filejob.export_fields(
+            base, self.editor.project.settings, [s.name for s in shapes],
+            [s.shape for s in shapes], self.editor.partition_fields())
+
+    def _finish_export_fields(self, export: filejob.FieldExport) -> None:
+        part: partition.Partition = export.partition
+        desc: str = f'Wrote {len(export.paths)} write field files.'
+        if len(part.flagged()) > 0:
+            desc += (f'\n{len(part.flagged())} shapes straddle field boundaries\n' +
+                     'and were left whole in the field of their center.')
+        self._enqueue_modal('Export Done', desc)
 
     def _handle_modal(self) -> None:
         if self.modal_entry is None:
@@ -231,8 +345,25 @@ class LyraToolApp:
                     imgui.close_current_popup()
                     self.modal_entry = None
 
+    def _needs_frame(self) -> bool:
+        if self.window.events > 0 or self.settle_frames > 0:
+            return True
+        if len(self.modal_queue) > 0 or self.file_job is not None:
+            return True
+        return self.editor.needs_redraw()
+
+    # Blocks until the next frame is due, if the app is idle
+    def wait(self) -> None:
+        if self.idle_mode and not self._needs_frame():
+            self.window.wait_events(self.IDLE_TIMEOUT)
+
     def update(self) -> None:
         self.window.update()
+        if self.window.take_events() > 0:
+            self.settle_frames = self.SETTLE_FRAMES
+        elif self.settle_frames > 0:
+            self.settle_frames -= 1
+
         ui_scale: float = self.window.content_scale
         # NOTE: Font is loaded with twice the size
         self.io.font_global_scale = ui_scale / self.font_mult
@@ -244,6 +375,7 @@ class LyraToolApp:
         with imgui.font(self.font):
             self._menu_bar()
             self._handle_modal()
+            self._handle_file_job()
             self.editor.update_ui()
 
     def draw(self) -> None:
@@ -259,18 +391,30 @@ class LyraToolApp:
 
 def main():
     log.info('Initializing Lyra Tool, v' + __version__)
-    app = LyraToolApp()
+    timeline = StartupTimeline(LAUNCH_TIME)
+    timeline.mark('imports')
+    app = LyraToolApp(timeline)
 
     log.info('Beginning main loop')
     while not app.should_close():
+        app.wait()
         app.update()
         app.draw()
+        if timeline is not None:
+            timeline.mark('first frame')
+            timeline.log()
+            timeline = None
 
     log.info('Shutting down')
     app.shutdown()
 
 
 if __name__ == '__main__':
+    # Setup logging. Only here, as the export's worker processes import this
+    # module as well and would truncate the log otherwise.
+    log.basicConfig(filename='lyra-tool.log', filemode='w',
+                    format='%(asctime)s |%(levelname)s| (%(name)s) %(message)s',
+                    level=log.INFO)
     try:
         main()
     except Exception as e:
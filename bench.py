@@ -0,0 +1,134 @@
+import argparse
+import math
+import timeit
+import numpy as np
+from typing import Callable
+from vector import *
+
+
+# Best time of repeat runs of number calls, in seconds per call
+def measure(fn: Callable, number: int, repeat: int = 5) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def report(name: str, seconds: float, baseline: float = None) -> None:
+    line: str = f'{name:<40} {seconds * 1e6:12.3f} us'
+    if baseline is not None:
+        line += f' {baseline / seconds:8.1f}x'
+    print(line)
+
+
+# Single-point math: Vec2 against Point2
+def bench_vec2(number: int) -> None:
+    a, b = Vec2(3.0, 4.0), Vec2(1.5, -2.0)
+    p, q = Point2(3.0, 4.0), Point2(1.5, -2.0)
+    cases = [
+        ('construct', lambda: Vec2(3.0, 4.0), lambda: Point2(3.0, 4.0)),
+        ('add', lambda: a + b, lambda: p + q),
+        ('scale', lambda: a * 2.5, lambda: p * 2.5),
+        ('length', lambda: a.length, lambda: p.length),
+        ('normalized', lambda: a.normalized(), lambda: p.normalized()),
+        ('atan2', lambda: a.atan2(), lambda: p.atan2()),
+        ('x + y', lambda: a.x + a.y, lambda: p.x + p.y),
+    ]
+    for name, slow, fast in cases:
+        baseline: float = measure(slow, number)
+        report(f'Vec2.{name}', baseline)
+        report(f'Point2.{name}', measure(fast, number), baseline)
+
+
+# Batch math: a list of Vec2 against one Vec2Array
+def bench_vec2_array(count: int) -> None:
+    rng = np.random.default_rng(1)
+    points = rng.uniform(-1.0, 1.0, (count, 2))
+    vectors = [Vec2(x, y) for x, y in points]
+    array = Vec2Array(points)
+    offset = Vec2(0.5, 0.25)
+    cases = [
+        ('add', lambda: [v + offset for v in vectors], lambda: array + offset),
+        ('length', lambda: [v.length for v in vectors], lambda: array.length),
+        ('normalized', lambda: [v.normalized() for v in vectors],
+         lambda: array.normalized()),
+        ('atan2', lambda: [v.atan2() for v in vectors], lambda: array.atan2()),
+    ]
+    for name, slow, fast in cases:
+        baseline: float = measure(slow, 1, 3)
+        report(f'{count} x Vec2.{name}', baseline)
+        report(f'Vec2Array({count}).{name}', measure(fast, 10, 3), baseline)
+
+
+# Affine transforms: a Vec2 at a time against whole arrays
+def bench_transform(count: int) -> None:
+    rng = np.random.default_rng(1)
+    points = rng.uniform(-1e-4, 1e-4, (count, 2))
+    vectors = [Vec2(x, y) for x, y in points[:10000]]
+    m = Matrix3x3.translation(-1e-4, -1e-4) \
+        .then(Matrix3x3.scaling(1e7, -1e7)) \
+        .then(Matrix3x3.translation(0, 1080))
+    out = np.empty_like(points)
+
+    baseline: float = measure(lambda: [m.dot_vec2(v) for v in vectors], 1, 3)
+    report('10000 x Matrix3x3.dot_vec2', baseline)
+    report('Matrix3x3.apply(10000)',
+           measure(lambda: m.apply(points[:10000]), 100), baseline)
+    report(f'Matrix3x3.apply({count})', measure(lambda: m.apply(points, out), 10))
+    report(f'Matrix3x3.apply_inverse({count})',
+           measure(lambda: m.apply_inverse(points, out), 10))
+    report('Matrix3x3.apply_point', measure(lambda: m.apply_point(1.0, 2.0), 20000))
+
+
+# Box tests: a Rect at a time against RectArray
+def bench_rects(count: int) -> None:
+    rng = np.random.default_rng(1)
+    centers = rng.uniform(0.0, 1.0, (count, 2))
+    half_dims = rng.uniform(0.0, 0.5 / math.sqrt(count), (count, 2))
+    boxes = RectArray(centers, half_dims)
+    rects = [boxes[i] for i in range(min(count, 10000))]
+    query = Rect()
+    query.center = Vec2(0.5, 0.5)
+    query.half_dims = Vec2(0.1, 0.1)
+
+    baseline: float = measure(
+        lambda: [r.overlaps_rect(query) for r in rects], 1, 3)
+    report(f'{len(rects)} x Rect.overlaps_rect', baseline)
+    report(f'RectArray({len(rects)}).overlaps_rect', measure(
+        lambda: boxes[0:len(rects)].overlaps_rect(0.4, 0.4, 0.6, 0.6), 100),
+        baseline)
+    report(f'RectArray({count}).overlaps_rect',
+           measure(lambda: boxes.overlaps_rect(0.4, 0.4, 0.6, 0.6), 10))
+    report(f'RectArray({count}).contains_points',
+           measure(lambda: boxes.contains_points(centers), 10))
+    report(f'RectArray({count}).union', measure(boxes.union, 10))
+    report(f'RectArray({count}).overlapping_pairs',
+           measure(boxes.overlapping_pairs, 1, 1))
+
+
+BENCHMARKS: dict[str, Callable[[argparse.Namespace], None]] = {
+    'vec2': lambda args: bench_vec2(args.number),
+    'vec2_array': lambda args: bench_vec2_array(args.count),
+    'transform': lambda args: bench_transform(args.count * 10),
+    'rects': lambda args: bench_rects(args.count * 10),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks')
+    parser.add_argument('names', nargs='*',
+                        help='benchmarks to run, all if none are given: '
+                             + ', '.join(BENCHMARKS))
+    parser.add_argument('--number', type=int, default=20000,
+                        help='calls per single-point measurement')
+    parser.add_argument('--count', type=int, default=100000,
+                        help='points per batch measurement')
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark: {name}')
+
+    for name in args.names or BENCHMARKS:
+        print(f'-- {name}')
+        BENCHMARKS[name](args)
+
+
+if __name__ == '__main__':
+    main()
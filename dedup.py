@@ -0,0 +1,161 @@
+import numpy as np
+from typing import Callable
+from geometry import ShapeGeometry
+from project import *
+from vector import RectArray
+
+
+# Pairs of rows (i, j), i < j, of shapes of the same type and depth whose
+# geometry matches within the tolerances, and whether every value of the pair
+# is exactly equal
+class Duplicates:
+    def __init__(self, pairs: np.ndarray, exact: np.ndarray) -> None:
+        self.pairs: np.ndarray = pairs
+        self.exact: np.ndarray = exact
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    # Sorted rows that duplicate a shape drawn before them, exactly or not.
+    # Removing them keeps the first shape of every group of duplicates.
+    def removable(self, exact_only: bool = False) -> np.ndarray:
+        pairs = self.pairs[self.exact] if exact_only else self.pairs
+        return np.unique(pairs[:, 1])
+
+    # Sorted rows of every shape that has a duplicate
+    def rows(self) -> np.ndarray:
+        return np.unique(self.pairs)
+
+
+# Values compared per shape family, as (N,K) arrays; lengths in meters
+def _point_values(shapes: list[ShapeObject]) -> np.ndarray:
+    return np.array([s.center[0:2] for s in shapes], dtype=np.float64)
+
+
+def _cross_values(shapes: list[ShapeObject]) -> np.ndarray:
+    return np.array([(s.center[0], s.center[1], s.width) for s in shapes],
+                    dtype=np.float64)
+
+
+def _line_values(shapes: list[ShapeObject]) -> np.ndarray:
+    return np.array([(s.begin[0], s.begin[1], s.end[0], s.end[1])
+                     for s in shapes], dtype=np.float64)
+
+
+def _rect_values(shapes: list[ShapeObject]) -> np.ndarray:
+    return np.array([(s.center[0], s.center[1], s.dimensions[0],
+                      s.dimensions[1], s.angle) for s in shapes],
+                    dtype=np.float64)
+
+
+def _circle_values(shapes: list[ShapeObject]) -> np.ndarray:
+    return np.array([(s.center[0], s.center[1], s.radius) for s in shapes],
+                    dtype=np.float64)
+
+
+def _annulus_values(shapes: list[ShapeObject]) -> np.ndarray:
+    return np.array([(s.center[0], s.center[1], s.radius, s.inner_radius)
+                     for s in shapes], dtype=np.float64)
+
+
+def _instance_values(shapes: list[ShapeObject]) -> np.ndarray:
+    return np.array([(s.center[0], s.center[1], s.angle) for s in shapes],
+                    dtype=np.float64)
+
+
+def _values_of(typ: type) -> Callable[[list[ShapeObject]], np.ndarray]:
+    if issubclass(typ, InstanceShape):
+        return _instance_values
+    if issubclass(typ, CrossShape):
+        return _cross_values
+    if issubclass(typ, PointShape):
+        return _point_values
+    if issubclass(typ, LineShape):
+        return _line_values
+    if issubclass(typ, RectangleShape):
+        return _rect_values
+    if issubclass(typ, AnnulusShape):
+        return _annulus_values
+    if issubclass(typ, CircleShape):
+        return _circle_values
+    raise TypeError(f'unknown ShapeObject subclass: {typ}')
+
+
+# Finds the shapes that repeat an earlier shape of the same type and depth,
+# with every coordinate and size within tolerance meters and rectangle
+# angles within angle_tolerance degrees (modulo 180). Lines match in either
+# direction, and instances of the same group match by their placement.
+# shapes are the shapes at the rows of the geometry. Candidates are the
+# shapes whose bounds centers lie within the tolerance of each other, found
+# with one sweep per type, so the cost grows with the number of shapes and
+# not with the number of pairs of them.
+def find_duplicates(shapes: list[ShapeObject], geometry: ShapeGeometry,
+                    tolerance: float = 0.0,
+                    angle_tolerance: float = 0.0) -> Duplicates:
+    by_type: dict[tuple[type, ShapeGroup], list[int]] = {}
+    for row, shape in enumerate(shapes):
+        key = (type(shape), getattr(shape, 'group', None))
+        by_type.setdefault(key, []).append(row)
+
+    pairs: list[np.ndarray] = [np.zeros((0, 2), dtype=np.int64)]
+    exact: list[np.ndarray] = [np.zeros(0, dtype=bool)]
+    for (typ, _), rows in by_type.items():
+        rows = np.array(rows, dtype=np.int64)
+        centers = geometry.centers[rows]
+        candidates = RectArray(centers, np.full_like(centers, tolerance * 0.5)) \
+            .overlapping_pairs()
+        if len(candidates) == 0:
+            continue
+        candidates = candidates[geometry.depths[rows[candidates[:, 0]]] ==
+                                geometry.depths[rows[candidates[:, 1]]]]
+
+        if len(candidates) == 0:
+            continue
+
+        # Only the shapes of candidate pairs are read
+        involved = np.unique(candidates)
+        values = _values_of(typ)([shapes[r] for r in rows[involved].tolist()])
+        a = values[np.searchsorted(involved, candidates[:, 0])]
+        b = values[np.searchsorted(involved, candidates[:, 1])]
+        same, equal = _compare(typ, a, b, tolerance, angle_tolerance)
+
+        found = rows[candidates[same]]
+        found.sort(axis=1)
+        pairs.append(found)
+        exact.append(equal[same])
+
+    found = np.concatenate(pairs)
+    equal = np.concatenate(exact)
+    order = np.lexsort((found[:, 1], found[:, 0]))
+    return Duplicates(found[order], equal[order])
+
+
+# Masks of the pairs of value rows that match within the tolerances, and
+# that match exactly
+def _compare(typ: type, a: np.ndarray, b: np.ndarray, tolerance: float,
+             angle_tolerance: float) -> tuple[np.ndarray, np.ndarray]:
+    if issubclass(typ, LineShape):
+        reversed_b = b[:, [2, 3, 0, 1]]
+        forward = np.abs(a - b)
+        backward = np.abs(a - reversed_b)
+        same = (forward <= tolerance).all(axis=1) | \
+            (backward <= tolerance).all(axis=1)
+        equal = (forward == 0.0).all(axis=1) | (backward == 0.0).all(axis=1)
+        return same, equal
+
+    diff = np.abs(a - b)
+    if issubclass(typ, InstanceShape):
+        angles = diff[:, 2] % 360.0
+        angles = np.minimum(angles, 360.0 - angles)
+        same = (diff[:, 0:2] <= tolerance).all(axis=1) & \
+            (angles <= angle_tolerance)
+        equal = (diff[:, 0:2] == 0.0).all(axis=1) & (angles == 0.0)
+        return same, equal
+    if issubclass(typ, RectangleShape):
+        angles = diff[:, 4] % 180.0
+        angles = np.minimum(angles, 180.0 - angles)
+        same = (diff[:, 0:4] <= tolerance).all(axis=1) & \
+            (angles <= angle_tolerance)
+        equal = (diff[:, 0:4] == 0.0).all(axis=1) & (angles == 0.0)
+        return same, equal
+    return (diff <= tolerance).all(axis=1), (diff == 0.0).all(axis=1)
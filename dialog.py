@@ -1,26 +1,36 @@
-from tkinter import filedialog, Tk
 from pathlib import Path
-from io import IOBase
+from types import ModuleType
 import logging as log
 
 
-tk_root = Tk()
-tk_root.withdraw()
+# Hidden Tk root window of the dialogs. Tk is only loaded and started when
+# the first dialog is opened, as starting it slows down the app's startup.
+tk_root = None
 
 
-# Opens a file open dialog and returns either an open file handle for reading
+def _filedialog() -> ModuleType:
+    global tk_root
+    from tkinter import filedialog, Tk
+    if tk_root is None:
+        log.info('Starting Tk for the file dialogs')
+        tk_root = Tk()
+        tk_root.withdraw()
+    return filedialog
+
+
+# Opens a file open dialog and returns the chosen path of an existing file,
 # or None if the user cancelled the operation
-def file_open(extension: str = '.xml') -> IOBase | None:
+def file_open_path(extension: str = '.xml') -> Path | None:
     log.info('Popping a file open dialog')
-    file = filedialog.askopenfile(defaultextension=extension)
-    log.info('File open dialog returned:', file)
-    return file
+    name = _filedialog().askopenfilename(defaultextension=extension)
+    log.info(f'File open dialog returned: {name}')
+    return Path(name) if name else None
 
 
-# Opens a file save dialog and returns either an open file handle for writing
-# or None if the user cancelled the operation
-def file_save(extension: str = '.xml') -> IOBase | None:
+# Opens a file save dialog without creating the file and returns the chosen
+# path, or None if the user cancelled the operation
+def file_save_path(extension: str = '.xml') -> Path | None:
     log.info('Popping a file save dialog')
-    file = filedialog.asksaveasfile(defaultextension=extension)
-    log.info('File save dialog returned:', file)
-    return file
+    name = _filedialog().asksaveasfilename(defaultextension=extension)
+    log.info(f'File save dialog returned: {name}')
+    return Path(name) if name else None
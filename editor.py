@@ -1,9 +1,22 @@
 import imgui
 import math
-from vector import Vec2, Rect
+import weakref
+import logging as log
+import numpy as np
+from vector import Vec2, Point2, Rect, Matrix3x3
 from viewport import Viewport
-from copy import deepcopy
+from geometry import ShapeGeometry, points_in_polygon, shape_extent, \
+    instance_matrix, place_shape
+from search import ShapeFilter, ShapeSearch
+from sequence import BlockList
+from snap import SnapIndex, snap_points
+from validate import Validator, Diagnostics, ISSUE_TEXT, ERRORS
+from dedup import Duplicates, find_duplicates
+from partition import FieldGrid, Partition, partition, splittable
+from fracture import FractureCache, ScanParams, ScanPath, is_fracturable
+import patterns
 from enum import IntEnum, auto
+from typing import Callable, Iterator, NamedTuple
 from util import *
 from project import *
 
@@ -24,6 +37,189 @@ SHAPE_NAMES = {
 }
 SHAPE_TYPES = [k for k in SHAPE_NAMES]
 
+# Names of the selected shapes listed in the object context menu
+LIST_POPUP_NAMES = 16
+
+PATTERN_NAMES = ['Dot Grid', 'Line Grating', 'Concentric Rings',
+                 'Fresnel Zone Plate']
+RING_LAWS = ['linear', 'sqrt', 'geometric']
+
+# Distance in pixels within which dragged shapes snap to other shapes and
+# to the axes
+SNAP_PIXELS = 8.0
+
+# Scan paths are drawn for at most this many selected shapes and lines, and
+# with lines at least this many pixels apart
+MAX_SCAN_SHAPES = 64
+MAX_SCAN_LINES = 4000
+SCAN_LINE_PIXELS = 3.0
+
+# Most problems listed in the validation panel and marked in the viewport
+MAX_ISSUE_ROWS = 100
+MAX_ISSUE_MARKERS = 2000
+# Smallest write field size that can be entered, in meters
+MIN_FIELD_SIZE = 1e-6
+
+
+class SelectMode(IntEnum):
+    REPLACE = auto()
+    ADD = auto()
+    SUBTRACT = auto()
+
+
+# How the combined inspector applies an edit to every selected shape
+class EditMode(IntEnum):
+    SET = auto()
+    OFFSET = auto()
+    SCALE = auto()
+
+
+# Properties shown by the combined inspector: label, attribute, kind of value
+# ('vec2', 'float' or 'int'), the shape types that have it and whether the
+# value is a length in meters
+INSPECTOR_PROPERTIES = [
+    ('Center', 'center', 'vec2', (PointShape, CircleShape, RectangleShape,
+                                  InstanceShape), True),
+    ('Begin', 'begin', 'vec2', (LineShape,), True),
+    ('End', 'end', 'vec2', (LineShape,), True),
+    ('Width', 'width', 'float', (CrossShape,), True),
+    ('Radius', 'radius', 'float', (CircleShape,), True),
+    ('Inner Radius', 'inner_radius', 'float', (AnnulusShape,), True),
+    ('Dims', 'dimensions', 'vec2', (RectangleShape,), True),
+    ('Angle', 'angle', 'float', (RectangleShape, InstanceShape), False),
+    ('Depth', 'depth', 'int', (PointShape, LineShape, RectangleShape,
+                               CircleShape), False),
+]
+
+
+# Stacks the first two components of the given Vec2 attribute of every shape
+# into an (N,2) array
+def _gather_vec2(shapes: list[ShapeObject], prop: str) -> np.ndarray:
+    if len(shapes) == 0:
+        return np.zeros((0, 2), dtype=np.float64)
+    return np.array([getattr(s, prop) for s in shapes])[:, 0:2]
+
+
+# Writes an (N,2) array back into the given Vec2 attribute, in place
+def _scatter_vec2(shapes: list[ShapeObject], prop: str,
+                  values: np.ndarray) -> None:
+    # Columns as flat lists, which avoids allocating a list per row
+    for s, x, y in zip(shapes, values[:, 0].tolist(), values[:, 1].tolist()):
+        v: Vec2 = getattr(s, prop)
+        v[0] = x
+        v[1] = y
+
+
+# Reads a float or int attribute of every shape into an (N,) array
+def _gather_scalar(shapes: list[ShapeObject], prop: str) -> np.ndarray:
+    return np.array([getattr(s, prop) for s in shapes], dtype=np.float64)
+
+
+# Writes an (N,) array back into a float or int attribute of every shape
+def _scatter_scalar(shapes: list[ShapeObject], prop: str, values: np.ndarray,
+                    integer: bool = False) -> None:
+    if integer:
+        values = np.rint(values).astype(np.int64)
+    for s, v in zip(shapes, values.tolist()):
+        setattr(s, prop, v)
+
+
+# Moves the shapes by the given offset (in meters), either a single (2,)
+# offset for all shapes or one (N,2) row per shape
+def offset_shapes(shapes: list[ShapeObject], offsets: np.ndarray) -> None:
+    offsets = np.broadcast_to(offsets, (len(shapes), 2))
+    lines = np.array([isinstance(s, LineShape) for s in shapes], dtype=bool)
+    centered = [s for s in shapes if not isinstance(s, LineShape)]
+    segments = [s for s in shapes if isinstance(s, LineShape)]
+
+    _scatter_vec2(centered, 'center',
+                  _gather_vec2(centered, 'center') + offsets[~lines])
+    for prop in ('begin', 'end'):
+        _scatter_vec2(segments, prop,
+                      _gather_vec2(segments, prop) + offsets[lines])
+
+
+# Applies the affine transform to all of the shapes in one vectorized pass.
+# Radii and widths follow the area scale of the transform, as circles cannot
+# become ellipses; rectangles follow the transformed directions of their
+# sides, which is exact for any combination of rotation, uniform scale and
+# mirroring, and the closest rectangle otherwise. Instances of groups only
+# follow rotations and translations, see is_rigid(); other transforms leave
+# them untouched.
+def transform_shapes(shapes: list[ShapeObject], mat: Matrix3x3) -> None:
+    linear = np.asarray(mat)[0:2, 0:2]
+    factor: float = math.sqrt(abs(np.linalg.det(linear)))
+    if not is_rigid(mat):
+        shapes = [s for s in shapes if not isinstance(s, InstanceShape)]
+
+    centered = [s for s in shapes if not isinstance(s, LineShape)]
+    segments = [s for s in shapes if isinstance(s, LineShape)]
+
+    _scatter_vec2(centered, 'center',
+                  mat.apply(_gather_vec2(centered, 'center')))
+    for prop in ('begin', 'end'):
+        _scatter_vec2(segments, prop, mat.apply(_gather_vec2(segments, prop)))
+
+    if factor != 1.0:
+        for s in centered:
+            if isinstance(s, CrossShape):
+                s.width *= factor
+            if isinstance(s, CircleShape):
+                s.radius *= factor
+            if isinstance(s, AnnulusShape):
+                s.inner_radius *= factor
+
+    instances = [s for s in centered if isinstance(s, InstanceShape)]
+    if len(instances) > 0:
+        turn: float = math.degrees(math.atan2(linear[1, 0], linear[0, 0]))
+        for s in instances:
+            s.angle += turn
+
+    rects = [s for s in centered if isinstance(s, RectangleShape)]
+    if len(rects) == 0 or np.allclose(linear, np.eye(2)):
+        return
+
+    angles = np.radians([r.angle for r in rects])
+    dims = _gather_vec2(rects, 'dimensions')
+    cos_a = np.cos(angles)
+    sin_a = np.sin(angles)
+    u = np.stack([cos_a, sin_a], axis=1) @ linear.T
+    v = np.stack([-sin_a, cos_a], axis=1) @ linear.T
+
+    new_angles = np.degrees(np.arctan2(u[:, 1], u[:, 0]))
+    new_dims = dims * np.stack([np.hypot(u[:, 0], u[:, 1]),
+                                np.hypot(v[:, 0], v[:, 1])], axis=1)
+    for r, angle in zip(rects, new_angles.tolist()):
+        r.angle = angle
+    _scatter_vec2(rects, 'dimensions', new_dims)
+
+
+# Whether the transform is a rotation and translation only, without scaling
+# or mirroring
+def is_rigid(mat: Matrix3x3) -> bool:
+    linear = np.asarray(mat)[0:2, 0:2]
+    return bool(np.allclose(linear @ linear.T, np.eye(2)) and
+                np.linalg.det(linear) > 0.0)
+
+
+# Wraps a linear transform so that it keeps the given pivot point in place
+def about_pivot(mat: Matrix3x3, pivot: tuple[float, float]) -> Matrix3x3:
+    px, py = pivot
+    return Matrix3x3.translation(-px, -py).then(mat) \
+        .then(Matrix3x3.translation(px, py))
+
+
+# EditableShapes of the shapes of a group, shared by all of its instances
+_group_editables: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _group_shapes(group: ShapeGroup) -> list['EditableShape']:
+    editables = _group_editables.get(group)
+    if editables is None:
+        editables = [EditableShape(n, s) for n, s in group.objects.items()]
+        _group_editables[group] = editables
+    return editables
+
 
 class EditableShape:
     # Make clicking the shape easier by expanding the targeting area by a bit
@@ -33,9 +229,12 @@ class EditableShape:
         self.name: str = name
         self.shape: ShapeObject = shape
         self.selected: bool = False
+        self.hovered: bool = False
 
     def _bg_color(self) -> int:
         alpha = 0.33
+        if self.hovered:
+            alpha = 0.5
         if self.selected:
             return imgui.get_color_u32_rgba(1, 1, 0, alpha)
         else:
@@ -43,19 +242,16 @@ class EditableShape:
 
     def _fg_color(self) -> int:
         alpha = 1.0
-        if self.selected:
+        if self.selected and self.hovered:
+            return imgui.get_color_u32_rgba(1, 1, 0.6, alpha)
+        elif self.selected:
             return imgui.get_color_u32_rgba(1, 1, 0, alpha)
+        elif self.hovered:
+            return imgui.get_color_u32_rgba(1, 0.6, 0.6, alpha)
         else:
             return imgui.get_color_u32_rgba(1, 0, 0, alpha)
 
-    def _rotate_vec2(self, v: Vec2, angle: float) -> Vec2:
-        sin_theta: float = math.sin(math.radians(angle))
-        cos_theta: float = math.cos(math.radians(angle))
-        x: float = v.x * cos_theta - v.y * sin_theta
-        y: float = v.x * sin_theta + v.y * cos_theta
-        return Vec2(x, y)
-
-    def _annulus_intersect(self, p: Vec2, center: Vec2,
+    def _annulus_intersect(self, p: Point2, center: Point2,
                            radius: float, inner_radius: float):
         dist: float = math.floor((p - center).length)
         if dist > radius:
@@ -64,35 +260,40 @@ class EditableShape:
             return False
         return True
 
-    def _box_intersect(self, p: Vec2, center: Vec2, half_dims: Vec2,
-                       angle: float, inner_half_dims: Vec2 = Vec2()) -> bool:
-        v: Vec2 = self._rotate_vec2(p - center, angle) + center
-        rect: Rect = Rect()
-        rect.center = center
-        rect.half_dims = half_dims
+    def _box_intersect(self, p: Point2, center: Point2, half_dims: Point2,
+                       angle: float, inner_half_dims: Point2 = Point2()) -> bool:
+        v: Point2 = (p - center).rotated(angle).abs
 
-        if not rect.overlaps_point(v):
+        if v.x > half_dims.x or v.y > half_dims.y:
             return False
-        if (inner_half_dims > 0.0).all():
-            rect.half_dims = inner_half_dims
-            if rect.overlaps_point(v):
+        if inner_half_dims.x > 0.0 and inner_half_dims.y > 0.0:
+            if v.x <= inner_half_dims.x and v.y <= inner_half_dims.y:
                 return False
         return True
 
     # Checks whether the given screen point intersects with shape
     def intersect_screen(self, view: Viewport, point: Vec2) -> bool:
+        if isinstance(self.shape, InstanceShape):
+            # The point moved into the group space instead of the shapes
+            # out of it, which keeps the pixel sizes the same
+            local = instance_matrix(self.shape).inverse().apply_point(
+                *view.from_screen(point))
+            point = view.to_screen(local)
+            return any(s.intersect_screen(view, point)
+                       for s in _group_shapes(self.shape.group))
+
         if isinstance(self.shape, (PointShape, CircleShape)):
-            center: Vec2 = view.to_screen(self.shape.center)
+            center: Point2 = view.to_screen(self.shape.center)
             radius: float = 2.0  # Default for point shape
             inner_radius: float = 0.0
 
             if isinstance(self.shape, CrossShape):
                 x: CrossShape = self.shape
                 hw: float = x.width * view.pixels_per_meter * 0.5
-                half_dims: Vec2 = Vec2(hw, self.CLICK_BUMP)
+                half_dims: Point2 = Point2(hw, self.CLICK_BUMP)
                 if self._box_intersect(point, center, half_dims, 0):
                     return True
-                half_dims = Vec2(self.CLICK_BUMP, hw)
+                half_dims = Point2(self.CLICK_BUMP, hw)
                 if self._box_intersect(point, center, half_dims, 0):
                     return True
             if isinstance(self.shape, CircleShape):
@@ -111,23 +312,23 @@ class EditableShape:
 
         if isinstance(self.shape, LineShape):
             l: LineShape = self.shape
-            d: Vec2 = (l.end - l.begin)
+            d: Point2 = Point2(l.end) - l.begin
 
-            center: Vec2 = view.to_screen(l.begin + d * 0.5)
+            center: Point2 = view.to_screen(d * 0.5 + l.begin)
             angle: float = -math.degrees(d.atan2())
-            half_dims: Vec2 = Vec2(0, l.length) * view.pixels_per_meter
+            half_dims: Point2 = Point2(0, l.length * 0.5) * view.pixels_per_meter
             half_dims += self.CLICK_BUMP * 2.0
             return self._box_intersect(point, center, half_dims, angle)
 
         if isinstance(self.shape, RectangleShape):
             r: RectangleShape = self.shape
-            center: Vec2 = view.to_screen(r.center)
-            half_dims: Vec2 = r.dimensions * 0.5 * view.pixels_per_meter
-            inner_half_dims: Vec2 = Vec2(half_dims)
+            center: Point2 = view.to_screen(r.center)
+            half_dims: Point2 = Point2(r.dimensions) * (0.5 * view.pixels_per_meter)
+            inner_half_dims: Point2 = half_dims
             angle: float = r.angle
 
             if isinstance(self.shape, FilledRectangleShape):
-                inner_half_dims = Vec2()
+                inner_half_dims = Point2()
 
             half_dims += self.CLICK_BUMP
             inner_half_dims -= self.CLICK_BUMP
@@ -135,18 +336,8 @@ class EditableShape:
                                        angle, inner_half_dims)
         return False
 
-    def translate_screen(self, view: Viewport, diff: Vec2):
-        diff = Vec2(diff.x, -diff.y) * view.meters_per_pixel
-
-        if isinstance(self.shape, (PointShape, CircleShape, RectangleShape)):
-            self.shape.center += diff
-
-        if isinstance(self.shape, LineShape):
-            l: LineShape = self.shape
-            l.begin += diff
-            l.end += diff
-
-    def _inspect_vec2(self, shape: ShapeObject, prop: str, meters: bool = True):
+    def _inspect_vec2(self, shape: ShapeObject, prop: str,
+                      meters: bool = True) -> bool:
         value: Vec2 = getattr(shape, prop)
         if not isinstance(value, Vec2):
             raise TypeError(f'Inspected attribute {prop} was not a Vec2, was: {type(value)}')
@@ -163,8 +354,10 @@ class EditableShape:
                 x *= METER_SCALE
                 y *= METER_SCALE
             setattr(shape, prop, Vec2(x, y))
+        return changed
 
-    def _inspect_float(self, shape: ShapeObject, prop: str, meters: bool = True):
+    def _inspect_float(self, shape: ShapeObject, prop: str,
+                       meters: bool = True) -> bool:
         value: float = getattr(shape, prop)
         if not isinstance(value, float):
             raise TypeError(f'Inspected attribute {prop} was not a float, was: {type(value)}')
@@ -178,59 +371,71 @@ class EditableShape:
             if meters:
                 value *= METER_SCALE
             setattr(shape, prop, value)
+        return changed
+
+    # Draws the inspector widgets, returns True if the shape was edited
+    def ui_inspect(self) -> bool:
+        edited: bool = False
 
-    def ui_inspect(self) -> None:
-        if isinstance(self.shape, (PointShape, CircleShape, RectangleShape)):
+        if isinstance(self.shape, InstanceShape):
+            group: ShapeGroup = self.shape.group
+            imgui.text_disabled(f'{group.name}, {len(group.objects)} shapes')
+
+        if isinstance(self.shape, (PointShape, CircleShape, RectangleShape,
+                                   InstanceShape)):
             imgui.text('Center:')
             imgui.same_line()
-            self._inspect_vec2(self.shape, 'center')
+            edited |= self._inspect_vec2(self.shape, 'center')
 
         if isinstance(self.shape, CrossShape):
             x: CrossShape = self.shape
             imgui.text('Width:')
             imgui.same_line()
-            self._inspect_float(x, 'width')
+            edited |= self._inspect_float(x, 'width')
 
         if isinstance(self.shape, LineShape):
             l: LineShape = self.shape
 
             imgui.text('Begin:')
             imgui.same_line()
-            self._inspect_vec2(l, 'begin')
+            edited |= self._inspect_vec2(l, 'begin')
 
             imgui.text('End:')
             imgui.same_line()
-            self._inspect_vec2(l, 'end')
+            edited |= self._inspect_vec2(l, 'end')
 
         if isinstance(self.shape, CircleShape):
             c: CircleShape = self.shape
             imgui.text('Radius:')
             imgui.same_line()
-            self._inspect_float(c, 'radius')
+            edited |= self._inspect_float(c, 'radius')
 
         if isinstance(self.shape, AnnulusShape):
             a: AnnulusShape = self.shape
             imgui.text('Inner Radius:')
             imgui.same_line()
-            self._inspect_float(a, 'inner_radius')
+            edited |= self._inspect_float(a, 'inner_radius')
 
         if isinstance(self.shape, RectangleShape):
             r: RectangleShape = self.shape
 
             imgui.text('Dims:')
             imgui.same_line()
-            self._inspect_vec2(r, 'dimensions')
+            edited |= self._inspect_vec2(r, 'dimensions')
 
+        if isinstance(self.shape, (RectangleShape, InstanceShape)):
             imgui.text('Angle:')
             imgui.same_line()
-            angle: float = r.angle
+            angle: float = self.shape.angle
             changed, angle = imgui.slider_float('degrees ##angle', angle, -360, 360,
                                                 format='%.01f')
             if changed:
                 # TODO: undo stack
-                r.angle = angle
+                self.shape.angle = angle
+                edited = True
 
-        if isinstance(self.shape, ShapeObject):
+        # The shapes of a group keep their own depths
+        if not isinstance(self.shape, InstanceShape):
             imgui.text('Depth:')
             imgui.same_line()
             depth: int = self.shape.depth
@@ -238,8 +443,19 @@ class EditableShape:
             if changed:
                 # TODO: undo stack
                 self.shape.depth = depth
+                edited = True
+
+        return edited
 
     def draw(self, view: Viewport) -> None:
+        if isinstance(self.shape, InstanceShape):
+            with view.transformed(instance_matrix(self.shape)):
+                for s in _group_shapes(self.shape.group):
+                    s.selected = self.selected
+                    s.hovered = self.hovered
+                    s.draw(view)
+            return
+
         typ = type(self.shape)
         bg_color: int = self._bg_color()
         fg_color: int = self._fg_color()
@@ -251,12 +467,13 @@ class EditableShape:
             view.draw_circle(p.center, radius, fg_color, True)
         if isinstance(self.shape, CrossShape):
             x: CrossShape = self.shape
+            center: Point2 = Point2(x.center)
             half_width = x.width * 0.5
-            view.draw_line(x.center - Vec2(half_width, 0),
-                            x.center + Vec2(half_width, 0),
+            view.draw_line(center - Point2(half_width, 0),
+                            center + Point2(half_width, 0),
                             fg_color, thickness)
-            view.draw_line(x.center - Vec2(0, half_width),
-                            x.center + Vec2(0, half_width),
+            view.draw_line(center - Point2(0, half_width),
+                            center + Point2(0, half_width),
                             fg_color, thickness)
         if isinstance(self.shape, LineShape):
             l: LineShape = self.shape
@@ -271,12 +488,8 @@ class EditableShape:
             if is_donut:
                 a: AnnulusShape = self.shape
 
-                # TODO: avoid kinda weird hack to draw background
-                r_diff = a.radius - a.inner_radius
-                mid_r = a.inner_radius + r_diff * 0.5
-                t = r_diff * view.pixels_per_meter
-                view.draw_circle(c.center, mid_r, bg_color, False, t)
-
+                view.draw_annulus(c.center, a.radius, a.inner_radius,
+                                  bg_color)
                 view.draw_circle(c.center, a.inner_radius, fg_color, False,
                                      thickness)
             view.draw_circle(c.center, c.radius, fg_color, False,
@@ -285,23 +498,85 @@ class EditableShape:
             r: RectangleShape = self.shape
             is_filled: bool = isinstance(self.shape, FilledRectangleShape)
 
-            half_dims: Vec2 = r.dimensions * 0.5
+            center: Point2 = Point2(r.center)
+            half_dims: Point2 = Point2(r.dimensions) * 0.5
             angle: float = r.angle
 
-            right: Vec2 = self._rotate_vec2(Vec2(half_dims.x, 0), angle)
-            up: Vec2 = self._rotate_vec2(Vec2(0, half_dims.y), angle)
+            right: Point2 = Point2(half_dims.x, 0).rotated(angle)
+            up: Point2 = Point2(0, half_dims.y).rotated(angle)
 
             points = [
-                r.center - up - right,
-                r.center + up - right,
-                r.center + up + right,
-                r.center - up + right,
+                center - up - right,
+                center + up - right,
+                center + up + right,
+                center - up + right,
             ]
             if is_filled:
                 view.draw_quad(points, bg_color, True)
             view.draw_quad(points, fg_color, False, thickness)
 
 
+# The shapes of a project in drawing order, as EditableShapes. The order is
+# the project's own BlockList of names, so reordering here is what gets saved.
+class ShapeList:
+    def __init__(self, project: Project = None) -> None:
+        self.order: BlockList = BlockList()
+        self.editables: dict[str, EditableShape] = {}
+        if project is not None:
+            self.order = project.order
+            for n, s in project.ordered_objects():
+                self.editables[n] = EditableShape(n, s)
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __iter__(self) -> Iterator[EditableShape]:
+        editables = self.editables
+        return (editables[n] for n in self.order)
+
+    def __getitem__(self, index: int | slice) -> EditableShape:
+        if isinstance(index, slice):
+            return [self.editables[n] for n in self.order[index]]
+        return self.editables[self.order[index]]
+
+    def index(self, shape: EditableShape) -> int:
+        return self.order.index(shape.name)
+
+    # The shapes at many rows, faster than indexing them one at a time when
+    # the rows cover a good part of the list
+    def take(self, rows) -> list[EditableShape]:
+        editables = self.editables
+        if len(rows) * 16 < len(self.order):
+            order = self.order
+            return [editables[order[i]] for i in rows]
+        names: list[str] = list(self.order)
+        return [editables[names[i]] for i in rows]
+
+    # Tracks shapes whose names were already added to the project's order
+    def add(self, shapes: list[EditableShape]) -> None:
+        self.editables.update((s.name, s) for s in shapes)
+
+    # Forgets shapes whose names were removed from the project's order
+    def discard(self, shapes: list[EditableShape]) -> None:
+        for s in shapes:
+            self.editables.pop(s.name, None)
+
+
+# What set_project() needs of a project that does not touch the editor, so
+# it can be made on another thread while the editor keeps running: the
+# EditableShapes of the project and their bounds
+class PreparedProject(NamedTuple):
+    shapes: ShapeList
+    extents: np.ndarray
+
+
+def prepare_project(proj: Project) -> PreparedProject:
+    shapes = ShapeList(proj)
+    extents = np.array([shape_extent(s.shape) for s in shapes],
+                       dtype=np.float64).reshape(-1, 4)
+    return PreparedProject(shapes, extents)
+
+
 class Interface:
     def __init__(self) -> None:
         self.frame_number: int = 0
@@ -310,22 +585,194 @@ class Interface:
         self.show_grid: bool = True
         self.viewport: Viewport = Viewport()
         self.project: Project = None
-        self.shapes: list[EditableShape] = []
+        self.shapes: ShapeList = ShapeList()
         self.selected: set[EditableShape] = set()
         self.is_dragging: bool = False
         self.is_dragging_selection: bool = False
         self.was_dragging: bool = False
         self.add_shape_type: int = 0
 
+        # World-space bounds of self.shapes, rebuilt lazily when dirty
+        self.geometry: ShapeGeometry = ShapeGeometry()
+        self.geometry_dirty: bool = True
+        self.selection_version: int = 0
+        self.selection_mask: np.ndarray = None
+
+        # Set whenever something changed that needs another frame to show
+        self.dirty: bool = True
+
+        # Shape under the mouse cursor, only re-picked when the view, the
+        # shapes or the mouse position changed
+        self.hovered: EditableShape = None
+        self.hover_key: tuple = None
+
+        # Parameters of the selection transform tools
+        self.xform_offset: tuple[float, float] = (0.0, 0.0)  # in meters
+        self.xform_angle: float = 90.0
+        self.xform_scale: tuple[float, float] = (1.0, 1.0)
+        self.xform_uniform: bool = True
+        self.xform_about_origin: bool = False
+
+        # Box (or lasso) selection in progress, as world-space points
+        self.band_points: list[Vec2] = None
+        self.band_lasso: bool = False
+        self.band_mode: SelectMode = SelectMode.REPLACE
+
+        # Snapping of the dragged selection to the snap points of the other
+        # shapes, the axes and the minor grid lines. The anchor is the snap
+        # point of the grabbed shape nearest to the mouse, as snapped, and
+        # the target is where it would be without snapping.
+        self.snap: SnapIndex = SnapIndex()
+        self.snap_shapes: bool = True
+        self.snap_axes: bool = True
+        self.snap_grid: bool = False
+        self.snap_anchor: np.ndarray = None
+        self.snap_target: np.ndarray = None
+        self.snap_hit: bool = False
+
+        # Pattern generator parameters, lengths in meters
+        self.pattern_type: int = 0
+        self.pattern_params: dict[str, float | int] = {
+            'columns': 10, 'rows': 10, 'pitch_x': 1e-6, 'pitch_y': 1e-6,
+            'radius': 0.0, 'angle': 0.0, 'count': 10, 'pitch': 1e-6,
+            'length': 1e-5, 'first': 1e-6, 'step': 1e-6, 'law': 0,
+            'width': 5e-7, 'wavelength': 5e-7, 'focal_length': 1e-3,
+            'zones': 20,
+        }
+
+        # Checks of the shapes before writing, re-run on changed shapes only
+        # once the user asked for them. The write field is centered on the
+        # origin, its size in meters.
+        self.validator: Validator = Validator()
+        self.validation: Diagnostics = None
+        self.field_enabled: bool = True
+        self.field_size: tuple[float, float] = (1e-4, 1e-4)
+        self.field_serpentine: bool = True
+
+        # Duplicate shapes found with the given tolerances (meters and
+        # degrees), dropped once the geometry changes
+        self.dedup_tolerance: float = 1e-9
+        self.dedup_angle: float = 0.01
+        self.duplicates: Duplicates = None
+        self.duplicates_version: int = -1
+
+        # Scan paths of the selected filled shapes, drawn over the viewport
+        self.fractures: FractureCache = FractureCache()
+        self.show_scan_paths: bool = False
+
+        # Object list rows that must be submitted even when scrolled out of
+        # view, so an open context menu or a drag in progress stays alive
+        self.list_popup: EditableShape = None
+        self.list_drag: EditableShape = None
+
+        # Object list filter, and the values of its optional criteria that
+        # are kept while those are switched off (sizes and region in meters)
+        self.filter: ShapeFilter = ShapeFilter()
+        self.search: ShapeSearch = ShapeSearch()
+        self.filter_depth: tuple[int, int] = (1, 20)
+        self.filter_size: tuple[float, float] = (0.0, 1e-5)
+        self.filter_region: tuple[float, float, float, float] = \
+            (-1e-4, -1e-4, 1e-4, 1e-4)
+
+        # Combined inspector for multiple selected shapes: how edits apply,
+        # the offset or scale operand of every property, and the values of
+        # the selected shapes per property, re-read only after changes
+        self.edit_mode: EditMode = EditMode.SET
+        self.edit_operands: dict[tuple[str, EditMode], tuple] = {}
+        self.edit_values_key: tuple = None
+        self.edit_values: dict[str, tuple[list[EditableShape], np.ndarray]] = {}
+
+    # Must be called whenever shapes are added, removed or reordered. Bulk
+    # operations that already updated self.geometry pass rebuild=False.
+    def _shapes_changed(self, rebuild: bool = True) -> None:
+        if rebuild:
+            self.geometry_dirty = True
+        self.selection_mask = None
+        self.dirty = True
+        self._set_hovered(None)
+
+    # Must be called whenever the geometry of existing shapes is edited
+    def _shapes_edited(self, shapes: list[EditableShape]) -> None:
+        if len(shapes) == 0:
+            return
+        if not self.geometry_dirty:
+            self.geometry.refresh([s.shape for s in shapes])
+            rows = [self.geometry.row(s.shape) for s in shapes]
+            self.snap.mark_stale(rows)
+            self.validator.mark_dirty(rows)
+        self.fractures.mark_stale([s.shape for s in shapes])
+        self.dirty = True
+
+    def _selection_changed(self) -> None:
+        self.selection_version += 1
+        self.selection_mask = None
+        self.dirty = True
+
+    def _update_geometry(self) -> None:
+        if self.geometry_dirty:
+            self.geometry.rebuild([s.shape for s in self.shapes])
+            self.geometry_dirty = False
+
+        if self.selection_mask is None:
+            mask = np.zeros(len(self.shapes), dtype=bool)
+            rows = [self.geometry.row(s.shape) for s in self.selected]
+            mask[rows] = True
+            self.selection_mask = mask
+
+    # Shapes under the given screen point, topmost (last drawn) first. Only
+    # the shapes found near the point by the spatial index are tested.
+    def _shapes_at(self, point: Vec2) -> list[EditableShape]:
+        self._update_geometry()
+        v: Viewport = self.viewport
+        p: Vec2 = v.from_screen(point)
+
+        # Covers the widest hit area of intersect_screen: the corners of the
+        # box around a diagonal line reach 2 * sqrt(2) bumps past its ends
+        bump: float = (EditableShape.CLICK_BUMP * 3.0 + 2.0) * v.meters_per_pixel
+        rows = self.geometry.query(p.x - bump, p.y - bump,
+                                   p.x + bump, p.y + bump)
+
+        hits: list[EditableShape] = []
+        for i in rows[::-1]:
+            s: EditableShape = self.shapes[i]
+            if s.intersect_screen(v, point):
+                hits.append(s)
+        return hits
+
+    def _set_hovered(self, shape: EditableShape) -> None:
+        if shape is self.hovered:
+            return
+        if self.hovered is not None:
+            self.hovered.hovered = False
+        if shape is not None:
+            shape.hovered = True
+        self.hovered = shape
+        self.hover_key = None
+        self.dirty = True
+
+    def _update_hover(self, pos: Vec2) -> None:
+        v: Viewport = self.viewport
+        key = (float(pos.x), float(pos.y), self.geometry.version,
+               self.geometry_dirty, v.zoom, float(v.offset[0]),
+               float(v.offset[1]))
+        if key == self.hover_key:
+            return
+
+        hits = self._shapes_at(pos)
+        self._set_hovered(hits[0] if len(hits) > 0 else None)
+        self.hover_key = key
+
     def _unselect_shape(self, shape: EditableShape) -> None:
         shape.selected = False
         if shape in self.selected:
             self.selected.remove(shape)
+            self._selection_changed()
 
     def _unselect_all(self) -> None:
         for shape in self.selected:
             shape.selected = False
         self.selected.clear()
+        self._selection_changed()
 
     def _select_shape(self, shape: EditableShape, add: bool = False):
         if not add:
@@ -333,42 +780,641 @@ class Interface:
         if shape is not None:
             self.selected.add(shape)
             shape.selected = True
+            self._selection_changed()
+
+    # Selects the shapes at the given rows in one go, keeping the selection
+    # mask up to date without rebuilding it from the selected set
+    def _select_rows(self, rows: np.ndarray, mode: SelectMode) -> None:
+        self._update_geometry()
+        mask: np.ndarray = self.selection_mask
+        shapes = self.shapes.take(rows)
+
+        if mode == SelectMode.REPLACE:
+            self._unselect_all()
+            mask = np.zeros(len(self.shapes), dtype=bool)
+
+        if mode == SelectMode.SUBTRACT:
+            for s in shapes:
+                s.selected = False
+            self.selected.difference_update(shapes)
+            mask[rows] = False
+        else:
+            for s in shapes:
+                s.selected = True
+            self.selected.update(shapes)
+            mask[rows] = True
+
+        self._selection_changed()
+        self.selection_mask = mask
 
     def _add_shape(self, shape: ShapeObject) -> EditableShape:
         # TODO: undo stack
         name = self.project.add_new_shape(shape)
         editable = EditableShape(name, shape)
-        self.shapes.append(editable)
+        self.shapes.add([editable])
+        if not self.geometry_dirty:
+            self.geometry.append([shape])
+        self._shapes_changed(rebuild=False)
         return editable
 
     def _move_shape(self, from_index: int, to_index: int) -> None:
         # TODO: undo stack
-        shape = self.shapes.pop(from_index)
-        self.shapes.insert(to_index, shape)
+        self.project.move_shape(from_index, to_index)
+        if not self.geometry_dirty:
+            lo: int = min(from_index, to_index)
+            hi: int = max(from_index, to_index) + 1
+            self.geometry.move(from_index, to_index,
+                               [s.shape for s in self.shapes[lo:hi]])
+        self._shapes_changed(rebuild=False)
 
     def _remove_shape(self, index: int) -> None:
         # TODO: undo stack
-        shape = self.shapes.pop(index)
+        shape = self.shapes[index]
         if shape in self.selected:
-            self.selected.remove(shape)
+            self._unselect_shape(shape)
         self.project.remove_shape(shape.name)
+        self.shapes.discard([shape])
+        self._shapes_changed()
+
+    # Removes the shapes at the given rows in one pass over the shape list,
+    # instead of one list deletion per shape
+    def _remove_rows(self, rows: np.ndarray) -> None:
+        # TODO: undo stack
+        if len(rows) == 0:
+            return
+        self._update_geometry()
+        mask: np.ndarray = np.zeros(len(self.shapes), dtype=bool)
+        mask[rows] = True
+
+        removed = self.shapes.take(np.flatnonzero(mask))
+        for s in removed:
+            s.selected = False
+        self.selected.difference_update(removed)
+        self._selection_changed()
+
+        self.project.remove_shapes([s.name for s in removed])
+        self.shapes.discard(removed)
+        self.geometry.remove(mask, [s.shape for s in self.shapes])
+        self._shapes_changed(rebuild=False)
+
+    # Appends many shapes, named in one batch, and selects them. Their bounds
+    # can be passed in as rows of shape_extent() when already known.
+    def _add_shapes(self, shapes: list[ShapeObject],
+                    extents: np.ndarray = None) -> list[EditableShape]:
+        # TODO: undo stack
+        names = self.project.add_new_shapes(shapes)
+
+        added = [EditableShape(n, s) for n, s in zip(names, shapes)]
+        first: int = len(self.shapes) - len(added)
+        self.shapes.add(added)
+        if not self.geometry_dirty:
+            self.geometry.append(shapes, extents)
+        self._shapes_changed(rebuild=False)
+
+        self._select_rows(np.arange(first, len(self.shapes)), SelectMode.REPLACE)
+        return added
+
+    # Appends copies of the shapes at the given rows and selects the copies
+    def _duplicate_rows(self, rows: np.ndarray) -> list[EditableShape]:
+        dupes = [copy_shape(s.shape) for s in self.shapes.take(rows)]
+        return self._add_shapes(dupes)
+
+    # Generates the current pattern around the center of the view
+    def _generate_pattern(self) -> list[EditableShape]:
+        p = self.pattern_params
+        center = (float(self.viewport.offset[0]), float(self.viewport.offset[1]))
+        name: str = PATTERN_NAMES[self.pattern_type]
+
+        if name == 'Dot Grid':
+            pattern = patterns.dot_grid(p['columns'], p['rows'],
+                                        (p['pitch_x'], p['pitch_y']), center,
+                                        p['angle'], p['radius'])
+        elif name == 'Line Grating':
+            pattern = patterns.line_grating(p['count'], p['pitch'], p['length'],
+                                            center, p['angle'])
+        elif name == 'Concentric Rings':
+            radii = patterns.ring_radii(p['count'], p['first'], p['step'],
+                                        RING_LAWS[p['law']])
+            pattern = patterns.concentric_rings(radii, p['width'], center)
+        else:
+            pattern = patterns.fresnel_zone_plate(p['wavelength'],
+                                                  p['focal_length'],
+                                                  p['zones'], center)
+
+        with patterns.paused_gc():
+            return self._add_shapes(pattern.shapes, pattern.extents)
+
+    def _ui_patterns(self) -> None:
+        p = self.pattern_params
+
+        def _int(label: str, key: str, lowest: int = 1) -> None:
+            _, value = imgui.input_int(f'{label}##pattern_{key}', p[key])
+            p[key] = max(value, lowest)
+
+        def _float(label: str, key: str, unit: str = None) -> None:
+            scale: float = METER_INV_SCALE if unit is None else 1.0
+            unit = METER_SCALE_NAME if unit is None else unit
+            changed, value = imgui.input_float(
+                f'{unit} {label}##pattern_{key}', p[key] * scale, format='%.5f')
+            if changed:
+                p[key] = value / scale
+
+        with imgui.begin_combo('##pattern', PATTERN_NAMES[self.pattern_type]) \
+                as combo:
+            if combo.opened:
+                for i, name in enumerate(PATTERN_NAMES):
+                    if imgui.selectable(name, i == self.pattern_type)[0]:
+                        self.pattern_type = i
+
+        name: str = PATTERN_NAMES[self.pattern_type]
+        if name == 'Dot Grid':
+            _int('columns', 'columns')
+            _int('rows', 'rows')
+            _float('pitch x', 'pitch_x')
+            _float('pitch y', 'pitch_y')
+            _float('radius (0 for points)', 'radius')
+            _float('angle', 'angle', 'degrees')
+        elif name == 'Line Grating':
+            _int('lines', 'count')
+            _float('pitch', 'pitch')
+            _float('length', 'length')
+            _float('angle', 'angle', 'degrees')
+        elif name == 'Concentric Rings':
+            _int('rings', 'count')
+            with imgui.begin_combo('radius law##pattern_law',
+                                   RING_LAWS[p['law']]) as combo:
+                if combo.opened:
+                    for i, law in enumerate(RING_LAWS):
+                        if imgui.selectable(law, i == p['law'])[0]:
+                            p['law'] = i
+            _float('first radius', 'first')
+            if RING_LAWS[p['law']] == 'geometric':
+                _float('ratio', 'step', '')
+            else:
+                _float('step', 'step')
+            _float('width', 'width')
+        else:
+            _float('wavelength', 'wavelength')
+            _float('focal length', 'focal_length')
+            _int('zones', 'zones')
+
+        if imgui.button('Generate'):
+            self._generate_pattern()
+
+    # World-space (min x, min y, max x, max y) of the write field, or None
+    def _field_bounds(self) -> tuple[float, float, float, float]:
+        if not self.field_enabled:
+            return None
+        w, h = self.field_size[0] * 0.5, self.field_size[1] * 0.5
+        return (-w, -h, w, h)
+
+    # Keeps the validation results current once validation was asked for,
+    # re-checking only the shapes edited since
+    def _update_validation(self) -> None:
+        if self.validation is None:
+            return
+        self.validator.field = self._field_bounds()
+        if self.validator.is_stale(self.geometry):
+            self._validate()
+
+    def _validate(self) -> None:
+        self.validation = self.validator.validate(
+            lambda rows: [s.shape for s in self.shapes.take(rows)],
+            self.geometry)
+        self.dirty = True
+
+    # Splits the shapes into a grid of write fields of the field size, for
+    # writing one project file per field. The geometry is brought up to date
+    # here and the split itself is returned to be run later, possibly off the
+    # main thread, as long as the project is not edited until it has run.
+    def partition_fields(self) -> Callable[[], tuple[FieldGrid, Partition]]:
+        self._update_geometry()
+        grid = FieldGrid(self.field_size)
+        geometry: ShapeGeometry = self.geometry
+        shapes = [s.shape for s in self.shapes]
+        order: str = 'serpentine' if self.field_serpentine else 'drawing'
+        return lambda: (grid, partition(geometry, grid, splittable(shapes),
+                                        order))
+
+    def _ui_validation(self) -> None:
+        _, self.field_enabled = imgui.checkbox('Write Field', self.field_enabled)
+        imgui.same_line()
+        w, h = (v * METER_INV_SCALE for v in self.field_size)
+        _, (w, h) = imgui.input_float2(METER_SCALE_NAME + '##field_size',
+                                       w, h, format='%.3f')
+        self.field_size = (max(w * METER_SCALE, MIN_FIELD_SIZE),
+                           max(h * METER_SCALE, MIN_FIELD_SIZE))
+        _, self.field_serpentine = imgui.checkbox('Serpentine order in fields',
+                                                  self.field_serpentine)
+
+        if imgui.button('Validate'):
+            self._update_geometry()
+            self.validator.field = self._field_bounds()
+            self.validator.reset()
+            self._validate()
+        imgui.same_line()
+        if imgui.button('Clear'):
+            self.validation = None
+            self.dirty = True
+
+        diag: Diagnostics = self.validation
+        if diag is None:
+            imgui.text_disabled('Not validated')
+            return
+        if len(diag) == 0:
+            imgui.text('No problems found')
+            return
+
+        # Clicking a count selects the shapes with that problem
+        for issue, count in diag.counts().items():
+            if count == 0:
+                continue
+            kind: str = 'error' if issue in ERRORS else 'warning'
+            if imgui.selectable(f'{count} x {ISSUE_TEXT[issue]} ({kind})')[0]:
+                self._select_rows(diag.rows_with(issue), SelectMode.REPLACE)
+
+        imgui.separator()
+        for i in range(min(len(diag), MAX_ISSUE_ROWS)):
+            text: str = diag.describe(i, lambda r: self.shapes[r].name)
+            if imgui.selectable(f'{text}##issue_{i}')[0]:
+                rows = [diag.rows[i]] if diag.others[i] < 0 else \
+                    [diag.rows[i], diag.others[i]]
+                self._select_rows(np.array(rows), SelectMode.REPLACE)
+        if len(diag) > MAX_ISSUE_ROWS:
+            imgui.text_disabled(f'... and {len(diag) - MAX_ISSUE_ROWS} more')
+
+    def _ui_duplicates(self) -> None:
+        tolerance: float = self.dedup_tolerance * METER_INV_SCALE
+        changed, tolerance = imgui.input_float(
+            METER_SCALE_NAME + ' tolerance##dedup', tolerance, format='%.5f')
+        if changed:
+            self.dedup_tolerance = max(tolerance, 0.0) * METER_SCALE
+        changed, angle = imgui.input_float('degrees##dedup_angle',
+                                           self.dedup_angle, format='%.3f')
+        if changed:
+            self.dedup_angle = max(angle, 0.0)
+
+        if imgui.button('Find Duplicates'):
+            self._update_geometry()
+            self.duplicates = find_duplicates(
+                [s.shape for s in self.shapes], self.geometry,
+                self.dedup_tolerance, self.dedup_angle)
+            self.duplicates_version = self.geometry.version
+
+        dup: Duplicates = self.duplicates
+        if dup is None or self.duplicates_version != self.geometry.version:
+            self.duplicates = None
+            imgui.text_disabled('Not searched')
+            return
+        exact: int = len(dup.removable(exact_only=True))
+        imgui.text(f'{exact} exact, {len(dup.removable()) - exact} near duplicates')
+        if len(dup) == 0:
+            return
+
+        # The first shape of every group of duplicates is kept
+        if imgui.button('Select'):
+            self._select_rows(dup.removable(), SelectMode.REPLACE)
+        imgui.same_line()
+        if imgui.button('Remove All'):
+            self._remove_rows(dup.removable())
+        imgui.same_line()
+        if imgui.button('Remove Exact'):
+            self._remove_rows(dup.removable(exact_only=True))
+
+    # Rows of the selected shapes, in draw order
+    def _selected_rows(self) -> np.ndarray:
+        self._update_geometry()
+        return np.flatnonzero(self.selection_mask)
+
+    def _transform_selection(self, mat: Matrix3x3) -> None:
+        # TODO: undo stack
+        shapes = self.shapes.take(self._selected_rows())
+        if not is_rigid(mat):
+            instances = [s for s in shapes if isinstance(s.shape, InstanceShape)]
+            if len(instances) > 0:
+                log.warning(f'{len(instances)} group instances left out of a '
+                            'transform that scales or mirrors')
+                shapes = [s for s in shapes
+                          if not isinstance(s.shape, InstanceShape)]
+        transform_shapes([s.shape for s in shapes], mat)
+        self._shapes_edited(shapes)
+
+    # Moves the selection by a single (2,) offset or one (N,2) row per shape
+    def _offset_selection(self, offsets: np.ndarray) -> None:
+        # TODO: undo stack
+        rows = self._selected_rows()
+        offset_shapes([s.shape for s in self.shapes.take(rows)], offsets)
+        self.geometry.translate(rows, offsets)
+        self.snap.mark_stale(rows)
+        self.validator.mark_dirty(rows)
+        self.fractures.mark_stale([s.shape for s in self.shapes.take(rows)])
+        self.dirty = True
+
+    # World-space bounds of the selection as (min, max) arrays
+    def _selection_bounds(self) -> tuple[np.ndarray, np.ndarray]:
+        rows = self._selected_rows()
+        geo: ShapeGeometry = self.geometry
+        lo = (geo.centers[rows] - geo.half_dims[rows]).min(axis=0)
+        hi = (geo.centers[rows] + geo.half_dims[rows]).max(axis=0)
+        return lo, hi
+
+    def _selection_pivot(self) -> tuple[float, float]:
+        if self.xform_about_origin:
+            return (0.0, 0.0)
+        lo, hi = self._selection_bounds()
+        return tuple((lo + hi) * 0.5)
+
+    # Replaces the selected shapes by one instance of a new group of copies
+    # of them, placed at the center of their bounds
+    def _group_selection(self) -> None:
+        # TODO: undo stack
+        rows = self._selected_rows()
+        lo, hi = self._selection_bounds()
+        pivot = (lo + hi) * 0.5
+        objects = [(s.name, copy_shape(s.shape)) for s in self.shapes.take(rows)]
+        offset_shapes([o for _, o in objects], -pivot)
+
+        instance = InstanceShape(self.project.add_group(objects))
+        instance.center = Vec2(*pivot)
+        self._remove_rows(rows)
+        self._add_shapes([instance])
+
+    # Replaces the selected instances by copies of the shapes of their
+    # groups, one level deep, and selects the copies
+    def _ungroup_selection(self) -> None:
+        # TODO: undo stack
+        rows = [r for r in self._selected_rows().tolist()
+                if isinstance(self.shapes[r].shape, InstanceShape)]
+        placed: list[ShapeObject] = []
+        for s in self.shapes.take(rows):
+            mat: Matrix3x3 = instance_matrix(s.shape)
+            placed.extend(place_shape(c, mat)
+                          for c in s.shape.group.objects.values())
+        if len(placed) > 0:
+            self._remove_rows(np.array(rows))
+            self._add_shapes(placed)
+
+    # Aligns the bounds of the selected shapes along one axis, to the min
+    # (side < 0), center (side == 0) or max (side > 0) of the selection
+    def _align_selection(self, axis: int, side: int) -> None:
+        rows = self._selected_rows()
+        geo: ShapeGeometry = self.geometry
+        lo = geo.centers[rows, axis] - geo.half_dims[rows, axis]
+        hi = geo.centers[rows, axis] + geo.half_dims[rows, axis]
+
+        offsets = np.zeros((len(rows), 2))
+        if side < 0:
+            offsets[:, axis] = lo.min() - lo
+        elif side > 0:
+            offsets[:, axis] = hi.max() - hi
+        else:
+            offsets[:, axis] = (lo.min() + hi.max()) * 0.5 - (lo + hi) * 0.5
+        self._offset_selection(offsets)
+
+    # Spaces the centers of the selected shapes evenly along one axis,
+    # keeping the two outermost shapes in place
+    def _distribute_selection(self, axis: int) -> None:
+        rows = self._selected_rows()
+        centers = self.geometry.centers[rows, axis]
+        order = np.argsort(centers, kind='stable')
+
+        offsets = np.zeros((len(rows), 2))
+        targets = np.linspace(centers[order[0]], centers[order[-1]], len(rows))
+        offsets[order, axis] = targets - centers[order]
+        self._offset_selection(offsets)
+
+    def _ui_transform(self) -> None:
+        expanded, _ = imgui.collapsing_header('Transform Selection')
+        if not expanded:
+            return
+
+        imgui.text('Pivot:')
+        imgui.same_line()
+        if imgui.radio_button('Selection', not self.xform_about_origin):
+            self.xform_about_origin = False
+        imgui.same_line()
+        if imgui.radio_button('Origin', self.xform_about_origin):
+            self.xform_about_origin = True
+
+        x, y = self.xform_offset
+        x *= METER_INV_SCALE
+        y *= METER_INV_SCALE
+        changed, (x, y) = imgui.input_float2(METER_SCALE_NAME + '##offset',
+                                             x, y, format='%.5f')
+        if changed:
+            self.xform_offset = (x * METER_SCALE, y * METER_SCALE)
+        imgui.same_line()
+        if imgui.button('Move'):
+            self._offset_selection(np.array(self.xform_offset))
 
-    def _duplicate_shape(self, index: int) -> EditableShape:
-        shape: ShapeObject = self.shapes[index].shape
-        dupe: ShapeObject = deepcopy(shape)
+        _, self.xform_angle = imgui.input_float('degrees ##xform_angle',
+                                                self.xform_angle, format='%.2f')
+        imgui.same_line()
+        if imgui.button('Rotate'):
+            m = Matrix3x3.rotation(self.xform_angle)
+            self._transform_selection(about_pivot(m, self._selection_pivot()))
+
+        sx, sy = self.xform_scale
+        if self.xform_uniform:
+            _, sx = imgui.input_float('##xform_scale', sx, format='%.4f')
+            sy = sx
+        else:
+            _, (sx, sy) = imgui.input_float2('##xform_scale', sx, sy,
+                                             format='%.4f')
+        self.xform_scale = (sx, sy)
+        imgui.same_line()
+        if imgui.button('Scale'):
+            m = Matrix3x3.scaling(sx, sy)
+            self._transform_selection(about_pivot(m, self._selection_pivot()))
+        imgui.same_line()
+        _, self.xform_uniform = imgui.checkbox('Uniform', self.xform_uniform)
+
+        for label, sx, sy in (('Mirror X', -1, 1), ('Mirror Y', 1, -1)):
+            if imgui.button(label):
+                m = Matrix3x3.scaling(sx, sy)
+                self._transform_selection(about_pivot(m, self._selection_pivot()))
+            imgui.same_line()
+        imgui.new_line()
+
+        imgui.text('Align:')
+        for label, axis, side in (('Left', 0, -1), ('Center X', 0, 0),
+                                  ('Right', 0, 1), ('Bottom', 1, -1),
+                                  ('Center Y', 1, 0), ('Top', 1, 1)):
+            if imgui.button(label):
+                self._align_selection(axis, side)
+            if side < 1:
+                imgui.same_line()
+
+        imgui.text('Distribute:')
+        imgui.same_line()
+        if imgui.button('Horizontally') and len(self.selected) > 2:
+            self._distribute_selection(0)
+        imgui.same_line()
+        if imgui.button('Vertically') and len(self.selected) > 2:
+            self._distribute_selection(1)
 
-        editable: EditableShape = self._add_shape(dupe)
-        self._select_shape(editable, True)
+        imgui.text('Group:')
+        imgui.same_line()
+        if imgui.button('Make Group') and len(self.selected) > 0:
+            self._group_selection()
+        imgui.same_line()
+        if imgui.button('Ungroup'):
+            self._ungroup_selection()
+        imgui.separator()
+
+    # Values of every inspector property over the selected shapes that have
+    # it, as the shapes and an (N,2) or (N,) array. Only re-read when the
+    # selection or the shapes changed.
+    def _selection_values(self) -> dict[str, tuple[list[EditableShape],
+                                                   np.ndarray]]:
+        self._update_geometry()
+        key = (self.selection_version, self.geometry.version)
+        if key == self.edit_values_key:
+            return self.edit_values
+
+        selected = self.shapes.take(self._selected_rows())
+        values = {}
+        for _, prop, kind, types, _ in INSPECTOR_PROPERTIES:
+            shapes = [s for s in selected if isinstance(s.shape, types)]
+            if len(shapes) == 0:
+                continue
+            objs = [s.shape for s in shapes]
+            if kind == 'vec2':
+                values[prop] = (shapes, _gather_vec2(objs, prop))
+            else:
+                values[prop] = (shapes, _gather_scalar(objs, prop))
+
+        self.edit_values = values
+        self.edit_values_key = key
+        return values
+
+    # Applies an edit to one property of every selected shape having it. The
+    # value is what to set, add or multiply by depending on the edit mode;
+    # components that are None are left alone.
+    def _edit_property(self, prop: str, kind: str, value: tuple) -> None:
+        # TODO: undo stack
+        shapes, old = self._selection_values()[prop]
+        new: np.ndarray = old.copy()
+        cols = new.reshape(len(new), -1)
+        for i, v in enumerate(value):
+            if v is None:
+                continue
+            if self.edit_mode == EditMode.SET:
+                cols[:, i] = v
+            elif self.edit_mode == EditMode.OFFSET:
+                cols[:, i] += v
+            else:
+                cols[:, i] *= v
+
+        objs = [s.shape for s in shapes]
+        if kind == 'vec2':
+            _scatter_vec2(objs, prop, new)
+        elif kind == 'int':
+            _scatter_scalar(objs, prop, np.maximum(new, 1), integer=True)
+        else:
+            _scatter_scalar(objs, prop, new)
+        self._shapes_edited(shapes)
+
+    def _ui_multi_inspector(self) -> None:
+        imgui.text(f'{len(self.selected)} objects selected')
+        for label, mode in (('Set', EditMode.SET), ('Offset', EditMode.OFFSET),
+                            ('Scale', EditMode.SCALE)):
+            if imgui.radio_button(label, self.edit_mode == mode):
+                self.edit_mode = mode
+            imgui.same_line()
+        imgui.new_line()
+        imgui.separator()
+
+        values = self._selection_values()
+        for label, prop, kind, _, meters in INSPECTOR_PROPERTIES:
+            if prop not in values:
+                continue
+            shapes, data = values[prop]
+            cols = data.reshape(len(data), -1)
+            lo = cols.min(axis=0)
+            hi = cols.max(axis=0)
+            shown = np.where(lo == hi, lo, (lo + hi) * 0.5)
+            scale = METER_INV_SCALE if meters else 1.0
+            unit = METER_SCALE_NAME if meters else ''
+
+            imgui.text(f'{label}:')
+            imgui.same_line()
+            imgui.text_disabled(f'({len(shapes)})')
+            if np.any(lo != hi):
+                imgui.same_line()
+                ranges = ', '.join(f'{a * scale:.4g}..{b * scale:.4g}'
+                                   for a, b in zip(lo, hi))
+                imgui.text_disabled(f'mixed {ranges}')
+
+            id = f'{unit}##multi_{prop}'
+            if self.edit_mode == EditMode.SET:
+                # As imgui holds them, so untouched components compare equal
+                current = tuple(float(np.float32(v * scale)) for v in shown)
+                if kind == 'int':
+                    current = tuple(float(round(v)) for v in current)
+            else:
+                neutral = 0.0 if self.edit_mode == EditMode.OFFSET else 1.0
+                current = self.edit_operands.get(
+                    (prop, self.edit_mode), (neutral,) * len(shown))
+
+            if len(current) == 2:
+                changed, entered = imgui.input_float2(id, *current,
+                                                      format='%.5f')
+            elif kind == 'int' and self.edit_mode != EditMode.SCALE:
+                changed, entered = imgui.input_int(id, int(round(current[0])))
+                entered = (float(entered),)
+            else:
+                changed, entered = imgui.input_float(id, current[0],
+                                                     format='%.5f')
+                entered = (entered,)
+
+            if self.edit_mode == EditMode.SET:
+                # Only components actually typed in are set, so editing x
+                # keeps the mixed y values of the shapes
+                if changed:
+                    value = tuple(None if e == c else
+                                  (e / scale if scale != 1.0 else e)
+                                  for e, c in zip(entered, current))
+                    self._edit_property(prop, kind, value)
+            else:
+                self.edit_operands[(prop, self.edit_mode)] = tuple(entered)
+                imgui.same_line()
+                if imgui.button(f'Apply##multi_{prop}'):
+                    if self.edit_mode == EditMode.OFFSET:
+                        entered = tuple(e / scale for e in entered)
+                    self._edit_property(prop, kind, entered)
 
     def _ui_inspector(self) -> None:
+        self._ui_transform()
+
+        if len(self.selected) > 1:
+            self._ui_multi_inspector()
+            return
+
         flags = imgui.TREE_NODE_DEFAULT_OPEN
+        edited: list[EditableShape] = []
         for s in self.selected:
             s: EditableShape = s
             name: str = s.name
             if imgui.tree_node(name, flags):
-                s.ui_inspect()
+                if s.ui_inspect():
+                    edited.append(s)
+                self._ui_scan_info(s.shape)
                 imgui.tree_pop()
             imgui.separator()
+        self._shapes_edited(edited)
+
+    # Line count, dwell count and time of the scan path of a filled shape
+    def _ui_scan_info(self, shape: ShapeObject) -> None:
+        if not is_fracturable(shape):
+            return
+        path: ScanPath = self.fractures.get(
+            shape, ScanParams.from_settings(self.project.settings))
+        if path is None:
+            imgui.text_disabled('Scan: ...')
+            return
+        imgui.text_disabled(f'Scan: {len(path)} lines, {path.dwell_count} dwells, '
+                            f'{path.total_time:.3f} s')
 
     def _create_new_shape(self) -> None:
         shape: ShapeObject = None
@@ -460,6 +1506,18 @@ class Interface:
                 ps.parallel = False
             imgui.tree_pop()
 
+        if imgui.tree_node('Patterns'):
+            self._ui_patterns()
+            imgui.tree_pop()
+
+        if imgui.tree_node('Validation'):
+            self._ui_validation()
+            imgui.tree_pop()
+
+        if imgui.tree_node('Duplicates'):
+            self._ui_duplicates()
+            imgui.tree_pop()
+
         _, avail_h = imgui.get_content_region_available()
         if avail_h < 200:
             avail_h = 200
@@ -479,71 +1537,207 @@ class Interface:
                 imgui.text_unformatted((
                     'Click objects in the list to select in the viewport,\n' +
                     'Shift-click or Ctrl-click to select multiple objects.\n' +
+                    'Drag in the viewport to box select, Alt-drag to lasso;\n' +
+                    'hold Shift to add to or Ctrl to remove from the selection.\n' +
                     'Drag and drop objects to re-order them in the list.'
                 ))
                 imgui.end_tooltip()
 
             self._ui_add_shape()
+            matches: np.ndarray = self._ui_filter(modifier)
 
             imgui.push_style_var(imgui.STYLE_CHILD_ROUNDING, 4.0)
 
             with imgui.begin_child('Objects', 0, avail_h, border=True):
-                for i in range(len(self.shapes)):
-                    shape: EditableShape = self.shapes[i]
-                    select, _ = imgui.selectable(shape.name, shape.selected)
-                    if select:
-                        if shape.selected and modifier:
-                            self._unselect_shape(shape)
-                        else:
-                            self._select_shape(shape, modifier)
-                    with imgui.begin_popup_context_item() as popup:
-                        if popup.opened:
-                            selected = set(self.selected)
-                            if shape not in selected:
-                                imgui.text_disabled(shape.name)
-                                imgui.separator()
-                            for s in selected:
-                                imgui.text_disabled(s.name)
-                            selected.add(shape)
-                            if imgui.button('Remove Shape(s)'):
-                                for j in range(len(self.shapes)):
-                                    if self.shapes[j] in selected:
-                                        remove_indices.append(j)
-                            if imgui.button('Duplicate Shape(s)'):
-                                for j in range(len(self.shapes)):
-                                    if self.shapes[j] in selected:
-                                        duplicate_indices.append(j)
-                    with imgui.begin_drag_drop_source() as src:
-                        if src.dragging:
-                            imgui.set_drag_drop_payload('shape', i.to_bytes(4))
-                            imgui.text(shape.name)
-                    with imgui.begin_drag_drop_target() as dest:
-                        if dest.hovered:
-                            payload = imgui.accept_drag_drop_payload('shape')
-                            if payload is not None:
-                                j = int.from_bytes(payload)
-                                self._move_shape(j, i)
+                for i in self._visible_list_rows(matches):
+                    self._ui_list_row(i, modifier, remove_indices,
+                                      duplicate_indices)
+                if not io.mouse_down[0]:
+                    self.list_drag = None
 
             imgui.pop_style_var()
             imgui.tree_pop()
 
         if len(duplicate_indices) > 0:
-            self._unselect_all()
-            for i in duplicate_indices:
-                self._duplicate_shape(i)
+            self._duplicate_rows(duplicate_indices)
+        self._remove_rows(remove_indices)
+
+    # Rows of the object list to submit this frame, out of all shapes or out
+    # of the given sorted rows only. Only the rows inside the scrolled region
+    # are laid out, with the cursor placed at each row's y so the scrollbar
+    # still spans the whole list, which keeps the list cost independent of
+    # the number of shapes (imgui's list clipper is not exposed by pyimgui).
+    def _visible_list_rows(self, rows: np.ndarray = None) -> Iterator[int]:
+        count: int = len(self.shapes) if rows is None else len(rows)
+        row_h: float = imgui.get_text_line_height_with_spacing()
+        top: float = imgui.get_cursor_pos_y()
+        scroll: float = imgui.get_scroll_y()
+        _, view_h = imgui.get_window_size()
+
+        first: int = max(int((scroll - top) // row_h), 0)
+        last: int = min(int((scroll - top + view_h) // row_h) + 1, count)
+        lines: list[int] = list(range(first, last))
+
+        for shape in (self.list_popup, self.list_drag):
+            if shape is None:
+                continue
+            self._update_geometry()
+            i = self.geometry.row(shape.shape)
+            if i < 0 or i >= len(self.shapes) or self.shapes[i] is not shape:
+                continue
+            if rows is not None:
+                line = int(np.searchsorted(rows, i))
+                if line >= count or rows[line] != i:
+                    continue
+                i = line
+            if i < first or i >= last:
+                lines.append(i)
+        lines.sort()
+
+        for line in lines:
+            imgui.set_cursor_pos_y(top + line * row_h)
+            yield line if rows is None else int(rows[line])
+
+        # Reserve the height of the rows below so the scroll range is right
+        imgui.set_cursor_pos_y(top + count * row_h)
+        imgui.dummy(0, 0)
+
+    # Draws the object list filter bar, returns the sorted rows matching the
+    # filter, or None when no filter is set
+    def _ui_filter(self, modifier: bool) -> np.ndarray:
+        filt: ShapeFilter = self.filter
+
+        imgui.push_item_width(-80)
+        _, filt.text = imgui.input_text_with_hint('##filter', 'Filter by name',
+                                                  filt.text)
+        imgui.pop_item_width()
+        imgui.same_line()
+        _, filt.prefix = imgui.checkbox('Prefix', filt.prefix)
+
+        any_type: str = 'Any type'
+        label: str = any_type if filt.typename is None else \
+            SHAPE_NAMES.get(filt.typename, filt.typename)
+        with imgui.begin_combo('##filter_type', label) as combo:
+            if combo.opened:
+                if imgui.selectable(any_type, filt.typename is None)[0]:
+                    filt.typename = None
+                for typ in SHAPE_TYPENAME_TO_TYPE:
+                    name = SHAPE_NAMES.get(typ, typ)
+                    if imgui.selectable(name, typ == filt.typename)[0]:
+                        filt.typename = typ
+
+        if imgui.tree_node('More Filters'):
+            lo, hi = self.filter_depth
+            _, on = imgui.checkbox('Depth', filt.depth is not None)
+            imgui.same_line()
+            _, (lo, hi) = imgui.input_int2('scans ##filter_depth', lo, hi)
+            self.filter_depth = (lo, hi)
+            filt.depth = self.filter_depth if on else None
 
-        remove_indices.sort(reverse=True)
-        for i in remove_indices:
-            self._remove_shape(i)
+            lo, hi = (v * METER_INV_SCALE for v in self.filter_size)
+            _, on = imgui.checkbox('Size', filt.size is not None)
+            imgui.same_line()
+            _, (lo, hi) = imgui.input_float2(METER_SCALE_NAME + '##filter_size',
+                                             lo, hi, format='%.4f')
+            self.filter_size = (lo * METER_SCALE, hi * METER_SCALE)
+            filt.size = self.filter_size if on else None
+
+            region = [v * METER_INV_SCALE for v in self.filter_region]
+            _, on = imgui.checkbox('Region', filt.region is not None)
+            imgui.same_line()
+            if imgui.button('From View'):
+                r: Rect = self.viewport.rect
+                region = [v * METER_INV_SCALE
+                          for v in (r.left, r.bottom, r.right, r.top)]
+            _, region = imgui.input_float4(METER_SCALE_NAME + '##filter_region',
+                                           *region, format='%.3f')
+            self.filter_region = tuple(v * METER_SCALE for v in region)
+            filt.region = self.filter_region if on else None
+            imgui.tree_pop()
+
+        if not filt.is_active():
+            return None
+
+        self._update_geometry()
+        matches: np.ndarray = self.search.matches(
+            filt, self.project.index, self.project.objects, self.geometry)
+
+        imgui.text_disabled(f'{len(matches)} of {len(self.shapes)} match')
+        imgui.same_line()
+        if imgui.button('Select All Matches'):
+            mode = SelectMode.ADD if modifier else SelectMode.REPLACE
+            self._select_rows(matches, mode)
+        imgui.same_line()
+        if imgui.button('Clear##filter'):
+            self.filter = ShapeFilter()
+        return matches
+
+    def _ui_list_row(self, i: int, modifier: bool, remove_indices: list[int],
+                     duplicate_indices: list[int]) -> None:
+        shape: EditableShape = self.shapes[i]
+        select, _ = imgui.selectable(shape.name, shape.selected)
+        if select:
+            if shape.selected and modifier:
+                self._unselect_shape(shape)
+            else:
+                self._select_shape(shape, modifier)
+
+        with imgui.begin_popup_context_item() as popup:
+            if popup.opened:
+                self.list_popup = shape
+                if not shape.selected:
+                    imgui.text_disabled(shape.name)
+                    imgui.separator()
+                # Listing every name would make the menu as slow as the list
+                rows = self._selected_rows()
+                for j in rows[:LIST_POPUP_NAMES]:
+                    imgui.text_disabled(self.shapes[j].name)
+                if len(rows) > LIST_POPUP_NAMES:
+                    imgui.text_disabled(
+                        f'... and {len(rows) - LIST_POPUP_NAMES} more')
+
+                targets: list[int] = rows.tolist()
+                if not shape.selected:
+                    targets = sorted(targets + [i])
+                if imgui.button('Remove Shape(s)'):
+                    remove_indices.extend(targets)
+                if imgui.button('Duplicate Shape(s)'):
+                    duplicate_indices.extend(targets)
+            elif self.list_popup is shape:
+                self.list_popup = None
+
+        with imgui.begin_drag_drop_source() as src:
+            if src.dragging:
+                self.list_drag = shape
+                imgui.set_drag_drop_payload('shape', i.to_bytes(4))
+                imgui.text(shape.name)
+        with imgui.begin_drag_drop_target() as dest:
+            if dest.hovered:
+                payload = imgui.accept_drag_drop_payload('shape')
+                if payload is not None:
+                    j = int.from_bytes(payload)
+                    self.list_drag = None
+                    self._move_shape(j, i)
 
 
     def set_ui_scale(self, ui_scale: float):
-        self.viewport.ui_scale = ui_scale
+        if ui_scale != self.viewport.ui_scale:
+            self.viewport.ui_scale = ui_scale
+            self.viewport.dirty = True
+
+    # Whether anything changed since the last frame that is not yet shown
+    def needs_redraw(self) -> bool:
+        return self.dirty or self.viewport.dirty or self.fractures.busy()
 
     def update_input(self) -> None:
         self.frame_number += 1
+        # Anything that changes during this frame requests one more frame
+        self.dirty = False
+        self.viewport.dirty = False
+
         io = imgui.get_io()
         if io.want_capture_mouse:
+            self._set_hovered(None)
             return  # Let imgui do its own thing
 
         mouse_pos = Vec2(*io.mouse_pos)
@@ -560,6 +1754,7 @@ class Interface:
             self.was_dragging = True
             self.is_dragging = False
             self.is_dragging_selection = False
+            self._finish_band()
         else:
             self.was_dragging = False
 
@@ -567,6 +1762,11 @@ class Interface:
             if not (self.is_dragging or self.was_dragging):
                 self._handle_click(mouse_pos, ctrl, shift)
 
+        # imgui reports -FLT_MAX when the mouse is outside of the window
+        mouse_valid: bool = mouse_pos.x > -1e30 and mouse_pos.y > -1e30
+        if mouse_valid and not self.is_dragging and self.project is not None:
+            self._update_hover(mouse_pos)
+
         wheel = io.mouse_wheel
         if wheel > 0:
             self.viewport.zoom_in(1, mouse_pos)
@@ -587,6 +1787,16 @@ class Interface:
                 v: Viewport = self.viewport
                 _, v.show_grid = imgui.menu_item('Grid', None, v.show_grid)
                 _, v.show_axes = imgui.menu_item('Axes', None, v.show_axes)
+                _, self.show_scan_paths = imgui.menu_item(
+                    'Scan Paths', None, self.show_scan_paths)
+                imgui.separator()
+
+                _, self.snap_shapes = imgui.menu_item('Snap to Shapes', None,
+                                                      self.snap_shapes)
+                _, self.snap_axes = imgui.menu_item('Snap to Axes', None,
+                                                    self.snap_axes)
+                _, self.snap_grid = imgui.menu_item('Snap to Grid', None,
+                                                    self.snap_grid)
 
         with imgui.begin_menu('Scale') as menu:
             if menu.opened:
@@ -648,45 +1858,47 @@ class Interface:
 
         self.viewport.update()
 
-        # TODO: some kind of shape culling or filtering here
+        self._update_geometry()
         self.viewport.shapes_to_draw = self.shapes
+        self.viewport.geometry = self.geometry
+        self.viewport.selection_mask = self.selection_mask
+        self.viewport.selection_version = self.selection_version
+        self.viewport.hovered = self.hovered
         self.viewport.draw()
-
-    def set_project(self, proj: Project) -> None:
+        self._update_validation()
+        self._draw_issues()
+        self._draw_scan_paths()
+        self._draw_band()
+        self._draw_snap()
+
+    # prepared, from prepare_project(proj), takes its work off this call
+    def set_project(self, proj: Project,
+                    prepared: PreparedProject = None) -> None:
         self.project = None
+        self.validation = None
+        self.fractures.clear()
         self._unselect_all()
-        self.shapes.clear()
 
         self.project = proj
-        if self.project:
-            for n, s in self.project.objects.items():
-                shape = EditableShape(n, s)
-                self.shapes.append(shape)
+        if prepared is None:
+            self.shapes = ShapeList(self.project)
+            self._shapes_changed()
+            return
+        self.shapes = prepared.shapes
+        self.geometry.rebuild([s.shape for s in self.shapes], prepared.extents)
+        self.geometry_dirty = False
+        self._shapes_changed(rebuild=False)
 
     def _handle_select(self, point: Vec2, modifier: bool):
+        hits = self._shapes_at(point)
         if modifier:
-            new_selection: bool = False
-            for s in self.shapes:
-                if s in self.selected:
-                    continue
-                if s.intersect_screen(self.viewport, point):
-                    self.selected.add(s)
-                    s.selected = True
-                    new_selection = True
-                    break
-            if not new_selection:
-                for s in self.selected:
-                    if s.intersect_screen(self.viewport, point):
-                        s.selected = False
-                        self.selected.remove(s)
-                        break
+            unselected = [s for s in hits if not s.selected]
+            if len(unselected) > 0:
+                self._select_shape(unselected[0], True)
+            elif len(hits) > 0:
+                self._unselect_shape(hits[0])
         else:
-            select: EditableShape = None
-            for s in self.shapes:
-                if s.intersect_screen(self.viewport, point):
-                    select = s
-                    break
-            self._select_shape(select)
+            self._select_shape(hits[0] if len(hits) > 0 else None)
 
     def _handle_click(self, pos: Vec2, ctrl: bool, shift: bool):
         self._handle_select(pos, shift)
@@ -696,11 +1908,204 @@ class Interface:
         self.is_dragging = True
 
         if began_dragging:
-            self.is_dragging_selection = False
-            for s in self.selected:
-                if s.intersect_screen(self.viewport, pos - diff):
-                    self.is_dragging_selection = True
-                    break
+            hits = self._shapes_at(pos - diff)
+            grabbed = [s for s in hits if s.selected]
+            self.is_dragging_selection = len(grabbed) > 0
+            if self.is_dragging_selection:
+                self._begin_snap(grabbed[0], pos - diff)
+            else:
+                origin = pos - Vec2(*imgui.get_mouse_drag_delta(0))
+                self._begin_band(origin)
         if self.is_dragging_selection:
-            for s in self.selected:
-                s.translate_screen(self.viewport, diff)
+            d: Vec2 = diff * self.viewport.meters_per_pixel
+            self._drag_selection(np.array([d.x, -d.y]))
+        elif self.band_points is not None:
+            self._extend_band(pos)
+
+    # Picks the snap point of the grabbed shape closest to the mouse as the
+    # point of the selection that snaps while dragging
+    def _begin_snap(self, grabbed: EditableShape, pos: Vec2) -> None:
+        self._update_geometry()
+        p: Vec2 = self.viewport.from_screen(pos)
+        row: int = self.geometry.row(grabbed.shape)
+        points, _ = snap_points([grabbed.shape], self.geometry.centers[[row]],
+                                np.array([row]))
+        d = points - (p.x, p.y)
+        anchor = points[np.argmin(np.einsum('ij,ij->i', d, d))]
+        self.snap_anchor = anchor.copy()
+        self.snap_target = anchor.copy()
+        self.snap_hit = False
+
+    # Moves the selection by the mouse movement, snapping the anchor point
+    # unless Alt is held
+    def _drag_selection(self, offset: np.ndarray) -> None:
+        self.snap_target += offset
+        snapped = self.snap_target
+        self.snap_hit = False
+        if not imgui.get_io().key_alt:
+            snapped = self._snap_point(*self.snap_target)
+        delta = snapped - self.snap_anchor
+        if delta[0] != 0.0 or delta[1] != 0.0:
+            self._offset_selection(delta)
+            self.snap_anchor = np.array(snapped)
+
+    # Snaps a world-space point to the closest snap point of an unselected
+    # shape, or else to the axes and the grid, each within SNAP_PIXELS
+    def _snap_point(self, x: float, y: float) -> np.ndarray:
+        v: Viewport = self.viewport
+        radius: float = SNAP_PIXELS * v.meters_per_pixel
+
+        if self.snap_shapes:
+            self._update_geometry()
+            hit = self.snap.nearest(
+                x, y, radius, lambda rows: [s.shape for s in self.shapes.take(rows)],
+                self.geometry, self.selection_mask)
+            if hit is not None:
+                self.snap_hit = True
+                return np.array(hit)
+
+        snapped = np.array([x, y])
+        if self.snap_grid:
+            spacing: float = v.grid_spacing()
+            grid = np.round(snapped / spacing) * spacing
+            near = np.abs(grid - snapped) <= radius
+            snapped[near] = grid[near]
+        if self.snap_axes:
+            snapped[np.abs(snapped) <= radius] = 0.0
+        return snapped
+
+    # Starts a box selection, or a lasso selection if Alt is held. Shift adds
+    # to the current selection and Ctrl removes from it.
+    def _begin_band(self, pos: Vec2) -> None:
+        io = imgui.get_io()
+        self.band_lasso = io.key_alt
+        if io.key_shift:
+            self.band_mode = SelectMode.ADD
+        elif io.key_ctrl:
+            self.band_mode = SelectMode.SUBTRACT
+        else:
+            self.band_mode = SelectMode.REPLACE
+        self.band_points = [self.viewport.from_screen(pos)]
+
+    def _extend_band(self, pos: Vec2) -> None:
+        p: Vec2 = self.viewport.from_screen(pos)
+        if not self.band_lasso:
+            self.band_points[1:] = [p]
+        else:
+            # Skip points closer than a few pixels to keep the polygon small
+            min_dist: float = 3.0 * self.viewport.meters_per_pixel
+            last: Vec2 = self.band_points[-1]
+            if math.hypot(p.x - last.x, p.y - last.y) >= min_dist:
+                self.band_points.append(p)
+        self.dirty = True
+
+    def _finish_band(self) -> None:
+        points = self.band_points
+        self.band_points = None
+        if points is None or len(points) < 2 or self.project is None:
+            return
+
+        self._update_geometry()
+        geo: ShapeGeometry = self.geometry
+        poly = np.array([(p.x, p.y) for p in points], dtype=np.float64)
+        lo = poly.min(axis=0)
+        hi = poly.max(axis=0)
+        rows = geo.query(lo[0], lo[1], hi[0], hi[1])
+
+        if self.band_lasso:
+            inside = points_in_polygon(geo.centers[rows], poly)
+        else:
+            # Only shapes that are entirely inside of the box
+            inside = geo.rects[rows].inside_rect(lo[0], lo[1], hi[0], hi[1])
+
+        self._select_rows(rows[inside], self.band_mode)
+
+    # Outlines the write field and the bounds of the visible shapes with
+    # problems, errors in red and warnings in yellow
+    def _draw_issues(self) -> None:
+        if self.validation is None:
+            return
+        v: Viewport = self.viewport
+        field = self._field_bounds()
+        if field is not None:
+            x0, y0, x1, y1 = field
+            corners = [Vec2(x0, y0), Vec2(x0, y1), Vec2(x1, y1), Vec2(x1, y0)]
+            v.draw_quad(corners, imgui.get_color_u32_rgba(0.4, 0.8, 1, 0.8))
+
+        geo: ShapeGeometry = self.geometry
+        r: Rect = v.rect
+        errors, warnings = self.validation.masks(len(geo))
+        for mask, color in ((errors, imgui.get_color_u32_rgba(1, 0.2, 0.2, 1)),
+                            (warnings, imgui.get_color_u32_rgba(1, 0.8, 0.2, 1))):
+            rows = np.flatnonzero(mask)
+            visible = geo.rects[rows].overlaps_rect(r.left, r.bottom,
+                                                     r.right, r.top)
+            for row in rows[visible][:MAX_ISSUE_MARKERS].tolist():
+                x, y = geo.centers[row]
+                w, h = geo.half_dims[row]
+                corners = [Vec2(x - w, y - h), Vec2(x - w, y + h),
+                           Vec2(x + w, y + h), Vec2(x + w, y - h)]
+                v.draw_quad(corners, color, False, 2.0)
+
+    # Draws the scan lines of the selected filled shapes, colored from blue
+    # for the first line to orange for the last, with the jumps between
+    # straight lines dimmed. Lines too close to tell apart on screen are
+    # skipped evenly.
+    def _draw_scan_paths(self) -> None:
+        if not self.show_scan_paths or self.project is None:
+            return
+        v: Viewport = self.viewport
+        params = ScanParams.from_settings(self.project.settings)
+        shapes = [s.shape for s in self.selected if is_fracturable(s.shape)]
+        budget: int = MAX_SCAN_LINES
+        jump = imgui.get_color_u32_rgba(1, 1, 1, 0.25)
+
+        for shape in shapes[:MAX_SCAN_SHAPES]:
+            path: ScanPath = self.fractures.get(shape, params)
+            if path is None or budget <= 0:
+                continue
+            count: int = len(path)
+            step: int = max(1, math.ceil(SCAN_LINE_PIXELS * v.meters_per_pixel
+                                         / params.pitch),
+                            math.ceil(count / budget))
+            lines = range(0, count, step)
+            budget -= len(lines)
+
+            last: Point2 = None
+            for k in lines:
+                t: float = k / max(count - 1, 1)
+                color = imgui.get_color_u32_rgba(0.2 + 0.8 * t, 0.5, 1.0 - 0.8 * t, 1)
+                if path.is_round:
+                    v.draw_circle(Vec2(*path.center), float(path.radii[k]), color)
+                    continue
+                x0, y0, x1, y1 = path.segments[k].tolist()
+                begin, end = Point2(x0, y0), Point2(x1, y1)
+                if last is not None:
+                    v.draw_line(last, begin, jump)
+                v.draw_line(begin, end, color)
+                last = end
+
+    # Marks the snap point the dragged selection is snapped to
+    def _draw_snap(self) -> None:
+        if not (self.is_dragging_selection and self.snap_hit):
+            return
+        color = imgui.get_color_u32_rgba(1, 0.8, 0.2, 1)
+        radius: float = 5.0 * self.viewport.meters_per_pixel
+        self.viewport.draw_circle(Vec2(*self.snap_anchor), radius, color, False)
+
+    def _draw_band(self) -> None:
+        if self.band_points is None or len(self.band_points) < 2:
+            return
+        v: Viewport = self.viewport
+        color = imgui.get_color_u32_rgba(1, 1, 1, 0.8)
+        fill = imgui.get_color_u32_rgba(1, 1, 1, 0.1)
+
+        if self.band_lasso:
+            points = self.band_points
+            for a, b in zip(points, points[1:] + points[:1]):
+                v.draw_line(a, b, color)
+        else:
+            a, b = self.band_points
+            corners = [Vec2(a.x, a.y), Vec2(a.x, b.y), Vec2(b.x, b.y), Vec2(b.x, a.y)]
+            v.draw_quad(corners, fill, True)
+            v.draw_quad(corners, color, False)
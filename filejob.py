@@ -0,0 +1,122 @@
+import os
+import time
+import threading
+import logging as log
+from concurrent.futures import CancelledError
+from pathlib import Path
+from typing import Any, Callable, NamedTuple
+from project import *
+import xmlproject
+import partition
+
+
+# A file operation run on a worker thread, so the UI keeps drawing frames
+# while it runs. The work reports its progress as a fraction through
+# report(), which is also where a requested cancellation stops it. Once
+# done() the outcome is either a result, an error or a cancellation, and is
+# read on the main thread; nothing the work makes is shared before that.
+class FileJob:
+    def __init__(self, title: str, work: Callable[['FileJob'], Any]) -> None:
+        self.title: str = title
+        self.progress: float = 0.0
+        self.result: Any = None
+        self.error: BaseException = None
+        self.cancelled: bool = False
+        self.started: float = time.perf_counter()
+        self._cancel: threading.Event = threading.Event()
+        self._done: threading.Event = threading.Event()
+        self._work: Callable[['FileJob'], Any] = work
+        self._thread = threading.Thread(target=self._run, name='file',
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            self.result = self._work(self)
+        except CancelledError:
+            self.cancelled = True
+        except BaseException as e:
+            self.error = e
+        self._done.set()
+
+    # Called by the work with the fraction done so far
+    def report(self, fraction: float) -> None:
+        self.progress = min(max(fraction, 0.0), 1.0)
+        if self._cancel.is_set():
+            raise CancelledError()
+
+    # Asks the work to stop at its next report
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    def cancelling(self) -> bool:
+        return self._cancel.is_set() and not self._done.is_set()
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+
+# Loads a project file on a worker thread. The job's result is the
+# (project, prepared) pair, where prepared is what prepare(project) returns,
+# so that work on the new project can be done off the main thread as well.
+def load_project(path: Path,
+                 prepare: Callable[[Project], Any] = None) -> FileJob:
+    def work(job: FileJob) -> tuple[Project, Any]:
+        with open(path, 'rb') as file:
+            proj: Project = xmlproject.from_file(file, job.report)
+        prepared = prepare(proj) if prepare is not None else None
+        job.report(1.0)
+        return proj, prepared
+
+    log.info(f'Loading using xmlproject reader from file: {path}')
+    return FileJob(f'Loading {path.name}', work)
+
+
+# Saves the project on a worker thread. The file is written next to path and
+# only renamed to it once complete, so a cancelled or failed save leaves any
+# earlier file at path untouched. The project must not be edited until the
+# job is done.
+def save_project(path: Path, project: Project) -> FileJob:
+    partial: Path = path.with_name(path.name + '.partial')
+
+    def work(job: FileJob) -> Path:
+        try:
+            with open(partial, 'w') as file:
+                xmlproject.to_file(project, file, job.report)
+            os.replace(partial, path)
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+        return path
+
+    log.info(f'Saving using xmlproject writer to file: {path}')
+    return FileJob(f'Saving {path.name}', work)
+
+
+# Outcome of an export of write fields
+class FieldExport(NamedTuple):
+    paths: list[Path]
+    partition: partition.Partition
+
+
+# Splits the shapes into write fields with split() and writes one project
+# file per field next to base, on a worker thread and the export's worker
+# processes. Progress counts the fields written; a cancel stops handing out
+# fields and keeps those already written. The project must not be edited
+# until the job is done.
+def export_fields(base: Path, settings: ProjectSettings, names: list[str],
+                  shapes: list[ShapeObject],
+                  split: Callable[[], tuple[partition.FieldGrid,
+                                            partition.Partition]]) -> FileJob:
+    def work(job: FileJob) -> FieldExport:
+        grid, part = split()
+        job.report(0.0)
+        paths = partition.export_fields(base, settings, names, shapes, part,
+                                        grid, progress=job.report)
+        return FieldExport(paths, part)
+
+    log.info(f'Exporting write fields next to: {base}')
+    return FileJob(f'Exporting {base.name}', work)
@@ -0,0 +1,223 @@
+import math
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import NamedTuple
+from project import *
+
+
+# Beam parameters that fracturing depends on: the distance between dwell
+# points and between scan lines, in meters, and the dwell time per point
+class ScanParams(NamedTuple):
+    pitch: float
+    dwell_time: float
+
+    @staticmethod
+    def from_settings(settings: ProjectSettings) -> 'ScanParams':
+        return ScanParams(settings.spot_size * settings.overlap,
+                          settings.dwell_time)
+
+
+# How a filled shape is scanned, as scan lines in scan order. Straight lines
+# are (x0, y0, x1, y1) rows of segments, from the first dwell point to the
+# last; round shapes are scanned along circles of the given radii around
+# center, counterclockwise from the +x axis. Every line has its number of
+# dwell points, evenly spaced along it, and the number of times it is
+# scanned. Dwell points are only made on request, one line at a time, so
+# shapes with millions of them stay cheap.
+class ScanPath:
+    def __init__(self, dwells: np.ndarray, repeats: np.ndarray,
+                 settle_time_line: float, settle_time_frame: float,
+                 dwell_time: float, segments: np.ndarray = None,
+                 radii: np.ndarray = None,
+                 center: tuple[float, float] = (0.0, 0.0)) -> None:
+        self.segments: np.ndarray = segments  # (L,4), or None for circles
+        self.radii: np.ndarray = radii        # (L,), or None for segments
+        self.center: tuple[float, float] = center
+        self.dwells: np.ndarray = dwells      # (L,) dwell points per line
+        self.repeats: np.ndarray = repeats    # (L,) scans per line
+        self.settle_time_line: float = settle_time_line
+        self.settle_time_frame: float = settle_time_frame
+        self.dwell_time: float = dwell_time
+
+    def __len__(self) -> int:
+        return len(self.dwells)
+
+    @property
+    def is_round(self) -> bool:
+        return self.radii is not None
+
+    # Dwell points exposed, counting every scan of a line
+    @property
+    def dwell_count(self) -> int:
+        return int((self.dwells * self.repeats).sum())
+
+    # Time to scan the shape: the dwells, the settle time after every scanned
+    # line and after every frame (one frame per scan of the deepest line)
+    @property
+    def total_time(self) -> float:
+        frames: int = int(self.repeats.max(initial=0))
+        return self.dwell_count * self.dwell_time + \
+            int(self.repeats.sum()) * self.settle_time_line + \
+            frames * self.settle_time_frame
+
+    # (K,2) dwell points of line k, in scan order
+    def dwell_points(self, k: int) -> np.ndarray:
+        n: int = int(self.dwells[k])
+        if self.radii is not None:
+            angles = np.arange(n) * (math.tau / n)
+            r: float = float(self.radii[k])
+            return np.stack((self.center[0] + r * np.cos(angles),
+                             self.center[1] + r * np.sin(angles)), axis=1)
+        x0, y0, x1, y1 = self.segments[k]
+        t = np.linspace(0.0, 1.0, n) if n > 1 else np.zeros(1)
+        return np.stack((x0 + (x1 - x0) * t, y0 + (y1 - y0) * t), axis=1)
+
+
+# Whether fracture() knows how the shape is scanned
+def is_fracturable(shape: ShapeObject) -> bool:
+    return isinstance(shape, (FilledRectangleShape, FilledCircleShape))
+
+
+# Evenly spaced positions of count lines across a span, half a gap in from
+# both ends
+def _line_offsets(span: float, count: int) -> np.ndarray:
+    return (np.arange(count) + 0.5) * (span / count) - span * 0.5
+
+
+# Scans per line: the depth of the shape, or for stairs shapes rising from
+# one scan at the first line to the depth at the last
+def _repeats(shape: ShapeObject, count: int) -> np.ndarray:
+    depth: int = max(shape.depth, 1)
+    if isinstance(shape, (RectangleStairsShape, CircleStairsShape)):
+        return np.ceil((np.arange(count) + 1) * (depth / count)).astype(np.int64)
+    return np.full(count, depth, dtype=np.int64)
+
+
+# Scan lines of a filled rectangle, along its width and stepping across its
+# height from the bottom edge, all in the same direction. Polish shapes are
+# scanned back and forth instead.
+def _fracture_rect(shape: FilledRectangleShape, params: ScanParams) -> ScanPath:
+    w: float = float(shape.dimensions[0])
+    h: float = float(shape.dimensions[1])
+    count: int = max(1, round(h / params.pitch))
+    dwells: int = max(1, round(w / params.pitch))
+
+    y = _line_offsets(h, count)
+    half: float = _line_offsets(w, dwells)[-1]
+    x0 = np.full(count, -half)
+    x1 = np.full(count, half)
+    if isinstance(shape, RectanglePolishShape):
+        x0[1::2], x1[1::2] = half, -half
+
+    a: float = math.radians(shape.angle)
+    c, s = math.cos(a), math.sin(a)
+    cx, cy = float(shape.center[0]), float(shape.center[1])
+    segments = np.stack((cx + x0 * c - y * s, cy + x0 * s + y * c,
+                         cx + x1 * c - y * s, cy + x1 * s + y * c), axis=1)
+    return ScanPath(np.full(count, dwells, dtype=np.int64),
+                    _repeats(shape, count), shape.settle_time_line,
+                    shape.settle_time_frame, params.dwell_time,
+                    segments=segments)
+
+
+# Scan lines of a filled circle: horizontal chords from the bottom up
+def _fracture_disc(shape: FilledCircleShape, params: ScanParams) -> ScanPath:
+    r: float = shape.radius
+    count: int = max(1, round(2.0 * r / params.pitch))
+    y = _line_offsets(2.0 * r, count)
+    chord = 2.0 * np.sqrt(np.maximum(r * r - y * y, 0.0))
+    dwells = np.maximum(np.round(chord / params.pitch), 1).astype(np.int64)
+    half = np.where(dwells > 1, (dwells - 1) * 0.5 * params.pitch, 0.0)
+
+    cx, cy = float(shape.center[0]), float(shape.center[1])
+    segments = np.stack((cx - half, cy + y, cx + half, cy + y), axis=1)
+    return ScanPath(dwells, _repeats(shape, count), 0.0,
+                    shape.settle_time_frame, params.dwell_time,
+                    segments=segments)
+
+
+# Scan lines of an annulus: circles from the inner radius outwards, or for
+# polish shapes from the outer radius inwards
+def _fracture_annulus(shape: AnnulusShape, params: ScanParams) -> ScanPath:
+    inner: float = max(shape.inner_radius, 0.0)
+    width: float = max(shape.radius - inner, 0.0)
+    count: int = max(1, round(width / params.pitch))
+    radii = inner + width * 0.5 + _line_offsets(width, count)
+    if isinstance(shape, CirclePolishShape):
+        radii = radii[::-1].copy()
+    dwells = np.maximum(np.round(math.tau * radii / params.pitch), 1) \
+        .astype(np.int64)
+    return ScanPath(dwells, _repeats(shape, count), 0.0,
+                    shape.settle_time_frame, params.dwell_time, radii=radii,
+                    center=(float(shape.center[0]), float(shape.center[1])))
+
+
+# Scan path of a filled shape, or None for shapes that are not filled or a
+# pitch of zero
+def fracture(shape: ShapeObject, params: ScanParams) -> ScanPath:
+    if not params.pitch > 0.0:
+        return None
+    if isinstance(shape, AnnulusShape):
+        return _fracture_annulus(shape, params)
+    if isinstance(shape, FilledCircleShape):
+        return _fracture_disc(shape, params)
+    if isinstance(shape, FilledRectangleShape):
+        return _fracture_rect(shape, params)
+    return None
+
+
+# Scan paths of recently asked for shapes, fractured on a worker thread so
+# that large shapes do not hold up the frame. get() returns None until the
+# path is ready. Edited shapes must be marked stale; paths made with other
+# ScanParams are not used.
+class FractureCache:
+    MAX_ENTRIES: int = 256
+
+    def __init__(self) -> None:
+        # Entries hold on to their shape, so its id is not reused meanwhile
+        self._paths: OrderedDict[int, tuple[ShapeObject, ScanParams, ScanPath]] = \
+            OrderedDict()
+        self._pending: dict[int, tuple[ShapeObject, ScanParams, Future]] = {}
+        self._executor: ThreadPoolExecutor = None
+
+    def get(self, shape: ShapeObject, params: ScanParams) -> ScanPath:
+        key: int = id(shape)
+        entry = self._paths.get(key)
+        if entry is not None and entry[1] == params:
+            self._paths.move_to_end(key)
+            return entry[2]
+
+        pending = self._pending.get(key)
+        if pending is not None and pending[1] == params:
+            if not pending[2].done():
+                return None
+            del self._pending[key]
+            path: ScanPath = pending[2].result()
+            self._paths[key] = (shape, params, path)
+            if len(self._paths) > self.MAX_ENTRIES:
+                self._paths.popitem(last=False)
+            return path
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(1, 'fracture')
+        self._pending[key] = (shape, params,
+                              self._executor.submit(fracture, shape, params))
+        return None
+
+    # Whether paths are still being made
+    def busy(self) -> bool:
+        return any(not f.done() for _, _, f in self._pending.values())
+
+    def mark_stale(self, shapes: list[ShapeObject]) -> None:
+        for shape in shapes:
+            self._paths.pop(id(shape), None)
+            pending = self._pending.pop(id(shape), None)
+            if pending is not None:
+                pending[2].cancel()
+
+    def clear(self) -> None:
+        for _, _, future in self._pending.values():
+            future.cancel()
+        self._paths.clear()
+        self._pending.clear()
@@ -0,0 +1,538 @@
+import math
+import numpy as np
+from typing import Iterable, Iterator
+from project import *
+from vector import Matrix3x3, RectArray
+
+
+# Computes the world-space axis-aligned bounds of a single shape, returned as
+# (center x, center y, half width, half height) in meters
+def shape_extent(shape: ShapeObject) -> tuple[float, float, float, float]:
+    if isinstance(shape, LineShape):
+        l: LineShape = shape
+        bx, by = float(l.begin[0]), float(l.begin[1])
+        ex, ey = float(l.end[0]), float(l.end[1])
+        return ((bx + ex) * 0.5, (by + ey) * 0.5,
+                abs(ex - bx) * 0.5, abs(ey - by) * 0.5)
+
+    cx, cy = float(shape.center[0]), float(shape.center[1])
+
+    if isinstance(shape, InstanceShape):
+        # The group bounds, turned like a rectangle
+        gx, gy, hw, hh = group_extent(shape.group)
+        sin_a: float = math.sin(math.radians(shape.angle))
+        cos_a: float = math.cos(math.radians(shape.angle))
+        return (cx + gx * cos_a - gy * sin_a, cy + gx * sin_a + gy * cos_a,
+                hw * abs(cos_a) + hh * abs(sin_a), hw * abs(sin_a) + hh * abs(cos_a))
+
+    if isinstance(shape, CrossShape):
+        hw: float = shape.width * 0.5
+        return (cx, cy, hw, hw)
+
+    if isinstance(shape, PointShape):
+        return (cx, cy, 0.0, 0.0)
+
+    if isinstance(shape, CircleShape):
+        return (cx, cy, shape.radius, shape.radius)
+
+    if isinstance(shape, RectangleShape):
+        r: RectangleShape = shape
+        hw: float = float(r.dimensions[0]) * 0.5
+        hh: float = float(r.dimensions[1]) * 0.5
+        sin_a: float = abs(math.sin(math.radians(r.angle)))
+        cos_a: float = abs(math.cos(math.radians(r.angle)))
+        return (cx, cy, hw * cos_a + hh * sin_a, hw * sin_a + hh * cos_a)
+
+    raise TypeError(f'unknown ShapeObject subclass: {type(shape)}')
+
+
+# Local bounds of the shapes of a group, as shape_extent(), measured once
+def group_extent(group: ShapeGroup) -> tuple[float, float, float, float]:
+    if group.extent is None:
+        extents = np.array([shape_extent(s) for s in group.objects.values()],
+                           dtype=np.float64).reshape(-1, 4)
+        if len(extents) == 0:
+            group.extent = (0.0, 0.0, 0.0, 0.0)
+        else:
+            lo = (extents[:, 0:2] - extents[:, 2:4]).min(axis=0)
+            hi = (extents[:, 0:2] + extents[:, 2:4]).max(axis=0)
+            center, half = (lo + hi) * 0.5, (hi - lo) * 0.5
+            group.extent = (float(center[0]), float(center[1]),
+                            float(half[0]), float(half[1]))
+    return group.extent
+
+
+# Group space to world space of an instance
+def instance_matrix(instance: InstanceShape) -> Matrix3x3:
+    return Matrix3x3.rotation(instance.angle).then(Matrix3x3.translation(
+        float(instance.center[0]), float(instance.center[1])))
+
+
+# A copy of a shape moved by a rigid transform, one of rotation and
+# translation only
+def place_shape(shape: ShapeObject, mat: Matrix3x3) -> ShapeObject:
+    placed: ShapeObject = copy_shape(shape)
+    if isinstance(shape, LineShape):
+        placed.begin = Vec2(*mat.apply_point(shape.begin[0], shape.begin[1]))
+        placed.end = Vec2(*mat.apply_point(shape.end[0], shape.end[1]))
+        return placed
+
+    placed.center = Vec2(*mat.apply_point(shape.center[0], shape.center[1]))
+    if isinstance(shape, (RectangleShape, InstanceShape)):
+        placed.angle = shape.angle + math.degrees(math.atan2(mat[1][0], mat[0][0]))
+    return placed
+
+
+# The shapes of an instance as placed in the world, named
+# '<instance>/<shape>', with nested instances expanded as well. mat places
+# the instance itself, for nested instances.
+def flatten_instance(name: str, instance: InstanceShape,
+                     mat: Matrix3x3 = None) -> Iterator[tuple[str, ShapeObject]]:
+    placed: Matrix3x3 = instance_matrix(instance)
+    if mat is not None:
+        placed = placed.then(mat)
+    for child_name, child in instance.group.objects.items():
+        if isinstance(child, InstanceShape):
+            yield from flatten_instance(f'{name}/{child_name}', child, placed)
+        else:
+            yield f'{name}/{child_name}', place_shape(child, placed)
+
+
+# (name, shape) pairs with every instance replaced by its shapes, one at a
+# time, for writing plain project files
+def flattened(objects: Iterable[tuple[str, ShapeObject]]
+              ) -> Iterator[tuple[str, ShapeObject]]:
+    for name, shape in objects:
+        if isinstance(shape, InstanceShape):
+            yield from flatten_instance(name, shape)
+        else:
+            yield name, shape
+
+
+# Uniform grid over world-space bounding boxes, stored as a sorted array of
+# (cell key, row) pairs so both building and querying are vectorized. Boxes
+# spanning too many cells are kept aside and tested by brute force.
+class GridIndex:
+    MAX_CELLS_PER_BOX: int = 16
+    MAX_QUERY_CELLS: int = 256
+
+    def __init__(self, centers: np.ndarray, half_dims: np.ndarray) -> None:
+        self.lo: np.ndarray = centers - half_dims
+        self.hi: np.ndarray = centers + half_dims
+        n: int = len(centers)
+
+        if n > 0:
+            self.origin: np.ndarray = self.lo.min(axis=0)
+            extent: np.ndarray = self.hi.max(axis=0) - self.origin
+        else:
+            self.origin = np.zeros(2)
+            extent = np.zeros(2)
+
+        # About one box per cell for evenly spread boxes, but no smaller than
+        # a typical box so that most boxes land in a single cell
+        typical: float = float(np.median(half_dims.max(axis=1))) * 2.0 if n else 0.0
+        even: float = math.sqrt(max(extent[0] * extent[1], 0.0) / max(n, 1))
+        self.cell: float = max(typical, even, float(extent.max()) / 4096, 1e-12)
+        self.stride: int = int(extent[1] / self.cell) + 2
+
+        c0 = self._cells(self.lo)
+        c1 = self._cells(self.hi)
+        span = c1 - c0 + 1
+        counts = span[:, 0] * span[:, 1]
+        large = counts > self.MAX_CELLS_PER_BOX
+        self.large: np.ndarray = np.flatnonzero(large)
+
+        rows = np.flatnonzero(~large)
+        counts = counts[rows]
+        rows = np.repeat(rows, counts)
+        # Position of every expanded entry within the cells of its box
+        k = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        width = span[rows, 0]
+        ix = c0[rows, 0] + k % width
+        iy = c0[rows, 1] + k // width
+
+        keys = ix * self.stride + iy
+        order = np.argsort(keys, kind='stable')
+        self.keys: np.ndarray = keys[order]
+        self.rows: np.ndarray = rows[order]
+
+    def _cells(self, points: np.ndarray) -> np.ndarray:
+        return np.floor((points - self.origin) / self.cell).astype(np.int64)
+
+    # Sorted rows of the boxes overlapping the given world-space box
+    def query(self, min_x: float, min_y: float,
+              max_x: float, max_y: float) -> np.ndarray:
+        c0 = self._cells(np.array([min_x, min_y]))
+        c1 = self._cells(np.array([max_x, max_y]))
+        c0 = np.maximum(c0, 0)
+        c1 = np.minimum(c1, [self.keys[-1] // self.stride if len(self.keys) else 0,
+                             self.stride - 1])
+
+        if c0[0] > c1[0] or c0[1] > c1[1]:
+            candidates = self.large
+        elif (c1 - c0 + 1).prod() > self.MAX_QUERY_CELLS:
+            # Scanning everything is cheaper than visiting this many cells
+            mask = (self.hi[:, 0] >= min_x) & (self.lo[:, 0] <= max_x) \
+                 & (self.hi[:, 1] >= min_y) & (self.lo[:, 1] <= max_y)
+            return np.flatnonzero(mask)
+        else:
+            ix, iy = np.meshgrid(np.arange(c0[0], c1[0] + 1),
+                                 np.arange(c0[1], c1[1] + 1))
+            keys = (ix * self.stride + iy).ravel()
+            start = np.searchsorted(self.keys, keys, 'left')
+            end = np.searchsorted(self.keys, keys, 'right')
+            parts = [self.rows[s:e] for s, e in zip(start, end) if e > s]
+            candidates = np.concatenate(parts + [self.large])
+
+        lo = self.lo[candidates]
+        hi = self.hi[candidates]
+        mask = (hi[:, 0] >= min_x) & (lo[:, 0] <= max_x) \
+             & (hi[:, 1] >= min_y) & (lo[:, 1] <= max_y)
+        return np.unique(candidates[mask])
+
+
+# Rows stored in the given cells of a sorted (keys, rows) grid, gathered
+# without a Python loop over the cells
+def _cell_rows(sorted_keys: np.ndarray, rows: np.ndarray,
+               keys: np.ndarray) -> np.ndarray:
+    start = np.searchsorted(sorted_keys, keys, 'left')
+    end = np.searchsorted(sorted_keys, keys, 'right')
+    counts = end - start
+    total: int = int(counts.sum())
+    if total == 0:
+        return rows[:0]
+    offsets = np.repeat(start - (np.cumsum(counts) - counts), counts)
+    return rows[offsets + np.arange(total)]
+
+
+# Uniform grid over points for nearest point queries, stored as sorted cell
+# keys like GridIndex. A query looks at the cells around the point and grows
+# the searched box until the closest point found is provably the closest.
+class PointIndex:
+    MAX_QUERY_CELLS: int = 4096
+
+    def __init__(self, points: np.ndarray) -> None:
+        self.points: np.ndarray = points
+        n: int = len(points)
+
+        if n > 0:
+            self.origin: np.ndarray = points.min(axis=0)
+            extent: np.ndarray = points.max(axis=0) - self.origin
+        else:
+            self.origin = np.zeros(2)
+            extent = np.zeros(2)
+
+        # About one point per cell for evenly spread points
+        even: float = math.sqrt(max(extent[0] * extent[1], 0.0) / max(n, 1))
+        self.cell: float = max(even, float(extent.max()) / 4096, 1e-12)
+        self.stride: int = int(extent[1] / self.cell) + 2
+        self.max_cell: np.ndarray = self._cells(self.origin + extent)
+
+        keys = self._keys(self._cells(points))
+        order = np.argsort(keys, kind='stable')
+        self.keys: np.ndarray = keys[order]
+        self.rows: np.ndarray = order
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def _cells(self, points: np.ndarray) -> np.ndarray:
+        return np.floor((points - self.origin) / self.cell).astype(np.int64)
+
+    def _keys(self, cells: np.ndarray) -> np.ndarray:
+        return cells[..., 0] * self.stride + cells[..., 1]
+
+    # Row of the point closest to (x, y) within radius among the rows that
+    # accept (a function from rows to a boolean mask) lets through, with its
+    # squared distance, or (-1, inf) if there is none
+    def nearest(self, x: float, y: float, radius: float,
+                accept=None) -> tuple[int, float]:
+        if len(self.points) == 0:
+            return (-1, math.inf)
+
+        half: float = min(self.cell, radius)
+        while True:
+            c0 = np.maximum(self._cells(np.array([x - half, y - half])), 0)
+            c1 = np.minimum(self._cells(np.array([x + half, y + half])),
+                            self.max_cell)
+            cells = np.prod(np.maximum(c1 - c0 + 1, 0))
+
+            if cells > self.MAX_QUERY_CELLS:
+                candidates = np.arange(len(self.points))
+                half = radius
+            elif cells == 0:
+                candidates = self.rows[:0]
+            else:
+                ix, iy = np.meshgrid(np.arange(c0[0], c1[0] + 1),
+                                     np.arange(c0[1], c1[1] + 1))
+                keys = (ix * self.stride + iy).ravel()
+                candidates = _cell_rows(self.keys, self.rows, keys)
+
+            if accept is not None and len(candidates) > 0:
+                candidates = candidates[accept(candidates)]
+            if len(candidates) > 0:
+                d = self.points[candidates] - (x, y)
+                d2 = np.einsum('ij,ij->i', d, d)
+                best: int = int(np.argmin(d2))
+                best_d2: float = float(d2[best])
+                # Points outside of the searched box are further than half
+                if best_d2 <= min(half, radius) ** 2:
+                    return (int(candidates[best]), best_d2)
+
+            if half >= radius:
+                return (-1, math.inf)
+            half = min(half * 2.0, radius)
+
+
+# World-space bounds of a list of shapes, stored as (N,2) arrays so that
+# culling and picking can run over whole projects in single NumPy calls.
+# Rows follow the order of the shape list passed to rebuild().
+class ShapeGeometry:
+    def __init__(self) -> None:
+        # Bumped on every change, so dependent caches know when to refresh
+        self.version: int = 0
+        # Bumped when the rows themselves change, i.e. on rebuild()
+        self.order_version: int = 0
+        # Bumped when the sizes or depths may have changed, not on translate()
+        self.props_version: int = 0
+        self.centers: np.ndarray = np.zeros((0, 2), dtype=np.float64)
+        self.half_dims: np.ndarray = np.zeros((0, 2), dtype=np.float64)
+        self.depths: np.ndarray = np.zeros(0, dtype=np.int64)
+        self._rows: dict[int, int] = {}
+        self._index: GridIndex = None
+        self._index_version: int = -1
+
+    def __len__(self) -> int:
+        return len(self.centers)
+
+    # Bounds already known, as rows of shape_extent(), can be passed in
+    def rebuild(self, shapes: list[ShapeObject],
+                extents: np.ndarray = None) -> None:
+        if extents is None:
+            extents = np.array([shape_extent(s) for s in shapes],
+                               dtype=np.float64).reshape(-1, 4)
+        self.centers = extents[:, 0:2].copy()
+        self.half_dims = extents[:, 2:4].copy()
+        self.depths = np.array([s.depth for s in shapes], dtype=np.int64)
+        self._rows = {id(s): i for i, s in enumerate(shapes)}
+        self.version += 1
+        self.order_version += 1
+        self.props_version += 1
+
+    # Adds rows for new shapes at the end, without re-reading the others.
+    # Bounds already known, as rows of shape_extent(), can be passed in.
+    def append(self, shapes: list[ShapeObject],
+               extents: np.ndarray = None) -> None:
+        if extents is None:
+            extents = np.array([shape_extent(s) for s in shapes],
+                               dtype=np.float64).reshape(-1, 4)
+        first: int = len(self.centers)
+        self.centers = np.concatenate((self.centers, extents[:, 0:2]))
+        self.half_dims = np.concatenate((self.half_dims, extents[:, 2:4]))
+        self.depths = np.concatenate((self.depths, np.array(
+            [s.depth for s in shapes], dtype=np.int64)))
+        self._rows.update((id(s), first + i) for i, s in enumerate(shapes))
+        self.version += 1
+        self.order_version += 1
+        self.props_version += 1
+
+    # Drops the rows where mask is set. shapes is the list of the remaining
+    # shapes, in order, to renumber the rows.
+    def remove(self, mask: np.ndarray, shapes: list[ShapeObject]) -> None:
+        keep: np.ndarray = ~mask
+        self.centers = self.centers[keep]
+        self.half_dims = self.half_dims[keep]
+        self.depths = self.depths[keep]
+        self._rows = {id(s): i for i, s in enumerate(shapes)}
+        self.version += 1
+        self.order_version += 1
+        self.props_version += 1
+
+    # Moves the row at from_index to to_index, shifting the rows in between.
+    # shapes are the shapes now at the rows between the two, in order.
+    def move(self, from_index: int, to_index: int,
+             shapes: list[ShapeObject]) -> None:
+        lo: int = min(from_index, to_index)
+        hi: int = max(from_index, to_index) + 1
+        order = np.roll(np.arange(lo, hi), -1 if from_index < to_index else 1)
+        self.centers[lo:hi] = self.centers[order]
+        self.half_dims[lo:hi] = self.half_dims[order]
+        self.depths[lo:hi] = self.depths[order]
+        self._rows.update((id(s), lo + i) for i, s in enumerate(shapes))
+        self.version += 1
+        self.order_version += 1
+        self.props_version += 1
+
+    # Re-reads the bounds of the given shapes only, e.g. after they were moved
+    def refresh(self, shapes: list[ShapeObject]) -> None:
+        if len(shapes) == 0:
+            return
+        rows = [self._rows[id(s)] for s in shapes]
+        extents = np.array([shape_extent(s) for s in shapes], dtype=np.float64)
+        self.centers[rows] = extents[:, 0:2]
+        self.half_dims[rows] = extents[:, 2:4]
+        self.depths[rows] = [s.depth for s in shapes]
+        self.version += 1
+        self.props_version += 1
+
+    # Moves the bounds at the given rows by a single (2,) offset or by one
+    # (N,2) row per shape, without re-reading the shapes
+    def translate(self, rows: np.ndarray, offsets: np.ndarray) -> None:
+        self.centers[rows] += offsets
+        self.version += 1
+
+    # Row of the given shape, or -1 if the shape is unknown
+    def row(self, shape: ShapeObject) -> int:
+        return self._rows.get(id(shape), -1)
+
+    # Row of every shape of a name to shape mapping, -1 for unknown shapes
+    def rows_by_name(self, shapes: dict[str, ShapeObject]) -> dict[str, int]:
+        rows = self._rows
+        return {n: rows.get(id(s), -1) for n, s in shapes.items()}
+
+    # Indices of the shapes whose bounds overlap the given world-space box,
+    # found through a grid index that is rebuilt lazily after changes. Meant
+    # for small boxes, see overlapping() for large ones.
+    def query(self, min_x: float, min_y: float,
+              max_x: float, max_y: float) -> np.ndarray:
+        if self._index_version != self.version:
+            self._index = GridIndex(self.centers, self.half_dims)
+            self._index_version = self.version
+        return self._index.query(min_x, min_y, max_x, max_y)
+
+    # The bounds of all rows as a RectArray viewing the same arrays
+    @property
+    def rects(self) -> RectArray:
+        return RectArray(self.centers, self.half_dims)
+
+    # Indices of the shapes whose bounds overlap the given world-space box
+    def overlapping(self, min_x: float, min_y: float,
+                    max_x: float, max_y: float) -> np.ndarray:
+        return np.flatnonzero(self.rects.overlaps_rect(min_x, min_y,
+                                                       max_x, max_y))
+
+
+# Clips the line segment (x0, y0)-(x1, y1) to the given box using the
+# Liang-Barsky algorithm, returns the clipped segment or None if it is
+# entirely outside of the box
+def clip_line(x0: float, y0: float, x1: float, y1: float,
+              min_x: float, min_y: float, max_x: float, max_y: float
+              ) -> tuple[float, float, float, float] | None:
+    dx: float = x1 - x0
+    dy: float = y1 - y0
+    t0: float = 0.0
+    t1: float = 1.0
+
+    for p, q in ((-dx, x0 - min_x), (dx, max_x - x0),
+                 (-dy, y0 - min_y), (dy, max_y - y0)):
+        if p == 0.0:
+            if q < 0.0:
+                return None  # Parallel to and outside of this edge
+            continue
+        t: float = q / p
+        if p < 0.0:
+            if t > t1:
+                return None
+            t0 = max(t0, t)
+        else:
+            if t < t0:
+                return None
+            t1 = min(t1, t)
+
+    return (x0 + t0 * dx, y0 + t0 * dy, x0 + t1 * dx, y0 + t1 * dy)
+
+
+# Clips a polygon, given as a list of (x, y) points, to the given box using
+# the Sutherland-Hodgman algorithm. Convex polygons stay convex.
+def clip_polygon(points: list[tuple[float, float]],
+                 min_x: float, min_y: float, max_x: float, max_y: float
+                 ) -> list[tuple[float, float]]:
+    # Each edge is given as (axis, boundary, keep values above boundary)
+    for axis, bound, above in ((0, min_x, True), (0, max_x, False),
+                               (1, min_y, True), (1, max_y, False)):
+        if len(points) == 0:
+            break
+        clipped = []
+        prev = points[-1]
+        prev_in: bool = (prev[axis] >= bound) == above
+        for p in points:
+            p_in: bool = (p[axis] >= bound) == above
+            if p_in != prev_in:
+                t: float = (bound - prev[axis]) / (p[axis] - prev[axis])
+                clipped.append((prev[0] + t * (p[0] - prev[0]),
+                                prev[1] + t * (p[1] - prev[1])))
+            if p_in:
+                clipped.append(p)
+            prev, prev_in = p, p_in
+        points = clipped
+    return points
+
+
+# Angular spans (start, end) in radians of the parts of a circle that lie
+# inside the given box, with end > start. A circle that is entirely inside
+# the box returns a single span of 2 pi.
+def circle_arcs_in_box(cx: float, cy: float, radius: float,
+                       min_x: float, min_y: float, max_x: float, max_y: float
+                       ) -> list[tuple[float, float]]:
+    def inside(angle: float) -> bool:
+        x: float = cx + radius * math.cos(angle)
+        y: float = cy + radius * math.sin(angle)
+        return min_x <= x <= max_x and min_y <= y <= max_y
+
+    angles = []
+    for bound, lo, hi, vertical in ((min_x, min_y, max_y, True),
+                                    (max_x, min_y, max_y, True),
+                                    (min_y, min_x, max_x, False),
+                                    (max_y, min_x, max_x, False)):
+        d: float = bound - (cx if vertical else cy)
+        if abs(d) > radius:
+            continue
+        # Factored to avoid cancellation for huge radii
+        h: float = math.sqrt((radius - d) * (radius + d))
+        for s in (h, -h):
+            along: float = (cy if vertical else cx) + s
+            if lo <= along <= hi:
+                if vertical:
+                    angles.append(math.atan2(s, d))
+                else:
+                    angles.append(math.atan2(d, s))
+
+    if len(angles) == 0:
+        return [(0.0, math.tau)] if inside(0.0) else []
+
+    angles.sort()
+    spans = []
+    for i, a in enumerate(angles):
+        b: float = angles[i + 1] if i + 1 < len(angles) else angles[0] + math.tau
+        if b - a > 0.0 and inside((a + b) * 0.5):
+            spans.append((a, b))
+    return spans
+
+
+# Mask of the (N,2) points that lie inside the polygon given as (M,2) vertices,
+# using the even-odd rule. Points are sorted by y once so that every edge only
+# visits the points within its own vertical span.
+def points_in_polygon(points: np.ndarray, polygon: np.ndarray) -> np.ndarray:
+    inside = np.zeros(len(points), dtype=bool)
+    if len(points) == 0 or len(polygon) < 3:
+        return inside
+
+    order = np.argsort(points[:, 1], kind='stable')
+    xs = points[order, 0]
+    ys = points[order, 1]
+    hits = np.zeros(len(points), dtype=bool)
+
+    for (x0, y0), (x1, y1) in zip(polygon, np.roll(polygon, -1, axis=0)):
+        if y0 == y1:
+            continue
+        # Half-open span so that shared vertices are only counted once
+        start = np.searchsorted(ys, min(y0, y1), 'right')
+        end = np.searchsorted(ys, max(y0, y1), 'right')
+        if start == end:
+            continue
+        y = ys[start:end]
+        crossing = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+        hits[start:end] ^= xs[start:end] < crossing
+
+    inside[order] = hits
+    return inside
@@ -0,0 +1,283 @@
+import math
+import os
+import logging as log
+import numpy as np
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from pathlib import Path
+from typing import Callable, Iterator, NamedTuple
+from geometry import ShapeGeometry, clip_line, flattened
+from project import *
+import xmlproject
+
+
+# Grid of stage write fields of the given (width, height) in meters. Field
+# (0, 0) is centered on the origin, field (i, j) on origin + (i, j) * size.
+class FieldGrid(NamedTuple):
+    size: tuple[float, float]
+    origin: tuple[float, float] = (0.0, 0.0)
+
+    # (N,2) field indices of the fields containing the given (N,2) points
+    def field_of(self, points: np.ndarray) -> np.ndarray:
+        return np.floor((points - self.origin) / self.size + 0.5).astype(np.int64)
+
+    def center(self, i: int, j: int) -> tuple[float, float]:
+        return (self.origin[0] + i * self.size[0],
+                self.origin[1] + j * self.size[1])
+
+    # World-space (min x, min y, max x, max y) of field (i, j)
+    def bounds(self, i: int, j: int) -> tuple[float, float, float, float]:
+        x, y = self.center(i, j)
+        w, h = self.size[0] * 0.5, self.size[1] * 0.5
+        return (x - w, y - h, x + w, y + h)
+
+
+# Most fields one shape is split across; wider shapes are left whole in the
+# field of their center, as if they could not be split
+MAX_SPLIT_FIELDS: int = 4096
+
+
+# Shapes that can be cut at field boundaries into shapes of the same type:
+# lines, and filled rectangles at right angles
+def splittable(shapes: list[ShapeObject]) -> np.ndarray:
+    return np.array([type(s) is LineShape or
+                     (type(s) is FilledRectangleShape and s.angle % 90.0 == 0.0)
+                     for s in shapes], dtype=bool)
+
+
+# Assignment of the rows of a ShapeGeometry to write fields. Every shape goes
+# to the field of its center, except straddling shapes that can be split,
+# which go to every field their bounds reach. entries lists the rows field
+# after field, in the order they are written, and the rows of field k are
+# entries[starts[k]:starts[k + 1]].
+class Partition:
+    def __init__(self, fields: np.ndarray, starts: np.ndarray,
+                 entries: np.ndarray, straddling: np.ndarray,
+                 split: np.ndarray) -> None:
+        self.fields: np.ndarray = fields          # (F,2) field indices
+        self.starts: np.ndarray = starts          # (F+1,)
+        self.entries: np.ndarray = entries
+        self.straddling: np.ndarray = straddling  # Sorted rows
+        self.split: np.ndarray = split            # Sorted rows, a subset
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def field_rows(self, k: int) -> np.ndarray:
+        return self.entries[self.starts[k]:self.starts[k + 1]]
+
+    # Straddling shapes left whole in the field of their center
+    def flagged(self) -> np.ndarray:
+        return np.setdiff1d(self.straddling, self.split, assume_unique=True)
+
+
+# Assigns shapes to the fields of the grid by their bounds. can_split masks
+# the rows that may be split, see splittable(). Within a field, shapes keep
+# their drawing order, or with order='serpentine' are sorted into bands of
+# the given height (about one shape per band height squared by default)
+# that are scanned alternately left to right and right to left, to keep
+# the beam moves short. Shapes spanning more than MAX_SPLIT_FIELDS fields
+# are not split.
+def partition(geometry: ShapeGeometry, grid: FieldGrid,
+              can_split: np.ndarray = None, order: str = 'drawing',
+              band: float = None) -> Partition:
+    if order not in ('drawing', 'serpentine'):
+        raise RuntimeError(f'unknown field order: {order}')
+    if not min(grid.size) > 0.0:
+        raise RuntimeError(f'write field size must be positive: {grid.size}')
+    centers, half_dims = geometry.centers, geometry.half_dims
+    n: int = len(centers)
+
+    home = grid.field_of(centers)
+    size = np.asarray(grid.size)
+    home_lo = np.asarray(grid.origin) + (home - 0.5) * size
+    straddling = np.flatnonzero(
+        ((centers - half_dims) < home_lo).any(axis=1) |
+        ((centers + half_dims) > home_lo + size).any(axis=1))
+    split = straddling if can_split is None else \
+        straddling[can_split[straddling]]
+
+    # One entry per row and field, split rows spanning several fields
+    first = home.copy()
+    last = home.copy()
+    first[split] = grid.field_of(centers[split] - half_dims[split])
+    last[split] = grid.field_of(centers[split] + half_dims[split])
+    spans = (last - first + 1).prod(axis=1)
+    too_wide = spans[split] > MAX_SPLIT_FIELDS
+    if too_wide.any():
+        log.warning(f'{np.count_nonzero(too_wide)} shapes span more than '
+                    f'{MAX_SPLIT_FIELDS} write fields and were not split')
+        wide = split[too_wide]
+        first[wide] = last[wide] = home[wide]
+        spans[wide] = 1
+        split = split[~too_wide]
+    rows = np.repeat(np.arange(n), spans)
+    k = np.arange(len(rows)) - np.repeat(np.cumsum(spans) - spans, spans)
+    width = np.repeat(last[:, 0] - first[:, 0] + 1, spans)
+    fi = np.repeat(first[:, 0], spans) + k % width
+    fj = np.repeat(first[:, 1], spans) + k // width
+
+    fields, field_ids = np.unique(np.stack((fj, fi), axis=1), axis=0,
+                                  return_inverse=True)
+    field_ids = field_ids.ravel()
+    if order == 'drawing':
+        sort = np.lexsort((rows, field_ids))
+    else:
+        # Split shapes are placed by their center clamped into the field
+        lo = np.asarray(grid.origin) + (np.stack((fi, fj), axis=1) - 0.5) * size
+        points = np.clip(centers[rows], lo, lo + size)
+        if band is None:
+            band = math.sqrt(size[0] * size[1] / max(n / max(len(fields), 1), 1.0))
+        bands = np.floor((points[:, 1] - lo[:, 1]) / band).astype(np.int64)
+        x = np.where(bands % 2 == 0, points[:, 0], -points[:, 0])
+        sort = np.lexsort((rows, x, bands, field_ids))
+
+    starts = np.searchsorted(field_ids[sort], np.arange(len(fields) + 1))
+    return Partition(fields[:, ::-1].copy(), starts, rows[sort], straddling,
+                     split)
+
+
+# The part of a splittable shape inside of the given box, None if nothing
+# of it is left
+def clip_shape(shape: ShapeObject, min_x: float, min_y: float,
+               max_x: float, max_y: float) -> ShapeObject:
+    piece: ShapeObject = copy_shape(shape)
+    if isinstance(shape, LineShape):
+        clipped = clip_line(float(shape.begin[0]), float(shape.begin[1]),
+                            float(shape.end[0]), float(shape.end[1]),
+                            min_x, min_y, max_x, max_y)
+        if clipped is None or clipped[0:2] == clipped[2:4]:
+            return None
+        piece.begin = Vec2(clipped[0], clipped[1])
+        piece.end = Vec2(clipped[2], clipped[3])
+        return piece
+
+    if isinstance(shape, RectangleShape):
+        w, h = float(shape.dimensions[0]) * 0.5, float(shape.dimensions[1]) * 0.5
+        if shape.angle % 180.0 != 0.0:
+            w, h = h, w
+        cx, cy = float(shape.center[0]), float(shape.center[1])
+        x0, x1 = max(cx - w, min_x), min(cx + w, max_x)
+        y0, y1 = max(cy - h, min_y), min(cy + h, max_y)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        dims = (x1 - x0, y1 - y0) if shape.angle % 180.0 == 0.0 else \
+            (y1 - y0, x1 - x0)
+        piece.center = Vec2((x0 + x1) * 0.5, (y0 + y1) * 0.5)
+        piece.dimensions = Vec2(*dims)
+        return piece
+
+    raise TypeError(f'cannot split ShapeObject subclass: {type(shape)}')
+
+
+def _offset_shape(shape: ShapeObject, dx: float, dy: float) -> ShapeObject:
+    moved: ShapeObject = copy_shape(shape)
+    if isinstance(moved, LineShape):
+        moved.begin = Vec2(moved.begin[0] + dx, moved.begin[1] + dy)
+        moved.end = Vec2(moved.end[0] + dx, moved.end[1] + dy)
+    else:
+        moved.center = Vec2(moved.center[0] + dx, moved.center[1] + dy)
+    return moved
+
+
+# Everything a worker process needs to write one field: the shapes to clip
+# to the field bounds, and the offset added to every shape
+class FieldJob(NamedTuple):
+    path: Path
+    settings: ProjectSettings
+    names: list[str]
+    shapes: list[ShapeObject]
+    clip: list[bool]
+    bounds: tuple[float, float, float, float]
+    offset: tuple[float, float]
+
+
+def _write_field(job: FieldJob) -> None:
+    def objects() -> Iterator[tuple[str, ShapeObject]]:
+        for name, shape, clip in zip(job.names, job.shapes, job.clip):
+            if clip:
+                shape = clip_shape(shape, *job.bounds)
+                if shape is None:
+                    continue
+            yield name, shape
+
+    dx, dy = job.offset
+    with open(job.path, 'w') as file:
+        xmlproject.write_objects(file, job.settings, (
+            (name, _offset_shape(shape, dx, dy) if dx != 0.0 or dy != 0.0
+             else shape) for name, shape in flattened(objects())))
+
+
+# Path of the file of field (i, j), next to the given base path
+def field_path(base: Path, i: int, j: int) -> Path:
+    return base.with_name(f'{base.stem}_x{i:+d}_y{j:+d}{base.suffix}')
+
+
+# Writes one xmlproject file per field of a partition, named after base by
+# field_path(). With local=True the shapes of every field are moved so that
+# its center is the origin, as written with the stage at the field center.
+# Fields are written by a pool of worker processes, with only a few fields
+# handed out ahead of time, or in this process if workers is 1. Workers are
+# spawned rather than forked, as forking the threads and window of the app
+# can deadlock them. progress is called with the fraction of fields written
+# before every field is handed out, and stops the export if it raises;
+# fields written so far are kept. Returns the written paths in field order.
+def export_fields(base: Path, settings: ProjectSettings, names: list[str],
+                  shapes: list[ShapeObject], part: Partition, grid: FieldGrid,
+                  local: bool = True, workers: int = None,
+                  progress: Callable[[float], None] = None) -> list[Path]:
+    split = np.zeros(len(shapes), dtype=bool)
+    split[part.split] = True
+    if len(part.flagged()) > 0:
+        log.warning(f'{len(part.flagged())} shapes straddle write field '
+                    'boundaries and were not split')
+
+    def jobs() -> Iterator[FieldJob]:
+        for k, (i, j) in enumerate(part.fields.tolist()):
+            rows = part.field_rows(k).tolist()
+            cx, cy = grid.center(i, j)
+            yield FieldJob(field_path(base, i, j), settings,
+                           [names[r] for r in rows], [shapes[r] for r in rows],
+                           split[rows].tolist(), grid.bounds(i, j),
+                           (-cx, -cy) if local else (0.0, 0.0))
+
+    paths: list[Path] = [field_path(base, i, j) for i, j in part.fields.tolist()]
+
+    def report(written: int) -> None:
+        if progress is not None:
+            progress(written / max(len(paths), 1))
+
+    if workers == 1:
+        for k, job in enumerate(jobs()):
+            report(k)
+            _write_field(job)
+        report(len(paths))
+        log.info(f'Wrote {len(paths)} write field files next to {base}')
+        return paths
+
+    # Loaded here, as the multiprocessing modules slow down the app's startup
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    workers = workers or os.cpu_count() or 1
+    written: int = 0
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        try:
+            ahead: int = workers * 2
+            pending: set[Future] = set()
+            for job in jobs():
+                report(written)
+                if len(pending) >= ahead:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                    written += len(done)
+                pending.add(pool.submit(_write_field, job))
+            for future in pending:
+                future.result()
+                written += 1
+                report(written)
+        except BaseException:
+            pool.shutdown(cancel_futures=True)
+            raise
+    log.info(f'Wrote {len(paths)} write field files next to {base}')
+    return paths
@@ -0,0 +1,164 @@
+import gc
+import math
+import numpy as np
+from contextlib import contextmanager
+from typing import Iterator, NamedTuple
+from vector import Vec2
+from project import *
+
+
+# Shapes made by a generator, with their bounds as (N,4) rows of (center x,
+# center y, half width, half height) in meters like geometry.shape_extent(),
+# so the editor does not have to measure every generated shape again
+class PatternShapes(NamedTuple):
+    shapes: list[ShapeObject]
+    extents: np.ndarray
+
+
+# Pauses garbage collection while many objects are made at once. Shapes
+# cannot form reference cycles, but every allocation counts towards the next
+# collection, which then walks all of the objects made so far.
+@contextmanager
+def paused_gc() -> Iterator[None]:
+    enabled: bool = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+# Makes count shapes of the given type in one pass. vectors maps attribute
+# names to (N,2) arrays, which become Vec2s sharing one buffer, and scalars
+# maps attribute names to (N,) arrays or single values.
+def make_shapes(typ: type, count: int, vectors: dict[str, np.ndarray],
+                scalars: dict[str, np.ndarray | float] = None) -> list[ShapeObject]:
+    with paused_gc():
+        return _make_shapes(typ, count, vectors, scalars or {})
+
+
+def _make_shapes(typ: type, count: int, vectors: dict[str, np.ndarray],
+                 scalars: dict[str, np.ndarray | float]) -> list[ShapeObject]:
+    template: dict = typ().__dict__
+    # Vectors left at their defaults still need one Vec2 per shape
+    vectors = {k: v for k, v in template.items() if isinstance(v, Vec2)} | vectors
+    columns: dict[str, list] = {}
+    for name, values in vectors.items():
+        buffer = np.ones((count, 3), dtype=np.float64)
+        buffer[:, 0:2] = np.asarray(values)[..., 0:2]
+        columns[name] = list(buffer.view(Vec2))
+    for name, values in scalars.items():
+        if np.ndim(values) == 0:
+            template[name] = values
+        else:
+            columns[name] = np.asarray(values).tolist()
+
+    shapes: list[ShapeObject] = []
+    new = object.__new__
+    names = list(columns)
+    for row in zip(*columns.values()):
+        fields = template.copy()
+        fields.update(zip(names, row))
+        shape = new(typ)
+        shape.__dict__ = fields
+        shapes.append(shape)
+    return shapes
+
+
+def _rotate(points: np.ndarray, angle: float) -> np.ndarray:
+    a: float = math.radians(angle)
+    c, s = math.cos(a), math.sin(a)
+    return points @ np.array([[c, s], [-s, c]])
+
+
+# A columns x rows grid of dots with the given (x, y) pitch in meters,
+# rotated by angle degrees about its center. Dots are points, or filled
+# circles if a radius is given.
+def dot_grid(columns: int, rows: int, pitch: tuple[float, float],
+             center: tuple[float, float] = (0.0, 0.0), angle: float = 0.0,
+             radius: float = 0.0) -> PatternShapes:
+    ix, iy = np.meshgrid(np.arange(columns) - (columns - 1) * 0.5,
+                         np.arange(rows) - (rows - 1) * 0.5)
+    points = np.stack((ix.ravel() * pitch[0], iy.ravel() * pitch[1]), axis=1)
+    points = _rotate(points, angle) + center
+
+    n: int = len(points)
+    if radius > 0.0:
+        shapes = make_shapes(FilledCircleShape, n, {'center': points},
+                             {'radius': radius})
+    else:
+        shapes = make_shapes(PointShape, n, {'center': points})
+    half = np.full((n, 2), radius)
+    return PatternShapes(shapes, np.hstack((points, half)))
+
+
+# count parallel lines of the given length, pitch meters apart, at angle
+# degrees from the x axis and centered on center
+def line_grating(count: int, pitch: float, length: float,
+                 center: tuple[float, float] = (0.0, 0.0),
+                 angle: float = 0.0) -> PatternShapes:
+    offsets = (np.arange(count) - (count - 1) * 0.5) * pitch
+    mids = _rotate(np.stack((np.zeros(count), offsets), axis=1), angle) + center
+    half = _rotate(np.array([[length * 0.5, 0.0]]), angle)
+    begins = mids - half
+    ends = mids + half
+
+    shapes = make_shapes(LineShape, count, {'begin': begins, 'end': ends})
+    extents = np.hstack((mids, np.broadcast_to(np.abs(half), (count, 2))))
+    return PatternShapes(shapes, extents)
+
+
+# Outer radii of count rings, starting at first and growing by step: evenly
+# spaced ('linear'), evenly spaced in area ('sqrt', r^2 grows by step^2) or
+# by a constant ratio ('geometric', step is the ratio)
+def ring_radii(count: int, first: float, step: float,
+               law: str = 'linear') -> np.ndarray:
+    k = np.arange(count, dtype=np.float64)
+    if law == 'linear':
+        return first + k * step
+    if law == 'sqrt':
+        return np.sqrt(first * first + k * step * step)
+    if law == 'geometric':
+        return first * np.power(step, k)
+    raise RuntimeError(f'unknown ring radius law: {law}')
+
+
+# Filled rings of the given width, one per outer radius
+def concentric_rings(radii: np.ndarray, width: float,
+                     center: tuple[float, float] = (0.0, 0.0)) -> PatternShapes:
+    radii = np.asarray(radii, dtype=np.float64)
+    inner = np.maximum(radii - width, 0.0)
+    return _annuli(radii, inner, center)
+
+
+# Radii of the zone boundaries of a Fresnel zone plate focusing light of the
+# given wavelength at focal_length, for zones 0 to zones
+def zone_plate_radii(wavelength: float, focal_length: float,
+                     zones: int) -> np.ndarray:
+    n = np.arange(zones + 1, dtype=np.float64)
+    return np.sqrt(n * wavelength * focal_length + (n * wavelength * 0.5) ** 2)
+
+
+# A Fresnel zone plate with the given number of zones, filling every other
+# zone starting with the central disc
+def fresnel_zone_plate(wavelength: float, focal_length: float, zones: int,
+                       center: tuple[float, float] = (0.0, 0.0)) -> PatternShapes:
+    r = zone_plate_radii(wavelength, focal_length, zones)
+    outer = r[1::2]
+    return _annuli(outer, r[0::2][:len(outer)], center)
+
+
+def _annuli(outer: np.ndarray, inner: np.ndarray,
+            center: tuple[float, float]) -> PatternShapes:
+    n: int = len(outer)
+    centers = np.broadcast_to(np.asarray(center, dtype=np.float64), (n, 2))
+    shapes = make_shapes(AnnulusShape, n, {'center': centers},
+                         {'radius': outer, 'inner_radius': inner})
+    extents = np.hstack((centers, np.stack((outer, outer), axis=1)))
+    return PatternShapes(shapes, extents)
+
+
+# Adds the shapes of a pattern to a project, named in one batch
+def add_pattern(project: Project, pattern: PatternShapes) -> list[str]:
+    return project.add_new_shapes(pattern.shapes)
@@ -1,6 +1,10 @@
+from bisect import bisect_left, bisect_right
 from collections import OrderedDict
+from itertools import islice
+from sequence import BlockList
 from vector import Vec2
 from enum import Enum, auto
+from typing import Iterator
 
 
 class ProjectSettings:
@@ -108,6 +112,29 @@ class CircleStairsShape(AnnulusShape):
         super().__init__()
 
 
+# Shapes defined once and placed any number of times by InstanceShapes, in
+# drawing order under names of their own. Instances share the shapes, so a
+# group must not be changed while it is placed.
+class ShapeGroup:
+    def __init__(self, name: str) -> None:
+        self.name: str = name
+        self.objects: OrderedDict[str, ShapeObject] = OrderedDict()
+        # Local (center x, center y, half width, half height) of the bounds
+        # of the shapes, filled in by geometry.shape_extent()
+        self.extent: tuple[float, float, float, float] = None
+
+
+# A placement of a ShapeGroup: its shapes rotated by angle degrees about the
+# group origin, then moved to center. The shapes are only copied out when
+# the project is written, see geometry.flattened().
+class InstanceShape(ShapeObject):
+    def __init__(self, group: ShapeGroup = None) -> None:
+        super().__init__()
+        self.group: ShapeGroup = group
+        self.center: Vec2 = Vec2()
+        self.angle: float = 0.0
+
+
 SHAPE_TYPENAME_TO_TYPE = {
     'PointShape': PointShape,
     'CrossShape': CrossShape,
@@ -122,9 +149,112 @@ SHAPE_TYPENAME_TO_TYPE = {
     'AnnulusShape': AnnulusShape,
     'CirclePolishShape': CirclePolishShape,
     'CircleStairsShape': CircleStairsShape,
+    'InstanceShape': InstanceShape,
 }
 
 
+# Name and type indexes of the shapes in a project, kept up to date by the
+# Project methods that add and remove shapes. Names are kept sorted by their
+# case-folded form, which answers prefix queries like a trie would with two
+# binary searches, while the per-type buckets answer type queries directly.
+class ProjectIndex:
+    # Above this many pending names, sorting everything again is cheaper
+    # than inserting them one by one
+    MAX_INSERTS: int = 64
+
+    def __init__(self) -> None:
+        # Bumped on every change, so dependent caches know when to refresh
+        self.version: int = 0
+        self.keys: list[str] = []   # Case-folded names, sorted
+        self.names: list[str] = []  # Names in the same order as keys
+        self.types: dict[str, set[str]] = {}
+        # Added names not sorted in yet, so that reading a large project
+        # sorts once instead of inserting into the middle of a long list
+        self._pending: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self.names) + len(self._pending)
+
+    def clear(self) -> None:
+        self.keys.clear()
+        self.names.clear()
+        self.types.clear()
+        self._pending.clear()
+        self.version += 1
+
+    def add(self, name: str, shape: ShapeObject) -> None:
+        self._pending.append(name)
+        self.types.setdefault(type(shape).__name__, set()).add(name)
+        self.version += 1
+
+    # Adds many names of shapes of one type
+    def add_many(self, names: list[str], typename: str) -> None:
+        self._pending.extend(names)
+        self.types.setdefault(typename, set()).update(names)
+        self.version += 1
+
+    def remove(self, name: str, shape: ShapeObject) -> None:
+        self._sort()
+        key: str = name.casefold()
+        i: int = bisect_left(self.keys, key)
+        while self.names[i] != name:
+            i += 1
+        del self.keys[i]
+        del self.names[i]
+        self.types[type(shape).__name__].discard(name)
+        self.version += 1
+
+    # Removes many names in one pass over the index, instead of one list
+    # deletion per name
+    def remove_many(self, shapes: dict[str, ShapeObject]) -> None:
+        self._sort()
+        keep = [n not in shapes for n in self.names]
+        self.keys = [k for k, m in zip(self.keys, keep) if m]
+        self.names = [n for n, m in zip(self.names, keep) if m]
+        for name, shape in shapes.items():
+            self.types[type(shape).__name__].discard(name)
+        self.version += 1
+
+    def _sort(self) -> None:
+        if len(self._pending) == 0:
+            return
+
+        if len(self._pending) > self.MAX_INSERTS:
+            names: list[str] = self.names + self._pending
+            names.sort(key=str.casefold)
+            self.names = names
+            self.keys = [n.casefold() for n in names]
+        else:
+            for name in self._pending:
+                key: str = name.casefold()
+                i: int = bisect_right(self.keys, key)
+                self.keys.insert(i, key)
+                self.names.insert(i, name)
+        self._pending.clear()
+
+    # Names starting with the given prefix, ignoring case
+    def with_prefix(self, prefix: str) -> list[str]:
+        self._sort()
+        key: str = prefix.casefold()
+        begin: int = bisect_left(self.keys, key)
+        end: int = bisect_left(self.keys, key + '\U0010ffff', begin)
+        return self.names[begin:end]
+
+    # Names containing the given text, ignoring case. Searching only within
+    # the matches of a shorter text avoids rescanning every name while the
+    # text is being typed.
+    def containing(self, text: str, within: list[str] = None) -> list[str]:
+        self._sort()
+        key: str = text.casefold()
+        if within is None:
+            return [n for k, n in zip(self.keys, self.names) if key in k]
+        return [n for n in within if key in n.casefold()]
+
+    # Names of the shapes of exactly the given type name
+    def of_type(self, typename: str) -> set[str]:
+        return self.types.get(typename, set())
+
+
 class Project:
     SHAPE_NAME_PREFIX = {
         'PointShape': 'Dot',
@@ -135,11 +265,17 @@ class Project:
         'CircleShape': 'Circle',
         'FilledCircleShape': 'Filled circle',
         'AnnulusShape': 'Annulus',
+        'InstanceShape': 'Instance',
     }
 
     def __init__(self) -> None:
         self.settings = ProjectSettings()
         self.objects: OrderedDict = OrderedDict()
+        # Names of the objects in drawing and file order
+        self.order: BlockList = BlockList()
+        self.index: ProjectIndex = ProjectIndex()
+        # Groups placed by InstanceShapes, by name
+        self.groups: dict[str, ShapeGroup] = {}
 
     def _shape_name_prefix(self, shape: ShapeObject) -> str:
         typ: type = type(shape)
@@ -151,11 +287,13 @@ class Project:
             raise TypeError(f'unknown ShapeObject subclass: {typ}')
 
     def _new_shape_name(self, shape: ShapeObject) -> str:
-        prefix = self._shape_name_prefix(shape)
+        return self._new_shape_names(self._shape_name_prefix(shape), 1)[0]
 
-        # TODO: this is a very inefficient way of finding unused indices
+    # The lowest count unused '<prefix> <index>' names. Only the names
+    # starting with the prefix are looked at, found through the index.
+    def _new_shape_names(self, prefix: str, count: int) -> list[str]:
         indices = set()
-        for name in self.objects:
+        for name in self.index.with_prefix(prefix):
             n: str = name
             if n.startswith(prefix):
                 n = n.removeprefix(prefix)
@@ -166,29 +304,99 @@ class Project:
                 except ValueError:
                     pass
 
-        free_index: int = 1
-        if len(indices) > 0:
-            indices = sorted(indices)
-            for i in indices:
-                if i < free_index:
-                    continue
-                if free_index == i:
-                    free_index += 1
-
-        return f'{prefix} {free_index:d}'
-
+        # At least count of the first count + len(indices) numbers are free
+        free = (i for i in range(1, count + len(indices) + 1)
+                if i not in indices)
+        return [f'{prefix} {i:d}' for i in islice(free, count)]
+
+    # Makes a group of the given (name, shape) pairs under the lowest unused
+    # 'Group <index>' name
+    def add_group(self, objects: list[tuple[str, ShapeObject]]) -> ShapeGroup:
+        index: int = 1
+        while f'Group {index}' in self.groups:
+            index += 1
+        group = ShapeGroup(f'Group {index}')
+        group.objects.update(objects)
+        self.groups[group.name] = group
+        return group
 
     def add_new_shape(self, shape: ShapeObject) -> str:
         if not isinstance(shape, ShapeObject):
             raise TypeError('shape is not a subclass of ShapeObject')
 
         name = self._new_shape_name(shape)
-        self.objects[name] = shape
+        self.insert_shape(name, shape)
 
         return name
 
+    # Adds many shapes at once, naming them with one pass over the existing
+    # names per shape type. Returns the new names in the order of shapes.
+    def add_new_shapes(self, shapes: list[ShapeObject]) -> list[str]:
+        groups: dict[type, list[int]] = {}
+        for i, shape in enumerate(shapes):
+            groups.setdefault(type(shape), []).append(i)
+        for typ in groups:
+            if not issubclass(typ, ShapeObject):
+                raise TypeError('shape is not a subclass of ShapeObject')
+
+        names: list[str] = [None] * len(shapes)
+        for typ, indices in groups.items():
+            prefix: str = self._shape_name_prefix(shapes[indices[0]])
+            typ_names = self._new_shape_names(prefix, len(indices))
+            if len(groups) == 1:
+                names = typ_names
+            else:
+                for i, name in zip(indices, typ_names):
+                    names[i] = name
+            self.index.add_many(typ_names, typ.__name__)
+
+        self.objects.update(zip(names, shapes))
+        self.order.extend(names)
+        return names
+
+    # Adds a shape under a given name, e.g. when reading a project file
+    def insert_shape(self, name: str, shape: ShapeObject) -> None:
+        if not isinstance(shape, ShapeObject):
+            raise TypeError('shape is not a subclass of ShapeObject')
+
+        old: ShapeObject = self.objects.get(name)
+        if old is not None:
+            self.index.remove(name, old)
+        else:
+            self.order.append(name)
+        self.objects[name] = shape
+        self.index.add(name, shape)
+
     def remove_shape(self, name: str) -> None:
-        self.objects.pop(name)
+        shape: ShapeObject = self.objects.pop(name)
+        self.index.remove(name, shape)
+        self.order.remove(name)
+
+    def remove_shapes(self, names: list[str]) -> None:
+        removed: dict[str, ShapeObject] = {n: self.objects.pop(n) for n in names}
+        self.index.remove_many(removed)
+        self.order.remove_many(removed.keys())
+
+    # Moves the shape at from_index in the drawing order to to_index
+    def move_shape(self, from_index: int, to_index: int) -> None:
+        self.order.move(from_index, to_index)
+
+    # (name, shape) pairs in drawing order
+    def ordered_objects(self) -> Iterator[tuple[str, ShapeObject]]:
+        objects = self.objects
+        return ((n, objects[n]) for n in self.order)
+
+
+# Copies a shape without going through deepcopy: shapes only hold numbers
+# and Vec2s, so copying the vectors is enough
+def copy_shape(shape: ShapeObject) -> ShapeObject:
+    dupe: ShapeObject = object.__new__(type(shape))
+    fields: dict = shape.__dict__.copy()
+    for k, v in fields.items():
+        if type(v) is Vec2:
+            fields[k] = v.copy()
+    dupe.__dict__ = fields
+    return dupe
 
 def new_project() -> Project:
     settings = ProjectSettings()
@@ -0,0 +1,300 @@
+import sys
+import math
+import time
+import zlib
+import struct
+import argparse
+import logging as log
+import numpy as np
+from pathlib import Path
+from io import IOBase
+from concurrent.futures import ProcessPoolExecutor
+
+import xmlproject
+from project import *
+from geometry import ShapeGeometry, flattened
+
+
+# Offscreen software renderer that draws a Project into a NumPy RGBA buffer,
+# used for thumbnails and previews where no window or GL context exists.
+# Shapes are rasterized by evaluating their signed distance (in pixels) over
+# the pixels of their bounding box, which also gives anti-aliased edges.
+
+BACKGROUND = (0.0, 0.0, 0.0)
+FG_COLOR = (1.0, 0.0, 0.0)
+BG_COLOR = (1.0, 0.0, 0.0)
+BG_ALPHA: float = 0.33
+
+STROKE_PIXELS: float = 1.0
+POINT_RADIUS_PIXELS: float = 1.5
+
+# Shapes smaller than this are splatted as single pixels in one pass
+SPLAT_PIXELS: float = 1.5
+
+
+# Signed distance to the origin-centered box of the given half dimensions
+def _box_distance(qx: np.ndarray, qy: np.ndarray,
+                  hx: float, hy: float) -> np.ndarray:
+    dx = np.abs(qx) - hx
+    dy = np.abs(qy) - hy
+    outside = np.hypot(np.maximum(dx, 0.0), np.maximum(dy, 0.0))
+    inside = np.minimum(np.maximum(dx, dy), 0.0)
+    return outside + inside
+
+
+# Distance to the line segment a-b
+def _segment_distance(px: np.ndarray, py: np.ndarray,
+                      ax: float, ay: float, bx: float, by: float) -> np.ndarray:
+    dx: float = bx - ax
+    dy: float = by - ay
+    length_sq: float = dx * dx + dy * dy
+    if length_sq == 0.0:
+        return np.hypot(px - ax, py - ay)
+    t = np.clip(((px - ax) * dx + (py - ay) * dy) / length_sq, 0.0, 1.0)
+    return np.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+class Rasterizer:
+    def __init__(self, width: int, height: int) -> None:
+        self.width: int = width
+        self.height: int = height
+        # Row 0 is the bottom of the image while drawing, flipped on output
+        self.image: np.ndarray = np.empty((height, width, 3), dtype=np.float32)
+        self.image[:] = BACKGROUND
+
+        # World (meters) to pixel transform
+        self.scale: float = 1.0
+        self.min_x: float = 0.0
+        self.min_y: float = 0.0
+
+    # Fits the given world-space box into the image, keeping aspect ratio
+    def fit(self, min_x: float, min_y: float, max_x: float, max_y: float,
+            margin: int = 4) -> None:
+        w: float = max(max_x - min_x, 1e-12)
+        h: float = max(max_y - min_y, 1e-12)
+        self.scale = min((self.width - 2 * margin) / w,
+                         (self.height - 2 * margin) / h)
+        self.min_x = (min_x + max_x) * 0.5 - self.width * 0.5 / self.scale
+        self.min_y = (min_y + max_y) * 0.5 - self.height * 0.5 / self.scale
+
+    def _to_pixels(self, x: float, y: float) -> tuple[float, float]:
+        return ((x - self.min_x) * self.scale, (y - self.min_y) * self.scale)
+
+    # Blends color over the pixels within the given pixel-space box, with
+    # coverage computed from the signed distance returned by dist(px, py)
+    def _blend(self, x0: float, y0: float, x1: float, y1: float,
+               dist, color: tuple, alpha: float) -> None:
+        i0: int = max(int(math.floor(x0)), 0)
+        j0: int = max(int(math.floor(y0)), 0)
+        i1: int = min(int(math.ceil(x1)) + 1, self.width)
+        j1: int = min(int(math.ceil(y1)) + 1, self.height)
+        if i0 >= i1 or j0 >= j1:
+            return
+
+        px = np.arange(i0, i1, dtype=np.float32) + 0.5
+        py = (np.arange(j0, j1, dtype=np.float32) + 0.5)[:, None]
+        coverage = np.clip(0.5 - dist(px, py), 0.0, 1.0) * alpha
+        coverage = coverage[..., None]
+
+        region = self.image[j0:j1, i0:i1]
+        region += (np.asarray(color, dtype=np.float32) - region) * coverage
+
+    def _draw_disc(self, cx: float, cy: float, radius: float,
+                   inner_radius: float, color: tuple, alpha: float) -> None:
+        def dist(px, py):
+            r = np.hypot(px - cx, py - cy)
+            return np.maximum(r - radius, inner_radius - r)
+        self._blend(cx - radius - 1, cy - radius - 1,
+                    cx + radius + 1, cy + radius + 1, dist, color, alpha)
+
+    def _draw_ring(self, cx: float, cy: float, radius: float,
+                   color: tuple) -> None:
+        hw: float = STROKE_PIXELS * 0.5
+        def dist(px, py):
+            return np.abs(np.hypot(px - cx, py - cy) - radius) - hw
+        e: float = radius + hw + 1
+        self._blend(cx - e, cy - e, cx + e, cy + e, dist, color, 1.0)
+
+    def _draw_segment(self, ax: float, ay: float, bx: float, by: float,
+                      width: float, color: tuple) -> None:
+        hw: float = width * 0.5
+        def dist(px, py):
+            return _segment_distance(px, py, ax, ay, bx, by) - hw
+        self._blend(min(ax, bx) - hw - 1, min(ay, by) - hw - 1,
+                    max(ax, bx) + hw + 1, max(ay, by) + hw + 1,
+                    dist, color, 1.0)
+
+    def _draw_box(self, cx: float, cy: float, hx: float, hy: float,
+                  angle: float, filled: bool) -> None:
+        sin_a: float = math.sin(math.radians(angle))
+        cos_a: float = math.cos(math.radians(angle))
+        ex: float = abs(cos_a) * hx + abs(sin_a) * hy + STROKE_PIXELS + 1
+        ey: float = abs(sin_a) * hx + abs(cos_a) * hy + STROKE_PIXELS + 1
+
+        def box(px, py):
+            # Rotate into the local frame of the box
+            dx = px - cx
+            dy = py - cy
+            qx = dx * cos_a + dy * sin_a
+            qy = -dx * sin_a + dy * cos_a
+            return _box_distance(qx, qy, hx, hy)
+
+        if filled:
+            self._blend(cx - ex, cy - ey, cx + ex, cy + ey,
+                        box, BG_COLOR, BG_ALPHA)
+        hw: float = STROKE_PIXELS * 0.5
+        self._blend(cx - ex, cy - ey, cx + ex, cy + ey,
+                    lambda px, py: np.abs(box(px, py)) - hw, FG_COLOR, 1.0)
+
+    def draw_shape(self, shape: ShapeObject) -> None:
+        s: float = self.scale
+
+        if isinstance(shape, LineShape):
+            l: LineShape = shape
+            ax, ay = self._to_pixels(l.begin[0], l.begin[1])
+            bx, by = self._to_pixels(l.end[0], l.end[1])
+            self._draw_segment(ax, ay, bx, by, STROKE_PIXELS * 2.0, FG_COLOR)
+            return
+
+        cx, cy = self._to_pixels(shape.center[0], shape.center[1])
+
+        if isinstance(shape, CrossShape):
+            hw: float = shape.width * 0.5 * s
+            self._draw_segment(cx - hw, cy, cx + hw, cy, STROKE_PIXELS, FG_COLOR)
+            self._draw_segment(cx, cy - hw, cx, cy + hw, STROKE_PIXELS, FG_COLOR)
+        elif isinstance(shape, PointShape):
+            self._draw_disc(cx, cy, POINT_RADIUS_PIXELS, 0.0, FG_COLOR, 1.0)
+        elif isinstance(shape, CircleShape):
+            radius: float = shape.radius * s
+            if isinstance(shape, AnnulusShape):
+                inner: float = shape.inner_radius * s
+                self._draw_disc(cx, cy, radius, inner, BG_COLOR, BG_ALPHA)
+                self._draw_ring(cx, cy, inner, FG_COLOR)
+            elif isinstance(shape, FilledCircleShape):
+                self._draw_disc(cx, cy, radius, 0.0, BG_COLOR, BG_ALPHA)
+            self._draw_ring(cx, cy, radius, FG_COLOR)
+        elif isinstance(shape, RectangleShape):
+            r: RectangleShape = shape
+            self._draw_box(cx, cy, r.dimensions[0] * 0.5 * s,
+                           r.dimensions[1] * 0.5 * s, r.angle,
+                           isinstance(shape, FilledRectangleShape))
+
+    # Splats the given (N,2) world-space points as single pixels
+    def splat(self, points: np.ndarray) -> None:
+        ix = np.floor((points[:, 0] - self.min_x) * self.scale).astype(np.int64)
+        iy = np.floor((points[:, 1] - self.min_y) * self.scale).astype(np.int64)
+        inside = (ix >= 0) & (ix < self.width) & (iy >= 0) & (iy < self.height)
+        self.image[iy[inside], ix[inside]] = FG_COLOR
+
+    def draw_project(self, proj: Project) -> None:
+        # Instances of groups are drawn as the shapes they place
+        shapes = [s for _, s in flattened(proj.ordered_objects())]
+        geo = ShapeGeometry()
+        geo.rebuild(shapes)
+        if len(geo) == 0:
+            return
+
+        lo = (geo.centers - geo.half_dims).min(axis=0)
+        hi = (geo.centers + geo.half_dims).max(axis=0)
+        self.fit(lo[0], lo[1], hi[0], hi[1])
+
+        size = geo.half_dims.max(axis=1) * 2.0 * self.scale
+        small = size < SPLAT_PIXELS
+        self.splat(geo.centers[small])
+        for i in np.flatnonzero(~small):
+            self.draw_shape(shapes[i])
+
+    # Image as (height, width, 4) RGBA bytes, top row first
+    def rgba(self) -> np.ndarray:
+        out = np.empty((self.height, self.width, 4), dtype=np.uint8)
+        out[..., 0:3] = np.clip(self.image[::-1] * 255.0 + 0.5, 0, 255)
+        out[..., 3] = 255
+        return out
+
+
+def render_project(proj: Project, width: int, height: int) -> np.ndarray:
+    r = Rasterizer(width, height)
+    r.draw_project(proj)
+    return r.rgba()
+
+
+# Writes an (height, width, 4) uint8 RGBA image as PNG
+def write_png(file: IOBase, image: np.ndarray) -> None:
+    height, width, _ = image.shape
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        crc: int = zlib.crc32(tag + data) & 0xffffffff
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', crc)
+
+    # Every row is prefixed by its filter type, 0 (none)
+    rows = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    rows[:, 1:] = image.reshape(height, width * 4)
+
+    file.write(b'\x89PNG\r\n\x1a\n')
+    file.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                          8, 6, 0, 0, 0)))
+    file.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+    file.write(chunk(b'IEND', b''))
+
+
+# Renders the project file at src into a PNG thumbnail at dst, returns the
+# number of shapes drawn
+def thumbnail_file(src: Path, dst: Path, size: int = 256) -> int:
+    with open(src, 'r') as file:
+        proj = xmlproject.from_file(file)
+    image = render_project(proj, size, size)
+    with open(dst, 'wb') as file:
+        write_png(file, image)
+    return len(proj.objects)
+
+
+def _thumbnail_job(job: tuple[Path, Path, int]) -> int:
+    src, dst, size = job
+    try:
+        return thumbnail_file(src, dst, size)
+    except:
+        log.exception(f'Exception occurred when thumbnailing {src}:')
+        return -1
+
+
+# Thumbnails every .xml project in src_dir into dst_dir, in a process pool
+def thumbnail_directory(src_dir: Path, dst_dir: Path, size: int = 256,
+                        workers: int = None) -> int:
+    dst_dir.mkdir(parents=True, exist_ok=True)
+    jobs = [(p, dst_dir / (p.stem + '.png'), size)
+            for p in sorted(src_dir.glob('*.xml'))]
+
+    start: float = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        counts = list(pool.map(_thumbnail_job, jobs, chunksize=4))
+    elapsed: float = time.perf_counter() - start
+
+    done: int = sum(1 for c in counts if c >= 0)
+    shapes: int = sum(c for c in counts if c > 0)
+    log.info(f'Thumbnailed {done}/{len(jobs)} projects ({shapes} shapes) '
+             f'in {elapsed:.2f} s: {done / max(elapsed, 1e-9):.1f} projects/s, '
+             f'{shapes / max(elapsed, 1e-9):.0f} shapes/s')
+    return done
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Render PNG thumbnails of Lyra project files.')
+    parser.add_argument('src', type=Path,
+                        help='project .xml file or directory of them')
+    parser.add_argument('dst', type=Path,
+                        help='output .png file or directory')
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    log.basicConfig(format='%(asctime)s |%(levelname)s| %(message)s',
+                    level=log.INFO, stream=sys.stdout)
+    if args.src.is_dir():
+        thumbnail_directory(args.src, args.dst, args.size, args.workers)
+    else:
+        thumbnail_file(args.src, args.dst, args.size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import numpy as np
+from geometry import ShapeGeometry
+from project import *
+
+
+# Criteria of the object list filter. Criteria left unset (empty text, no
+# type or None ranges) match every shape.
+class ShapeFilter:
+    def __init__(self) -> None:
+        self.text: str = ''
+        self.prefix: bool = False  # Match text at the start of names only
+        self.typename: str = None
+        self.depth: tuple[int, int] = None
+        # Range of the larger side of the shape bounds, in meters
+        self.size: tuple[float, float] = None
+        # World-space (min x, min y, max x, max y) box the bounds must overlap
+        self.region: tuple[float, float, float, float] = None
+
+    def is_active(self) -> bool:
+        return len(self.text) > 0 or self.typename is not None or \
+            self.depth is not None or self.size is not None or \
+            self.region is not None
+
+
+# Finds the rows of a ShapeGeometry whose shapes match a ShapeFilter. Names
+# and types are looked up in the ProjectIndex, depths and sizes through
+# arrays sorted once per change of the shapes, and every criterion keeps its
+# own cached result so that typing in the name field does not recompute the
+# others and vice versa.
+class ShapeSearch:
+    def __init__(self) -> None:
+        self._results: dict[str, tuple[tuple, np.ndarray]] = {}
+        self._matches: tuple[tuple, np.ndarray] = (None, None)
+
+        # Names matching the last text, to narrow down as more is typed
+        self._text: str = None
+        self._text_prefix: bool = False
+        self._text_version: int = -1
+        self._text_names: list[str] = None
+
+        # Row of every shape name, rebuilt when shapes are added or moved
+        self._name_rows: dict[str, int] = None
+        self._name_rows_key: tuple = None
+
+        self._sorted_version: int = -1
+        self._depth_order: np.ndarray = None
+        self._depth_sorted: np.ndarray = None
+        self._size_order: np.ndarray = None
+        self._size_sorted: np.ndarray = None
+
+    # Sorted rows matching the filter, or None when the filter is not active
+    def matches(self, filt: ShapeFilter, index: ProjectIndex,
+                objects: dict[str, ShapeObject],
+                geometry: ShapeGeometry) -> np.ndarray:
+        if not filt.is_active():
+            return None
+
+        parts: list[np.ndarray] = []
+        keys: list[tuple] = []
+
+        if len(filt.text) > 0:
+            key = (filt.text, filt.prefix, index.version, geometry.order_version)
+            parts.append(self._cached('text', key, lambda: self._rows_of(
+                self._match_text(filt.text, filt.prefix, index),
+                objects, geometry, index)))
+            keys.append(key)
+
+        if filt.typename is not None:
+            key = (filt.typename, index.version, geometry.order_version)
+            parts.append(self._cached('type', key, lambda: self._rows_of(
+                index.of_type(filt.typename), objects, geometry, index)))
+            keys.append(key)
+
+        if filt.depth is not None:
+            key = (filt.depth, geometry.props_version)
+            parts.append(self._cached('depth', key, lambda: self._in_range(
+                geometry, 'depth', *filt.depth)))
+            keys.append(key)
+
+        if filt.size is not None:
+            key = (filt.size, geometry.props_version)
+            parts.append(self._cached('size', key, lambda: self._in_range(
+                geometry, 'size', *filt.size)))
+            keys.append(key)
+
+        if filt.region is not None:
+            key = (filt.region, geometry.version)
+            parts.append(self._cached('region', key, lambda: np.sort(
+                geometry.overlapping(*filt.region))))
+            keys.append(key)
+
+        key = tuple(keys)
+        if self._matches[0] != key:
+            rows: np.ndarray = parts[0]
+            for part in parts[1:]:
+                rows = np.intersect1d(rows, part, assume_unique=True)
+            self._matches = (key, rows)
+        return self._matches[1]
+
+    def _cached(self, name: str, key: tuple, compute) -> np.ndarray:
+        entry = self._results.get(name)
+        if entry is None or entry[0] != key:
+            entry = (key, compute())
+            self._results[name] = entry
+        return entry[1]
+
+    def _match_text(self, text: str, prefix: bool,
+                    index: ProjectIndex) -> list[str]:
+        if prefix:
+            names = index.with_prefix(text)
+        elif self._text is not None and not self._text_prefix and \
+                self._text_version == index.version and \
+                self._text.casefold() in text.casefold():
+            # Anything matching the new text also matched the previous one
+            names = index.containing(text, self._text_names)
+        else:
+            names = index.containing(text)
+
+        self._text = text
+        self._text_prefix = prefix
+        self._text_version = index.version
+        self._text_names = names
+        return names
+
+    def _rows_of(self, names, objects: dict[str, ShapeObject],
+                 geometry: ShapeGeometry, index: ProjectIndex) -> np.ndarray:
+        key = (index.version, geometry.order_version)
+        if self._name_rows_key != key:
+            self._name_rows = geometry.rows_by_name(objects)
+            self._name_rows_key = key
+
+        name_rows: dict[str, int] = self._name_rows
+        rows = np.array([name_rows[n] for n in names], dtype=np.int64)
+        return np.sort(rows[rows >= 0])
+
+    def _update_sorted(self, geometry: ShapeGeometry) -> None:
+        if self._sorted_version == geometry.props_version:
+            return
+        sizes: np.ndarray = geometry.half_dims.max(axis=1) * 2.0
+        self._depth_order = np.argsort(geometry.depths, kind='stable')
+        self._depth_sorted = geometry.depths[self._depth_order]
+        self._size_order = np.argsort(sizes, kind='stable')
+        self._size_sorted = sizes[self._size_order]
+        self._sorted_version = geometry.props_version
+
+    # Rows whose depth or size lies within [lo, hi]
+    def _in_range(self, geometry: ShapeGeometry, prop: str,
+                  lo: float, hi: float) -> np.ndarray:
+        self._update_sorted(geometry)
+        if prop == 'depth':
+            order, values = self._depth_order, self._depth_sorted
+        else:
+            order, values = self._size_order, self._size_sorted
+        begin: int = np.searchsorted(values, lo, 'left')
+        end: int = np.searchsorted(values, hi, 'right')
+        return np.sort(order[begin:end])
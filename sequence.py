@@ -0,0 +1,179 @@
+from bisect import bisect_right
+from itertools import chain, islice
+from typing import Any, Iterable, Iterator
+
+
+# A list of unique, hashable items split into blocks of bounded size, with a
+# map from every item to its block. Inserting, removing or moving an item
+# only shifts the items of one block instead of the whole list, looking up
+# the item at an index is a binary search over the block offsets, and the
+# index of an item is found through its block instead of a linear scan. The
+# block offsets are refreshed lazily, so a run of edits costs one refresh.
+class BlockList:
+    # Blocks are split once they reach twice this size
+    BLOCK_SIZE: int = 512
+
+    def __init__(self, items: Iterable = ()) -> None:
+        self._blocks: list[list] = []
+        self._block_of: dict[Any, list] = {}
+        self._len: int = 0
+        # First index of every block and position of every block by id,
+        # None when out of date
+        self._starts: list[int] = None
+        self._positions: dict[int, int] = None
+        self.extend(items)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator:
+        return chain.from_iterable(self._blocks)
+
+    def __contains__(self, item: Any) -> bool:
+        return item in self._block_of
+
+    def __getitem__(self, index: int | slice) -> Any:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step != 1:
+                return list(self)[index]
+            if start >= stop:
+                return []
+            # Start iterating at the block holding the first item
+            self._refresh()
+            b: int = bisect_right(self._starts, start) - 1
+            items = chain.from_iterable(islice(self._blocks, b, None))
+            return list(islice(items, start - self._starts[b],
+                               stop - self._starts[b]))
+
+        block, offset = self._locate(index)
+        return block[offset]
+
+    def _refresh(self) -> None:
+        if self._starts is not None:
+            return
+        starts: list[int] = []
+        n: int = 0
+        for block in self._blocks:
+            starts.append(n)
+            n += len(block)
+        self._starts = starts
+        self._positions = {id(b): i for i, b in enumerate(self._blocks)}
+
+    def _changed(self) -> None:
+        self._starts = None
+        self._positions = None
+
+    # Block holding the given index, and the offset of the index within it
+    def _locate(self, index: int) -> tuple[list, int]:
+        if index < 0:
+            index += self._len
+        if index < 0 or index >= self._len:
+            raise IndexError('BlockList index out of range')
+        self._refresh()
+        b: int = bisect_right(self._starts, index) - 1
+        return self._blocks[b], index - self._starts[b]
+
+    def index(self, item: Any) -> int:
+        block: list = self._block_of[item]
+        self._refresh()
+        return self._starts[self._positions[id(block)]] + block.index(item)
+
+    def append(self, item: Any) -> None:
+        self.insert(self._len, item)
+
+    def extend(self, items: Iterable) -> None:
+        items = list(items)
+        if len(items) == 0:
+            return
+        block_of: dict[Any, list] = self._block_of
+        if len(block_of) > 0 and not block_of.keys().isdisjoint(items) or \
+                len(set(items)) != len(items):
+            raise RuntimeError('items already in BlockList')
+
+        # Fill up the last block, then add whole blocks
+        start: int = 0
+        if len(self._blocks) > 0:
+            block: list = self._blocks[-1]
+            start = max(self.BLOCK_SIZE - len(block), 0)
+            block.extend(items[:start])
+            block_of.update(dict.fromkeys(items[:start], block))
+        for i in range(start, len(items), self.BLOCK_SIZE):
+            block = items[i:i + self.BLOCK_SIZE]
+            self._blocks.append(block)
+            block_of.update(dict.fromkeys(block, block))
+        self._len += len(items)
+        self._changed()
+
+    def insert(self, index: int, item: Any) -> None:
+        if item in self._block_of:
+            raise RuntimeError(f'item already in BlockList: {item}')
+        if index < 0:
+            index = max(index + self._len, 0)
+
+        if index >= self._len:
+            if len(self._blocks) == 0:
+                self._blocks.append([])
+                self._changed()
+            block: list = self._blocks[-1]
+            block.append(item)
+        else:
+            block, offset = self._locate(index)
+            block.insert(offset, item)
+        self._block_of[item] = block
+        self._len += 1
+
+        if len(block) >= self.BLOCK_SIZE * 2:
+            self._split(block)
+        elif self._starts is not None:
+            # Only the offsets of the following blocks move
+            b: int = self._positions[id(block)]
+            for i in range(b + 1, len(self._starts)):
+                self._starts[i] += 1
+
+    def _split(self, block: list) -> None:
+        self._refresh()
+        b: int = self._positions[id(block)]
+        half: int = len(block) // 2
+        tail: list = block[half:]
+        del block[half:]
+        self._blocks.insert(b + 1, tail)
+        for item in tail:
+            self._block_of[item] = tail
+        self._changed()
+
+    def pop(self, index: int = -1) -> Any:
+        block, offset = self._locate(index)
+        item: Any = block.pop(offset)
+        del self._block_of[item]
+        self._len -= 1
+
+        if len(block) == 0:
+            del self._blocks[self._positions[id(block)]]
+            self._changed()
+        elif self._starts is not None:
+            b: int = self._positions[id(block)]
+            for i in range(b + 1, len(self._starts)):
+                self._starts[i] -= 1
+        return item
+
+    def remove(self, item: Any) -> None:
+        self.pop(self.index(item))
+
+    # Moves the item at from_index so that it ends up at to_index, like
+    # insert(to_index, pop(from_index)) on a list
+    def move(self, from_index: int, to_index: int) -> None:
+        item: Any = self.pop(from_index)
+        self.insert(to_index, item)
+
+    # Removes many items in one pass over the list
+    def remove_many(self, items: set) -> None:
+        kept: list = [item for item in self if item not in items]
+        self.clear()
+        self.extend(kept)
+
+    def clear(self) -> None:
+        self._blocks.clear()
+        self._block_of.clear()
+        self._len = 0
+        self._changed()
@@ -0,0 +1,115 @@
+import numpy as np
+from typing import Callable
+from geometry import PointIndex, ShapeGeometry
+from project import *
+
+
+# Snap points of the given shapes: the center of every shape, the corners of
+# rectangles and both ends of lines. centers are the rows of
+# ShapeGeometry.centers for the shapes, and rows their row numbers. Returns
+# the (M,2) points and the (M,) row each point belongs to.
+def snap_points(shapes: list[ShapeObject], centers: np.ndarray,
+                rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    points: list[np.ndarray] = [centers.reshape(-1, 2)]
+    owners: list[np.ndarray] = [np.asarray(rows, dtype=np.int64)]
+
+    rects = [i for i, s in enumerate(shapes) if isinstance(s, RectangleShape)]
+    if len(rects) > 0:
+        dims = np.array([shapes[i].dimensions for i in rects])[:, 0:2] * 0.5
+        angles = np.radians([shapes[i].angle for i in rects])
+        cos_a, sin_a = np.cos(angles), np.sin(angles)
+        for sx, sy in ((-1, -1), (1, -1), (1, 1), (-1, 1)):
+            x = sx * dims[:, 0]
+            y = sy * dims[:, 1]
+            points.append(centers[rects] + np.stack(
+                (x * cos_a - y * sin_a, x * sin_a + y * cos_a), axis=1))
+            owners.append(owners[0][rects])
+
+    lines = [i for i, s in enumerate(shapes) if isinstance(s, LineShape)]
+    if len(lines) > 0:
+        for prop in ('begin', 'end'):
+            points.append(np.array([getattr(shapes[i], prop)
+                                    for i in lines])[:, 0:2])
+            owners.append(owners[0][lines])
+
+    return np.concatenate(points), np.concatenate(owners)
+
+
+# Nearest snap point queries over the snap points of all shapes. Moving
+# shapes only marks their rows stale; the points of stale shapes are
+# re-read when they are next needed and kept in a second, smaller index,
+# until it grows large enough that rebuilding everything is cheaper.
+class SnapIndex:
+    REBUILD_FRACTION: float = 0.25
+
+    def __init__(self) -> None:
+        self.order_version: int = -1
+        self.index: PointIndex = PointIndex(np.zeros((0, 2)))
+        self.owners: np.ndarray = np.zeros(0, dtype=np.int64)
+        self.stale: np.ndarray = np.zeros(0, dtype=bool)
+        # Points re-read since the last rebuild, and whether a row's points
+        # are in there instead of in self.index
+        self.extra: PointIndex = PointIndex(np.zeros((0, 2)))
+        self.extra_owners: np.ndarray = np.zeros(0, dtype=np.int64)
+        self.moved: np.ndarray = np.zeros(0, dtype=bool)
+
+    def rebuild(self, shapes: list[ShapeObject],
+                geometry: ShapeGeometry) -> None:
+        rows = np.arange(len(shapes))
+        points, self.owners = snap_points(shapes, geometry.centers, rows)
+        self.index = PointIndex(points)
+        self.stale = np.zeros(len(shapes), dtype=bool)
+        self.moved = np.zeros(len(shapes), dtype=bool)
+        self.extra = PointIndex(np.zeros((0, 2)))
+        self.extra_owners = np.zeros(0, dtype=np.int64)
+        self.order_version = geometry.order_version
+
+    # Must be called when the shapes at the given rows moved or changed
+    def mark_stale(self, rows: np.ndarray) -> None:
+        if len(self.stale) > 0:
+            self.stale[rows] = True
+
+    # Re-reads the points of the stale shapes that are not excluded
+    def _refresh(self, shapes_at: Callable[[np.ndarray], list[ShapeObject]],
+                 geometry: ShapeGeometry, exclude: np.ndarray) -> None:
+        stale = self.stale if exclude is None else self.stale & ~exclude
+        rows = np.flatnonzero(stale)
+        if len(rows) == 0:
+            return
+
+        keep = ~np.isin(self.extra_owners, rows)
+        points, owners = snap_points(shapes_at(rows), geometry.centers[rows],
+                                     rows)
+        points = np.concatenate((self.extra.points[keep], points))
+        self.extra_owners = np.concatenate((self.extra_owners[keep], owners))
+        self.extra = PointIndex(points)
+        self.moved[rows] = True
+        self.stale[rows] = False
+
+    # Closest snap point to (x, y) within radius, skipping the shapes where
+    # exclude is set, or None if there is none
+    def nearest(self, x: float, y: float, radius: float,
+                shapes_at: Callable[[np.ndarray], list[ShapeObject]],
+                geometry: ShapeGeometry,
+                exclude: np.ndarray = None) -> tuple[float, float]:
+        if self.order_version != geometry.order_version:
+            self.rebuild(shapes_at(np.arange(len(geometry))), geometry)
+        self._refresh(shapes_at, geometry, exclude)
+        if len(self.extra) > len(self.index) * self.REBUILD_FRACTION:
+            self.rebuild(shapes_at(np.arange(len(geometry))), geometry)
+
+        skip = self.stale | self.moved
+        if exclude is not None:
+            skip = skip | exclude
+        row, d2 = self.index.nearest(
+            x, y, radius, lambda r: ~skip[self.owners[r]])
+
+        skip = self.stale if exclude is None else self.stale | exclude
+        extra_row, extra_d2 = self.extra.nearest(
+            x, y, radius, lambda r: ~skip[self.extra_owners[r]])
+
+        if extra_row >= 0 and extra_d2 < d2:
+            return tuple(self.extra.points[extra_row])
+        if row >= 0:
+            return tuple(self.index.points[row])
+        return None
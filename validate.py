@@ -0,0 +1,376 @@
+import numpy as np
+from enum import IntEnum
+from typing import Callable
+from geometry import ShapeGeometry, flatten_instance, shape_extent
+from project import *
+from vector import RectArray
+
+
+# Problems found by the Validator. The ones up to OUT_OF_FIELD are checked
+# per shape, OVERLAP per pair of shapes.
+class Issue(IntEnum):
+    NOT_FINITE = 0    # NaN or infinite coordinates or sizes
+    BAD_DEPTH = 1     # Less than one scan deep
+    EMPTY = 2         # Zero or negative width, radius, dimensions or length
+    INNER_RADIUS = 3  # Annulus inner radius negative or not below the radius
+    OUT_OF_FIELD = 4  # Bounds not entirely inside of the write field
+    OVERLAP = 5       # Overlaps another shape, exposing the overlap twice
+
+
+SHAPE_ISSUES: int = int(Issue.OUT_OF_FIELD) + 1
+
+ISSUE_TEXT: dict[Issue, str] = {
+    Issue.NOT_FINITE: 'coordinates or sizes are not finite',
+    Issue.BAD_DEPTH: 'depth is below one scan',
+    Issue.EMPTY: 'size is zero or negative',
+    Issue.INNER_RADIUS: 'inner radius is not between zero and the radius',
+    Issue.OUT_OF_FIELD: 'lies outside of the write field',
+    Issue.OVERLAP: 'overlaps',
+}
+
+# Issues that make a project unfit for writing, the others are warnings
+ERRORS: frozenset[Issue] = frozenset((Issue.NOT_FINITE, Issue.BAD_DEPTH,
+                                      Issue.EMPTY, Issue.INNER_RADIUS))
+
+# Shape families the per-type checks tell apart
+_KIND_OTHER: int = 0
+_KIND_INSTANCE: int = 1
+_KIND_CROSS: int = 2
+_KIND_LINE: int = 3
+_KIND_RECT: int = 4
+_KIND_CIRCLE: int = 5
+_KIND_FILLED_CIRCLE: int = 6
+_KIND_ANNULUS: int = 7
+
+
+def _kind(shape: ShapeObject) -> int:
+    if isinstance(shape, InstanceShape):
+        return _KIND_INSTANCE
+    if isinstance(shape, CrossShape):
+        return _KIND_CROSS
+    if isinstance(shape, LineShape):
+        return _KIND_LINE
+    if isinstance(shape, RectangleShape):
+        return _KIND_RECT
+    if isinstance(shape, AnnulusShape):
+        return _KIND_ANNULUS
+    if isinstance(shape, FilledCircleShape):
+        return _KIND_FILLED_CIRCLE
+    if isinstance(shape, CircleShape):
+        return _KIND_CIRCLE
+    return _KIND_OTHER
+
+
+# Found problems as parallel arrays, one entry per problem: the row of the
+# shape, the Issue and, for overlaps, the row of the other shape (else -1).
+# An overlap is listed once, under the lower row.
+class Diagnostics:
+    def __init__(self, rows: np.ndarray, issues: np.ndarray,
+                 others: np.ndarray) -> None:
+        self.rows: np.ndarray = rows
+        self.issues: np.ndarray = issues
+        self.others: np.ndarray = others
+        self._masks: tuple[np.ndarray, np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def counts(self) -> dict[Issue, int]:
+        counts = np.bincount(self.issues, minlength=len(Issue))
+        return {issue: int(counts[issue]) for issue in Issue}
+
+    def has_errors(self) -> bool:
+        return bool(np.isin(self.issues, list(ERRORS)).any())
+
+    # Sorted rows of the shapes with the given issue, or with any issue.
+    # Both shapes of an overlap count.
+    def rows_with(self, issue: Issue = None) -> np.ndarray:
+        if issue is None:
+            found = self.issues >= 0
+        else:
+            found = self.issues == issue
+        rows = self.rows[found]
+        if issue is None or issue == Issue.OVERLAP:
+            others = self.others[found]
+            rows = np.concatenate((rows, others[others >= 0]))
+        return np.unique(rows)
+
+    # Rows with an error and rows with only warnings, as masks over n rows
+    def masks(self, n: int) -> tuple[np.ndarray, np.ndarray]:
+        if self._masks is None or len(self._masks[0]) != n:
+            self._masks = self._make_masks(n)
+        return self._masks
+
+    def _make_masks(self, n: int) -> tuple[np.ndarray, np.ndarray]:
+        errors = np.zeros(n, dtype=bool)
+        warnings = np.zeros(n, dtype=bool)
+        is_error = np.isin(self.issues, list(ERRORS))
+        errors[self.rows[is_error]] = True
+        warnings[self.rows[~is_error]] = True
+        others = self.others[~is_error]
+        warnings[others[others >= 0]] = True
+        return errors, warnings & ~errors
+
+    # Text of the problem at index i, naming shapes through the given names
+    # of the rows
+    def describe(self, i: int, name_of: Callable[[int], str]) -> str:
+        issue = Issue(int(self.issues[i]))
+        text: str = f'{name_of(int(self.rows[i]))}: {ISSUE_TEXT[issue]}'
+        if self.others[i] >= 0:
+            text += f' {name_of(int(self.others[i]))}'
+        return text
+
+
+# Checks every shape of a project for per-type problems, for lying outside
+# of the write field and for overlapping other shapes, all vectorized over
+# the bounds of a ShapeGeometry. The results are kept per row: edited shapes
+# are marked dirty and only they are checked again, against all others,
+# until so many are dirty that checking everything is cheaper. Adding,
+# removing or reordering shapes checks everything again.
+class Validator:
+    REVALIDATE_FRACTION: float = 0.25
+
+    def __init__(self) -> None:
+        # World-space (min x, min y, max x, max y) of the write field, None
+        # to skip the field check
+        self.field: tuple[float, float, float, float] = None
+
+        self._order_version: int = -1
+        self._field: tuple[float, float, float, float] = None
+        self._kinds: np.ndarray = np.zeros(0, dtype=np.int8)
+        # (N, SHAPE_ISSUES) flags of the per-shape issues
+        self._flags: np.ndarray = np.zeros((0, SHAPE_ISSUES), dtype=bool)
+        # Overlapping (i, j) rows, i < j
+        self._pairs: np.ndarray = np.zeros((0, 2), dtype=np.int64)
+        self._dirty: np.ndarray = np.zeros(0, dtype=bool)
+        self._diagnostics: Diagnostics = None
+        # Sweep of the bounds as of the last full check, and the rows whose
+        # bounds changed since, which the sweep no longer describes
+        self._sweep: tuple[np.ndarray, np.ndarray, float] = None
+        self._moved: np.ndarray = np.zeros(0, dtype=bool)
+
+    # Forgets all results, so the next validate() checks everything again
+    def reset(self) -> None:
+        self._order_version = -1
+        self._diagnostics = None
+
+    # Must be called when the shapes at the given rows moved or changed.
+    # Rows past the last check are left to the full check that adding them
+    # causes.
+    def mark_dirty(self, rows: np.ndarray) -> None:
+        rows = np.asarray(rows, dtype=np.int64)
+        self._dirty[rows[rows < len(self._dirty)]] = True
+        self._diagnostics = None
+
+    # Whether validate() would have to check anything again
+    def is_stale(self, geometry: ShapeGeometry) -> bool:
+        return self._diagnostics is None or self._field != self.field or \
+            self._order_version != geometry.order_version
+
+    def validate(self, shapes_at: Callable[[np.ndarray], list[ShapeObject]],
+                 geometry: ShapeGeometry) -> Diagnostics:
+        n: int = len(geometry)
+        if self._order_version != geometry.order_version or \
+                len(self._flags) != n:
+            self._validate_all(shapes_at, geometry)
+        else:
+            rows = np.flatnonzero(self._dirty)
+            if len(rows) > n * self.REVALIDATE_FRACTION:
+                self._validate_all(shapes_at, geometry)
+            elif len(rows) > 0:
+                self._validate_rows(rows, shapes_at, geometry)
+            if self._field != self.field:
+                self._flags[:, Issue.OUT_OF_FIELD] = \
+                    self._out_of_field(geometry.rects)
+
+        if self._diagnostics is None or self._field != self.field:
+            self._field = self.field
+            self._diagnostics = self._collect()
+        return self._diagnostics
+
+    def _validate_all(self, shapes_at: Callable[[np.ndarray], list[ShapeObject]],
+                      geometry: ShapeGeometry) -> None:
+        rows = np.arange(len(geometry))
+        shapes = shapes_at(rows)
+        self._kinds = np.array([_kind(s) for s in shapes], dtype=np.int8)
+        self._flags = self._check_shapes(rows, shapes, geometry)
+        self._flags[:, Issue.OUT_OF_FIELD] = self._out_of_field(geometry.rects)
+        pairs = geometry.rects.overlapping_pairs()
+        self._pairs = pairs[self._overlaps(pairs, shapes, rows, geometry)]
+        self._dirty = np.zeros(len(rows), dtype=bool)
+        self._sweep = geometry.rects.sweep()
+        self._moved = np.zeros(len(rows), dtype=bool)
+        self._order_version = geometry.order_version
+        self._diagnostics = None
+
+    def _validate_rows(self, rows: np.ndarray,
+                       shapes_at: Callable[[np.ndarray], list[ShapeObject]],
+                       geometry: ShapeGeometry) -> None:
+        self._flags[rows] = self._check_shapes(rows, shapes_at(rows), geometry)
+        self._flags[rows, Issue.OUT_OF_FIELD] = \
+            self._out_of_field(geometry.rects[rows])
+
+        # Pairs of the dirty rows are found again against all rows: the rows
+        # that did not move through the sweep of the last full check, the
+        # others directly
+        dirty = self._dirty
+        kept = self._pairs[~(dirty[self._pairs[:, 0]] | dirty[self._pairs[:, 1]])]
+        self._moved[rows] = True
+        moved = np.flatnonzero(self._moved)
+        rects = geometry.rects[rows]
+        found = rects.overlapping(geometry.rects, self._sweep)
+        found = found[~self._moved[found[:, 1]]]
+        found_moved = rects.overlapping(geometry.rects[moved])
+        found_moved[:, 1] = moved[found_moved[:, 1]]
+        found = np.concatenate((found, found_moved))
+        found[:, 0] = rows[found[:, 0]]
+        found = found[found[:, 0] != found[:, 1]]
+        found.sort(axis=1)
+        found = np.unique(found, axis=0)
+        if len(found) > 0:
+            involved = np.unique(found)
+            found = found[self._overlaps(found, shapes_at(involved), involved,
+                                         geometry)]
+
+        pairs = np.concatenate((kept, found))
+        self._pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+        self._dirty[rows] = False
+        self._diagnostics = None
+
+    def _check_shapes(self, rows: np.ndarray, shapes: list[ShapeObject],
+                      geometry: ShapeGeometry) -> np.ndarray:
+        flags = np.zeros((len(rows), SHAPE_ISSUES), dtype=bool)
+        centers = geometry.centers[rows]
+        half_dims = geometry.half_dims[rows]
+        kinds = self._kinds[rows]
+
+        flags[:, Issue.NOT_FINITE] = ~(np.isfinite(centers).all(axis=1) &
+                                       np.isfinite(half_dims).all(axis=1))
+        flags[:, Issue.BAD_DEPTH] = geometry.depths[rows] < 1
+
+        # Crosses and circles are as wide as their bounds, lines are empty
+        # when both ends coincide
+        sized = (kinds == _KIND_CROSS) | (kinds >= _KIND_CIRCLE)
+        empty = sized & (half_dims.min(axis=1) <= 0.0)
+        empty |= (kinds == _KIND_LINE) & (half_dims.max(axis=1) <= 0.0)
+
+        # Rotated rectangles can have non-empty bounds with a zero side
+        rects = np.flatnonzero(kinds == _KIND_RECT)
+        if len(rects) > 0:
+            dims = np.array([shapes[i].dimensions[0:2] for i in rects.tolist()],
+                            dtype=np.float64)
+            empty[rects] |= dims.min(axis=1) <= 0.0
+        flags[:, Issue.EMPTY] = empty
+
+        annuli = np.flatnonzero(kinds == _KIND_ANNULUS)
+        if len(annuli) > 0:
+            radii = np.array([(shapes[i].inner_radius, shapes[i].radius)
+                              for i in annuli.tolist()], dtype=np.float64)
+            flags[annuli, Issue.INNER_RADIUS] = \
+                (radii[:, 0] < 0.0) | (radii[:, 0] >= radii[:, 1])
+        return flags
+
+    def _out_of_field(self, rects: RectArray) -> np.ndarray:
+        if self.field is None:
+            return np.zeros(len(rects), dtype=bool)
+        return ~rects.inside_rect(*self.field)
+
+    # Mask of the candidate pairs of overlapping bounds whose shapes really
+    # overlap. shapes are the shapes at the sorted rows, which must include
+    # every row of the pairs. Bounds that merely touch do not overlap unless
+    # one of them is a point or an axis-aligned line. Circles are tested
+    # against the bounds of the other shape, or exactly against another
+    # circle, so shapes beside a circle or inside of the hole of an annulus
+    # or of a circle outline do not overlap it. Instances of groups are tested
+    # by the bounds of the shapes they place.
+    def _overlaps(self, pairs: np.ndarray, shapes: list[ShapeObject],
+                  rows: np.ndarray, geometry: ShapeGeometry) -> np.ndarray:
+        if len(pairs) == 0:
+            return np.zeros(0, dtype=bool)
+        i, j = pairs[:, 0], pairs[:, 1]
+        c, h = geometry.centers, geometry.half_dims
+        overlap = np.minimum(c[i] + h[i], c[j] + h[j]) - \
+            np.maximum(c[i] - h[i], c[j] - h[j])
+        degenerate = (h[i] <= 0.0).any(axis=1) | (h[j] <= 0.0).any(axis=1)
+        keep = ((overlap > 0.0).all(axis=1) | degenerate) & \
+            (overlap >= 0.0).all(axis=1)
+
+        placed = np.flatnonzero(keep & ((self._kinds[i] == _KIND_INSTANCE) |
+                                        (self._kinds[j] == _KIND_INSTANCE)))
+        bounds: dict[int, np.ndarray] = {}
+        for k in placed.tolist():
+            a, b = (self._placed_bounds(int(r), shapes, rows, geometry, bounds)
+                    for r in pairs[k])
+            keep[k] = _bounds_overlap(a, b)
+
+        round_i = self._kinds[i] >= _KIND_CIRCLE
+        round_j = self._kinds[j] >= _KIND_CIRCLE
+        if not (round_i.any() or round_j.any()):
+            return keep
+        holes = self._holes(rows, shapes)
+
+        for a, b, round_a in ((i, j, round_i), (j, i, round_j)):
+            found = np.flatnonzero(keep & round_a)
+            ca, cb = a[found], b[found]
+            d = np.abs(c[cb] - c[ca])
+            nearest = np.hypot(*np.maximum(d - h[cb], 0.0).T)
+            farthest = np.hypot(*(d + h[cb]).T)
+            keep[found] = (nearest < h[ca, 0]) & \
+                (farthest > holes[np.searchsorted(rows, ca)])
+
+        found = np.flatnonzero(keep & round_i & round_j)
+        ci, cj = i[found], j[found]
+        dist = np.hypot(*(c[ci] - c[cj]).T)
+        ri, rj = h[ci, 0], h[cj, 0]
+        keep[found] = (dist < ri + rj) & \
+            (dist + rj > holes[np.searchsorted(rows, ci)]) & \
+            (dist + ri > holes[np.searchsorted(rows, cj)])
+        return keep
+
+    # (N,4) bounds, as rows of shape_extent(), of what the shape at a row
+    # exposes: the shapes placed by an instance, else its own bounds. Placed
+    # bounds are kept in cache, by row.
+    def _placed_bounds(self, row: int, shapes: list[ShapeObject],
+                       rows: np.ndarray, geometry: ShapeGeometry,
+                       cache: dict[int, np.ndarray]) -> np.ndarray:
+        if self._kinds[row] != _KIND_INSTANCE:
+            return np.concatenate((geometry.centers[row],
+                                   geometry.half_dims[row]))[None, :]
+        found = cache.get(row)
+        if found is None:
+            shape = shapes[int(np.searchsorted(rows, row))]
+            found = np.array([shape_extent(s) for _, s in
+                              flatten_instance('', shape)],
+                             dtype=np.float64).reshape(-1, 4)
+            cache[row] = found
+        return found
+
+    # Radius of the unexposed hole of every circle at the sorted rows: the
+    # inner radius of annuli, the whole circle of outlines, else zero
+    def _holes(self, rows: np.ndarray, shapes: list[ShapeObject]) -> np.ndarray:
+        kinds = self._kinds[rows]
+        holes = np.zeros(len(rows), dtype=np.float64)
+        for i in np.flatnonzero(kinds == _KIND_ANNULUS).tolist():
+            holes[i] = shapes[i].inner_radius
+        for i in np.flatnonzero(kinds == _KIND_CIRCLE).tolist():
+            holes[i] = shapes[i].radius
+        return holes
+
+    def _collect(self) -> Diagnostics:
+        rows, issues = np.nonzero(self._flags)
+        pairs = self._pairs
+        return Diagnostics(
+            np.concatenate((rows, pairs[:, 0])),
+            np.concatenate((issues, np.full(len(pairs), int(Issue.OVERLAP)))),
+            np.concatenate((np.full(len(rows), -1, dtype=np.int64), pairs[:, 1])))
+
+
+# Whether any of the (N,4) bounds overlaps any of the (M,4) bounds, as rows
+# of shape_extent(), by the same rule as Validator._overlaps()
+def _bounds_overlap(a: np.ndarray, b: np.ndarray) -> bool:
+    ca, ha = a[:, None, 0:2], a[:, None, 2:4]
+    cb, hb = b[None, :, 0:2], b[None, :, 2:4]
+    overlap = np.minimum(ca + ha, cb + hb) - np.maximum(ca - ha, cb - hb)
+    degenerate = (ha <= 0.0).any(axis=2) | (hb <= 0.0).any(axis=2)
+    return bool((((overlap > 0.0).all(axis=2) | degenerate) &
+                 (overlap >= 0.0).all(axis=2)).any())
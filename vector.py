@@ -1,4 +1,5 @@
-from typing import Any
+import math
+from typing import Any, Iterable, Iterator
 import numpy as np
 from numpy import matrix
 from numpy._typing import ArrayLike, DTypeLike
@@ -51,11 +52,293 @@ class Vec2(np.ndarray):
         return np.arctan2(self[0], self[1])
 
 
+# A 2D vector of two plain floats, for math on single points where the
+# NumPy dispatch of Vec2 costs more than the math itself. Has the same
+# x/y/length/abs/normalized/atan2 API as Vec2 and mixes with it: arithmetic
+# with a Vec2 on either side gives a Point2.
+class Point2:
+    __slots__ = ('x', 'y')
+    # Makes NumPy hand Vec2 <op> Point2 over to the Point2 operators
+    __array_ufunc__ = None
+
+    def __init__(self, x: float = 0.0, y: float = None) -> None:
+        if y is None:
+            if isinstance(x, (Point2, np.ndarray)):
+                x, y = x[0], x[1]
+            else:
+                y = x  # Duplicate values if only a single value is provided
+        self.x: float = float(x)
+        self.y: float = float(y)
+
+    def __repr__(self) -> str:
+        return f'Point2({self.x!r}, {self.y!r})'
+
+    def __iter__(self) -> Iterator[float]:
+        yield self.x
+        yield self.y
+
+    def __len__(self) -> int:
+        return 2
+
+    def __getitem__(self, index: int) -> float:
+        return (self.x, self.y)[index]
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, (Point2, np.ndarray)):
+            return self.x == other[0] and self.y == other[1]
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash((self.x, self.y))
+
+    def __add__(self, other: Any) -> 'Point2':
+        if isinstance(other, Point2):
+            return Point2(self.x + other.x, self.y + other.y)
+        if isinstance(other, np.ndarray):
+            return Point2(self.x + other[0], self.y + other[1])
+        return Point2(self.x + other, self.y + other)
+
+    __radd__ = __add__
+
+    def __sub__(self, other: Any) -> 'Point2':
+        if isinstance(other, Point2):
+            return Point2(self.x - other.x, self.y - other.y)
+        if isinstance(other, np.ndarray):
+            return Point2(self.x - other[0], self.y - other[1])
+        return Point2(self.x - other, self.y - other)
+
+    def __rsub__(self, other: Any) -> 'Point2':
+        if isinstance(other, np.ndarray):
+            return Point2(other[0] - self.x, other[1] - self.y)
+        return Point2(other - self.x, other - self.y)
+
+    def __mul__(self, other: Any) -> 'Point2':
+        if isinstance(other, Point2):
+            return Point2(self.x * other.x, self.y * other.y)
+        if isinstance(other, np.ndarray):
+            return Point2(self.x * other[0], self.y * other[1])
+        return Point2(self.x * other, self.y * other)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other: Any) -> 'Point2':
+        if isinstance(other, Point2):
+            return Point2(self.x / other.x, self.y / other.y)
+        if isinstance(other, np.ndarray):
+            return Point2(self.x / other[0], self.y / other[1])
+        return Point2(self.x / other, self.y / other)
+
+    def __neg__(self) -> 'Point2':
+        return Point2(-self.x, -self.y)
+
+    @property
+    def length(self) -> float:
+        return math.hypot(self.x, self.y)
+
+    @property
+    def abs(self) -> 'Point2':
+        return Point2(abs(self.x), abs(self.y))
+
+    def normalized(self) -> 'Point2':
+        l: float = math.hypot(self.x, self.y)
+        if l == 0.0:
+            return Point2()
+        else:
+            return Point2(self.x / l, self.y / l)
+
+    # Like Vec2.atan2, the angle of the vector measured from the y axis
+    def atan2(self) -> float:
+        return math.atan2(self.x, self.y)
+
+    def round(self) -> 'Point2':
+        return Point2(round(self.x), round(self.y))
+
+    def rotated(self, angle: float) -> 'Point2':
+        sin_angle: float = sin(radians(angle))
+        cos_angle: float = cos(radians(angle))
+        return Point2(self.x * cos_angle - self.y * sin_angle,
+                      self.x * sin_angle + self.y * cos_angle)
+
+    def to_vec2(self) -> Vec2:
+        return Vec2(self.x, self.y)
+
+
+# N 2D vectors held in one contiguous (N,2) array, with the operations of
+# Vec2 applied to all of them at once. An (N,3) array of homogeneous
+# coordinates, like stacked Vec2s, is accepted and its third column dropped.
+class Vec2Array:
+    __array_ufunc__ = None
+
+    def __init__(self, points: ArrayLike = ()) -> None:
+        data = np.asarray(points, dtype=np.float64)
+        if data.size == 0:
+            data = data.reshape(0, 2)
+        if data.ndim != 2 or data.shape[1] not in (2, 3):
+            raise TypeError(f'expected an (N,2) or (N,3) array, got {data.shape}')
+        self.data: np.ndarray = np.ascontiguousarray(data[:, 0:2])
+
+    @staticmethod
+    def from_vec2s(vectors: Iterable) -> 'Vec2Array':
+        return Vec2Array(np.array([(v[0], v[1]) for v in vectors],
+                                  dtype=np.float64).reshape(-1, 2))
+
+    def __repr__(self) -> str:
+        return f'Vec2Array({self.data!r})'
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __iter__(self) -> Iterator[Point2]:
+        return (Point2(x, y) for x, y in self.data.tolist())
+
+    def __getitem__(self, index: Any) -> 'Point2 | Vec2Array':
+        if isinstance(index, (int, np.integer)):
+            x, y = self.data[index]
+            return Point2(x, y)
+        return Vec2Array(self.data[index])
+
+    def __setitem__(self, index: Any, value: Any) -> None:
+        self.data[index] = self._operand(value)
+
+    def __array__(self, dtype: DTypeLike = None, copy: bool = None) -> np.ndarray:
+        return self.data if dtype is None else self.data.astype(dtype)
+
+    # Other operand of an arithmetic operator, broadcastable against data
+    def _operand(self, other: Any) -> Any:
+        if isinstance(other, Vec2Array):
+            return other.data
+        if isinstance(other, Point2):
+            return (other.x, other.y)
+        if isinstance(other, Vec2):
+            return other[0:2]
+        if isinstance(other, np.ndarray) and other.ndim == 1 and \
+                len(other) == len(self.data) != 2:
+            return other[:, None]  # One value per vector
+        return other
+
+    def __add__(self, other: Any) -> 'Vec2Array':
+        return Vec2Array(self.data + self._operand(other))
+
+    __radd__ = __add__
+
+    def __sub__(self, other: Any) -> 'Vec2Array':
+        return Vec2Array(self.data - self._operand(other))
+
+    def __rsub__(self, other: Any) -> 'Vec2Array':
+        return Vec2Array(self._operand(other) - self.data)
+
+    def __mul__(self, other: Any) -> 'Vec2Array':
+        return Vec2Array(self.data * self._operand(other))
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other: Any) -> 'Vec2Array':
+        return Vec2Array(self.data / self._operand(other))
+
+    def __neg__(self) -> 'Vec2Array':
+        return Vec2Array(-self.data)
+
+    def __iadd__(self, other: Any) -> 'Vec2Array':
+        self.data += self._operand(other)
+        return self
+
+    def __isub__(self, other: Any) -> 'Vec2Array':
+        self.data -= self._operand(other)
+        return self
+
+    def __imul__(self, other: Any) -> 'Vec2Array':
+        self.data *= self._operand(other)
+        return self
+
+    def __itruediv__(self, other: Any) -> 'Vec2Array':
+        self.data /= self._operand(other)
+        return self
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.data[:, 0]
+
+    @x.setter
+    def x(self, value: ArrayLike):
+        self.data[:, 0] = value
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.data[:, 1]
+
+    @y.setter
+    def y(self, value: ArrayLike):
+        self.data[:, 1] = value
+
+    @property
+    def length(self) -> np.ndarray:
+        return np.hypot(self.data[:, 0], self.data[:, 1])
+
+    @property
+    def abs(self) -> 'Vec2Array':
+        return Vec2Array(np.abs(self.data))
+
+    # Unit vectors, with zero vectors left at zero like Vec2.normalized()
+    def normalized(self) -> 'Vec2Array':
+        l = self.length
+        scale = np.divide(1.0, l, out=np.zeros_like(l), where=l != 0.0)
+        return Vec2Array(self.data * scale[:, None])
+
+    # Like Vec2.atan2, the angles of the vectors measured from the y axis
+    def atan2(self) -> np.ndarray:
+        return np.arctan2(self.data[:, 0], self.data[:, 1])
+
+    def round(self) -> 'Vec2Array':
+        return Vec2Array(np.round(self.data))
+
+    def rotated(self, angle: float) -> 'Vec2Array':
+        sin_angle: float = sin(radians(angle))
+        cos_angle: float = cos(radians(angle))
+        return Vec2Array(self.data @ np.array([[cos_angle, sin_angle],
+                                               [-sin_angle, cos_angle]]))
+
+    def dot(self, other: Any) -> np.ndarray:
+        o = np.broadcast_to(self._operand(other), self.data.shape)
+        return np.einsum('ij,ij->i', self.data, o)
+
+    # The vectors as (N,3) homogeneous coordinates, as stacked Vec2s would be
+    def homogeneous(self) -> np.ndarray:
+        return np.hstack((self.data, np.ones((len(self.data), 1))))
+
+
+# A 3x3 matrix of an affine transform of homogeneous 2D coordinates.
+# Transforms compose with @ (a @ b applies b first) or then(), and apply to
+# single points or to whole (N,2) arrays of points. The inverse and the
+# coefficients for single points are cached until the matrix changes.
 class Matrix3x3(np.ndarray):
     def __new__(self):
         arr = np.zeros((3,3), dtype=np.float64)
         return super().__new__(self, shape=(3,3), dtype=np.float64, buffer=arr)
 
+    @staticmethod
+    def identity() -> 'Matrix3x3':
+        m = Matrix3x3()
+        m.set_scale(1, 1)
+        return m
+
+    @staticmethod
+    def scaling(x: float, y: float) -> 'Matrix3x3':
+        m = Matrix3x3()
+        m.set_scale(x, y)
+        return m
+
+    @staticmethod
+    def rotation(angle: float) -> 'Matrix3x3':
+        m = Matrix3x3.identity()
+        m.set_rotation(angle)
+        return m
+
+    @staticmethod
+    def translation(x: float, y: float) -> 'Matrix3x3':
+        m = Matrix3x3.identity()
+        m.set_translation(x, y)
+        return m
+
     def set_scale(self, x: float, y: float) -> None:
         self[0][0] = x
         self[1][1] = y
@@ -74,10 +357,63 @@ class Matrix3x3(np.ndarray):
         self[1][2] = y
         self[2][2] = 1
 
+    # This transform followed by the other one
+    def then(self, other: 'Matrix3x3') -> 'Matrix3x3':
+        m = Matrix3x3()
+        np.matmul(other, self, out=m)
+        return m
+
+    # Inverse and single point coefficients, recomputed when any element
+    # changed since they were last asked for
+    def _derived(self) -> tuple:
+        key: bytes = self.tobytes()
+        cache = self.__dict__.get('_cache')
+        if cache is None or cache[0] != key:
+            inverse = Matrix3x3()
+            inverse[:] = linalg.inv(self)
+            cache = (key, inverse, tuple(self[0:2].ravel().tolist()))
+            self.__dict__['_cache'] = cache
+        return cache
+
+    def inverse(self) -> 'Matrix3x3':
+        return self._derived()[1]
+
     def dot_vec2(self, v: Vec2) -> Vec2:
         result = self.dot(v.transpose())
         return Vec2(result[0], result[1])
 
+    # The top two rows as six floats (a, b, c, d, e, f), mapping (x, y) to
+    # (a x + b y + c, d x + e y + f) without going through NumPy
+    def affine(self) -> tuple[float, ...]:
+        return self._derived()[2]
+
+    def apply_point(self, x: float, y: float) -> Point2:
+        a, b, c, d, e, f = self._derived()[2]
+        return Point2(a * x + b * y + c, d * x + e * y + f)
+
+    # Transforms (N,2) points, or (N,3) homogeneous ones, or a Vec2Array
+    # with one matrix product. Returns (N,2) points, written to out if given.
+    def apply(self, points: ArrayLike, out: np.ndarray = None) -> np.ndarray:
+        if isinstance(points, Vec2Array):
+            return Vec2Array(self.apply(points.data, out))
+        m = np.asarray(self)
+        p = np.asarray(points, dtype=np.float64)
+        if out is None:
+            out = np.empty((len(p), 2), dtype=np.float64)
+        np.matmul(p[:, 0:2], m[0:2, 0:2].T, out=out)
+        # Adding the translation as one complex number per point runs over a
+        # flat array, several times faster than broadcasting a (2,) row
+        if out.flags.c_contiguous:
+            z = out.view(np.complex128)
+            z += complex(m[0, 2], m[1, 2])
+        else:
+            out += m[0:2, 2]
+        return out
+
+    def apply_inverse(self, points: ArrayLike,
+                      out: np.ndarray = None) -> np.ndarray:
+        return self.inverse().apply(points, out)
+
 
 class Rect:
     def __init__(self) -> None:
@@ -165,3 +501,179 @@ class Rect:
         if (p.y < aabb_min.y) or (p.y > aabb_max.y):
             return False
         return True
+
+
+# N axis-aligned boxes as (N,2) centers and (N,2) half dimensions, with the
+# tests of Rect applied to all of them in single NumPy calls. The arrays are
+# used as given, so a RectArray can be a view of existing bounds.
+class RectArray:
+    # Candidate pairs tested at once by overlapping_pairs(), bounding the
+    # memory used when many boxes overlap along the sweep axis
+    PAIR_CHUNK: int = 1 << 22
+
+    def __init__(self, centers: ArrayLike = None,
+                 half_dims: ArrayLike = None) -> None:
+        if centers is None:
+            centers = np.zeros((0, 2), dtype=np.float64)
+        self.centers: np.ndarray = np.asarray(centers, dtype=np.float64)
+        if half_dims is None:
+            half_dims = np.zeros_like(self.centers)
+        self.half_dims: np.ndarray = np.asarray(half_dims, dtype=np.float64)
+        if self.centers.shape != self.half_dims.shape or \
+                self.centers.ndim != 2 or self.centers.shape[1] != 2:
+            raise TypeError('expected (N,2) centers and half dimensions, got '
+                            f'{self.centers.shape} and {self.half_dims.shape}')
+
+    @staticmethod
+    def from_bounds(lo: ArrayLike, hi: ArrayLike) -> 'RectArray':
+        lo = np.asarray(lo, dtype=np.float64)
+        hi = np.asarray(hi, dtype=np.float64)
+        return RectArray((lo + hi) * 0.5, np.maximum(hi - lo, 0.0) * 0.5)
+
+    @staticmethod
+    def from_rects(rects: Iterable[Rect]) -> 'RectArray':
+        values = np.array([(r.center[0], r.center[1],
+                            r.half_dims[0], r.half_dims[1]) for r in rects],
+                          dtype=np.float64).reshape(-1, 4)
+        return RectArray(values[:, 0:2], values[:, 2:4])
+
+    def __len__(self) -> int:
+        return len(self.centers)
+
+    def __getitem__(self, index: Any) -> 'Rect | RectArray':
+        if isinstance(index, (int, np.integer)):
+            rect = Rect()
+            rect.center = Vec2(*self.centers[index])
+            rect.half_dims = Vec2(*self.half_dims[index])
+            return rect
+        return RectArray(self.centers[index], self.half_dims[index])
+
+    @property
+    def lo(self) -> np.ndarray:
+        return self.centers - self.half_dims
+
+    @property
+    def hi(self) -> np.ndarray:
+        return self.centers + self.half_dims
+
+    # Mask of the boxes overlapping the given box, touching counts
+    def overlaps_rect(self, min_x: float, min_y: float,
+                      max_x: float, max_y: float) -> np.ndarray:
+        c, h = self.centers, self.half_dims
+        return (np.abs(c[:, 0] - (min_x + max_x) * 0.5) <= h[:, 0] + (max_x - min_x) * 0.5) \
+             & (np.abs(c[:, 1] - (min_y + max_y) * 0.5) <= h[:, 1] + (max_y - min_y) * 0.5)
+
+    # Mask of the boxes lying entirely inside of the given box
+    def inside_rect(self, min_x: float, min_y: float,
+                    max_x: float, max_y: float) -> np.ndarray:
+        lo, hi = self.lo, self.hi
+        return (lo[:, 0] >= min_x) & (lo[:, 1] >= min_y) \
+             & (hi[:, 0] <= max_x) & (hi[:, 1] <= max_y)
+
+    # Mask of the boxes containing the given points: an (N,2) array tests box
+    # i against point i, a single (2,) point is tested against every box
+    def contains_points(self, points: ArrayLike) -> np.ndarray:
+        d = np.abs(np.asarray(points, dtype=np.float64)[..., 0:2] - self.centers)
+        return (d[:, 0] <= self.half_dims[:, 0]) & (d[:, 1] <= self.half_dims[:, 1])
+
+    # (min, max) corners of the box around all boxes, or None if empty
+    def union(self) -> tuple[np.ndarray, np.ndarray]:
+        if len(self.centers) == 0:
+            return None
+        # Reducing each column on its own is much faster than along axis 0
+        c, h = self.centers, self.half_dims
+        lo = np.array([(c[:, i] - h[:, i]).min() for i in (0, 1)])
+        hi = np.array([(c[:, i] + h[:, i]).max() for i in (0, 1)])
+        return lo, hi
+
+    # Sorted (K,2) index pairs (i, j), i < j, of the boxes that overlap each
+    # other. Sweep and prune within horizontal strips: every box is entered
+    # into the strips it spans, each strip is swept along X pairing a box
+    # with the following boxes that start before it ends, and the candidates
+    # are tested along Y. A pair is only kept in the strip where its overlap
+    # begins, so it is reported once.
+    def overlapping_pairs(self) -> np.ndarray:
+        n: int = len(self.centers)
+        if n < 2:
+            return np.zeros((0, 2), dtype=np.int64)
+        lo, hi = self.lo, self.hi
+
+        # About one box per strip width squared, but no thinner than a
+        # typical box, like GridIndex cells
+        extent = hi.max(axis=0) - lo.min(axis=0)
+        typical: float = float(np.median(self.half_dims[:, 1])) * 2.0
+        even: float = math.sqrt(max(extent[0] * extent[1], 0.0) / n)
+        height: float = max(typical, even, float(extent[1]) / 4096, 1e-300)
+        first_strip = np.floor((lo[:, 1] - lo[:, 1].min()) / height).astype(np.int64)
+        last_strip = np.floor((hi[:, 1] - lo[:, 1].min()) / height).astype(np.int64)
+
+        # One entry per box and strip
+        spans = last_strip - first_strip + 1
+        boxes = np.repeat(np.arange(n), spans)
+        strips = np.repeat(first_strip, spans) + np.arange(len(boxes)) \
+            - np.repeat(np.cumsum(spans) - spans, spans)
+
+        # Sorting by strip, then by the rank of the start along X, makes the
+        # candidates of an entry one run of the following entries
+        x_order = np.argsort(lo[:, 0], kind='stable')
+        start_rank = np.empty(n, dtype=np.int64)
+        start_rank[x_order] = np.arange(n)
+        end_rank = np.searchsorted(lo[x_order, 0], hi[:, 0], 'right')
+        keys = strips * (n + 1) + start_rank[boxes]
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        boxes = boxes[order]
+        strips = strips[order]
+        ends = np.searchsorted(keys, strips * (n + 1) + end_rank[boxes], 'left')
+        counts = np.maximum(ends - np.arange(1, len(boxes) + 1), 0)
+
+        parts: list[np.ndarray] = []
+        bounds = np.cumsum(counts)
+        begin: int = 0
+        while begin < len(boxes):
+            # Entries whose candidates fit into one chunk, but at least one
+            base: int = int(bounds[begin - 1]) if begin > 0 else 0
+            end: int = int(np.searchsorted(bounds, base + self.PAIR_CHUNK, 'right'))
+            end = max(end, begin + 1)
+            c = counts[begin:end]
+            a = np.repeat(np.arange(begin, end), c)
+            b = a + 1 + np.arange(len(a)) - np.repeat(np.cumsum(c) - c, c)
+            i, j = boxes[a], boxes[b]
+            keep = (lo[j, 1] <= hi[i, 1]) & (hi[j, 1] >= lo[i, 1]) \
+                 & (strips[a] == np.maximum(first_strip[i], first_strip[j]))
+            parts.append(np.stack((i[keep], j[keep]), axis=1))
+            begin = end
+
+        pairs = np.concatenate(parts)
+        pairs.sort(axis=1)
+        return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+    # The boxes sorted by their lower X bound, as (order, sorted lower
+    # bounds, widest box), for repeated overlapping() queries against them
+    def sweep(self) -> tuple[np.ndarray, np.ndarray, float]:
+        lo_x = self.centers[:, 0] - self.half_dims[:, 0]
+        order = np.argsort(lo_x, kind='stable')
+        widest: float = float(self.half_dims[:, 0].max(initial=0.0)) * 2.0
+        return order, lo_x[order], widest
+
+    # (K,2) index pairs (i, j) of the boxes i of this array overlapping the
+    # boxes j of the other array, sorted by i. Meant for a few boxes against
+    # many: the other boxes are found by a binary search over their starts,
+    # looking back by the widest of them. The sweep of the other boxes can
+    # be passed in when it is already known.
+    def overlapping(self, other: 'RectArray',
+                    sweep: tuple[np.ndarray, np.ndarray, float] = None) -> np.ndarray:
+        if len(self.centers) == 0 or len(other.centers) == 0:
+            return np.zeros((0, 2), dtype=np.int64)
+        order, starts, widest = other.sweep() if sweep is None else sweep
+        lo, hi = self.lo, self.hi
+
+        begin = np.searchsorted(starts, lo[:, 0] - widest, 'left')
+        end = np.searchsorted(starts, hi[:, 0], 'right')
+        counts = end - begin
+        first = np.repeat(np.arange(len(lo)), counts)
+        second = order[np.repeat(begin - (np.cumsum(counts) - counts), counts)
+                       + np.arange(int(counts.sum()))]
+        keep = (np.abs(other.centers[second] - self.centers[first]) <=
+                other.half_dims[second] + self.half_dims[first]).all(axis=1)
+        return np.stack((first[keep], second[keep]), axis=1)
@@ -1,8 +1,86 @@
 import imgui
 import math
+import numpy as np
+import OpenGL.GL as gl
+from contextlib import contextmanager
+from typing import Iterator
 from vector import *
 from util import *
 from project import *
+from geometry import ShapeGeometry, clip_line, clip_polygon, \
+                     circle_arcs_in_box
+
+
+# Binned density image of shapes that are too small to draw individually,
+# uploaded to a texture and cached until the zoom bucket, the binned shapes or
+# the covered region change
+class DensityLayer:
+    def __init__(self, color: tuple[float, float, float]) -> None:
+        self.color: tuple[float, float, float] = color
+        self.key: tuple = None
+        self.texture: int = None
+        self.count: int = 0
+
+        # Covered world-space region (in meters)
+        self.min_x: float = 0.0
+        self.min_y: float = 0.0
+        self.max_x: float = 0.0
+        self.max_y: float = 0.0
+
+    def covers(self, rect: Rect) -> bool:
+        return (self.min_x <= rect.left and self.max_x >= rect.right and
+                self.min_y <= rect.bottom and self.max_y >= rect.top)
+
+    # Bins the given (N,2) world-space points into an RGBA image covering the
+    # rect grown by half a viewport on each side
+    def rebuild(self, key: tuple, points: np.ndarray, rect: Rect,
+                bin_size: float) -> None:
+        self.key = key
+        self.min_x = math.floor((rect.left - rect.width * 0.5) / bin_size) * bin_size
+        self.min_y = math.floor((rect.bottom - rect.height * 0.5) / bin_size) * bin_size
+        nx: int = max(math.ceil(rect.width * 2.0 / bin_size) + 1, 1)
+        ny: int = max(math.ceil(rect.height * 2.0 / bin_size) + 1, 1)
+        self.max_x = self.min_x + nx * bin_size
+        self.max_y = self.min_y + ny * bin_size
+
+        ix = np.floor((points[:, 0] - self.min_x) / bin_size).astype(np.int64)
+        iy = np.floor((points[:, 1] - self.min_y) / bin_size).astype(np.int64)
+        inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        self.count = int(np.count_nonzero(inside))
+
+        # Row 0 is the top of the screen
+        bins = (ny - 1 - iy[inside]) * nx + ix[inside]
+        counts = np.bincount(bins, minlength=nx * ny)
+        occupied = np.flatnonzero(counts)
+
+        # Log scale so that sparse areas are still visible next to dense ones
+        c = counts[occupied].astype(np.float32)
+        alpha = np.log1p(c) / np.log1p(max(float(c.max(initial=0)), 1.0))
+
+        image = np.zeros((ny * nx, 4), dtype=np.uint8)
+        image[occupied, 0:3] = np.array(self.color) * 255
+        image[occupied, 3] = (0.4 + 0.6 * alpha) * 255
+        self._upload(image.reshape(ny, nx, 4))
+
+    def _upload(self, image: np.ndarray) -> None:
+        if self.texture is None:
+            self.texture = gl.glGenTextures(1)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGBA, image.shape[1],
+                        image.shape[0], 0, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE,
+                        np.ascontiguousarray(image))
+
+    def draw(self, view) -> None:
+        if self.count == 0:
+            return
+        dl = imgui.get_background_draw_list()
+        corners = view.to_screen_array(np.array([(self.min_x, self.max_y),
+                                                 (self.max_x, self.min_y)]))
+        (left, top), (right, bottom) = np.round(corners).tolist()
+        dl.add_image(self.texture, (left, top), (right, bottom))
 
 
 class Viewport:
@@ -11,6 +89,20 @@ class Viewport:
     ZOOM_STEP = 0.2
     IMGUI_WHITE: int = 0xffffffff
 
+    # Shapes smaller than this on screen are binned into a density image...
+    LOD_PIXELS: float = 2.0
+    # ...in bins of this size...
+    LOD_BIN_PIXELS: int = 2
+    # ...but only once there are enough of them to make it worthwhile
+    LOD_MIN_SHAPES: int = 256
+    # On-screen size of shapes with empty bounds, such as dots, which are
+    # drawn at a fixed size whatever the zoom
+    POINT_PIXELS: float = 8.0
+
+    # Largest allowed deviation of tessellated arcs from the true circle
+    ARC_TOLERANCE: float = 0.25  # pixels
+    MAX_ARC_SEGMENTS: int = 512
+
     def __init__(self) -> None:
         self.show_grid: bool = True
         self.show_axes: bool = True
@@ -31,28 +123,50 @@ class Viewport:
         # Viewport visible area rect (in meters)
         self.rect: Rect = Rect()
 
-        self.to_screen_matrix: Matrix3x3 = Matrix3x3()
-        self.from_screen_matrix: Matrix3x3 = Matrix3x3()
+        # Set when zoom or pan changed since the last frame
+        self.dirty: bool = True
+
+        self.to_screen_matrix: Matrix3x3 = Matrix3x3.identity()
+        self.from_screen_matrix: Matrix3x3 = Matrix3x3.identity()
+        # Coefficients of both matrices for converting single points
+        self._to_screen: tuple[float, ...] = self.to_screen_matrix.affine()
+        self._from_screen: tuple[float, ...] = self.from_screen_matrix.affine()
 
         # EditableShapes to be drawn
         self.shapes_to_draw: list = []
 
+        # World-space bounds of shapes_to_draw and mask of selected shapes
+        self.geometry: ShapeGeometry = None
+        self.selection_mask: np.ndarray = None
+        self.selection_version: int = 0
+
+        # Screen-space gridlines, cached until the view changes
+        self._grid_key: tuple = None
+        self._grid_cache: list[tuple[int, list]] = []
+
+        # EditableShape under the mouse, drawn on top of everything else
+        self.hovered = None
+
+        self.density: DensityLayer = DensityLayer((1, 0, 0))
+        self.density_selected: DensityLayer = DensityLayer((1, 1, 0))
+
     def _meters_per_pixel(self, zoom: float) -> float:
         m_per_pix = math.pow(10, -zoom)
         m_per_pix /= self.ui_scale
         return m_per_pix
 
+    # World to screen: move the bottom left corner of the visible rect to
+    # the origin, scale to pixels and flip Y, as the viewport renders with
+    # Y pointing down
     def _recompute_matrices(self) -> None:
-        m_per_pix: float = self._meters_per_pixel(self.zoom)
-        pix_per_m: float = 1.0 / m_per_pix
-
-        trans: Vec2 = Vec2(-self.offset) * pix_per_m
-        trans += Vec2(self.width, self.height) * 0.5
-
-        mat = Matrix3x3()
-        mat.set_scale(pix_per_m, pix_per_m)
-        mat.set_translation(trans.x, trans.y)
+        pix_per_m: float = self.pixels_per_meter
+        mat = Matrix3x3.translation(-self.rect.left, -self.rect.bottom) \
+            .then(Matrix3x3.scaling(pix_per_m, -pix_per_m)) \
+            .then(Matrix3x3.translation(0, self.height))
         self.to_screen_matrix = mat
+        self.from_screen_matrix = mat.inverse()
+        self._to_screen = mat.affine()
+        self._from_screen = self.from_screen_matrix.affine()
 
     def _change_zoom(self, new_zoom: float, anchor: Vec2 = None):
         prev_zoom = self.zoom
@@ -70,9 +184,10 @@ class Viewport:
             curr = self._meters_per_pixel(new_zoom)
 
             adiff = adiff * (curr / prev)
-            self.offset = anchor - adiff
+            self.offset = (anchor - adiff).to_vec2()
 
         self.zoom = new_zoom
+        self.dirty = True
 
     def zoom_in(self, steps: int = 1, anchor: Vec2 = None):
         new_zoom = self.zoom + steps * self.ZOOM_STEP
@@ -85,22 +200,48 @@ class Viewport:
     def translate_pixels(self, offset: Vec2) -> None:
         offset.y = -offset.y
         self.offset -= offset * self.meters_per_pixel
+        self.dirty = True
 
     # Transforms a global coordinate (in meters) to screen space (in pixels)
-    def to_screen(self, coord: Vec2) -> Vec2:
-        c = Vec2(coord)
-        c -= Vec2(self.rect.left, self.rect.bottom)
-        c *= self.pixels_per_meter
-        c.y = self.height - c.y  # Viewport renders with flipped Y
-        return c.round()
+    def to_screen(self, coord: Vec2 | Point2) -> Point2:
+        a, b, c, d, e, f = self._to_screen
+        x: float = coord[0]
+        y: float = coord[1]
+        return Point2(round(a * x + b * y + c), round(d * x + e * y + f))
 
     # Transforms a screen coordinate (in pixels) to global space (in meters)
-    def from_screen(self, coord: Vec2) -> Vec2:
-        c = Vec2(coord)
-        c.y = self.height - c.y  # Undo viewport flipped Y
-        c *= self.meters_per_pixel
-        c += Vec2(self.rect.left, self.rect.bottom)
-        return c
+    def from_screen(self, coord: Vec2 | Point2) -> Point2:
+        a, b, c, d, e, f = self._from_screen
+        x: float = coord[0]
+        y: float = coord[1]
+        return Point2(a * x + b * y + c, d * x + e * y + f)
+
+    # Draws and converts points in the local space of the given rigid
+    # transform (rotation and translation only, so that lengths in pixels
+    # stay the same) while the context is open
+    @contextmanager
+    def transformed(self, mat: Matrix3x3) -> Iterator[None]:
+        saved = (self.to_screen_matrix, self.from_screen_matrix,
+                 self._to_screen, self._from_screen)
+        self.to_screen_matrix = mat.then(self.to_screen_matrix)
+        self.from_screen_matrix = self.to_screen_matrix.inverse()
+        self._to_screen = self.to_screen_matrix.affine()
+        self._from_screen = self.from_screen_matrix.affine()
+        try:
+            yield
+        finally:
+            self.to_screen_matrix, self.from_screen_matrix, \
+                self._to_screen, self._from_screen = saved
+
+    # Transforms (N,2) global coordinates to unrounded screen coordinates
+    def to_screen_array(self, coords: np.ndarray,
+                        out: np.ndarray = None) -> np.ndarray:
+        return self.to_screen_matrix.apply(coords, out)
+
+    # Transforms (N,2) screen coordinates to global coordinates
+    def from_screen_array(self, coords: np.ndarray,
+                          out: np.ndarray = None) -> np.ndarray:
+        return self.from_screen_matrix.apply(coords, out)
 
     def update(self) -> None:
         main_viewport = imgui.get_main_viewport()
@@ -129,90 +270,321 @@ class Viewport:
         if self.show_axes:
             self._draw_axes()
 
-        for s in self.shapes_to_draw:
-            s.draw(self)
-
+        self._draw_shapes()
         self._draw_scale()
 
+    def _draw_shapes(self) -> None:
+        geo: ShapeGeometry = self.geometry
+        shapes: list = self.shapes_to_draw
+        if geo is None or len(geo) != len(shapes):
+            for s in shapes:
+                s.draw(self)
+            return
+
+        r: Rect = self.rect
+        visible = geo.overlapping(r.left, r.bottom, r.right, r.top)
+        small = self._lod_small(geo.half_dims[visible], self.pixels_per_meter)
+
+        if np.count_nonzero(small) < self.LOD_MIN_SHAPES:
+            for i in visible:
+                shapes[i].draw(self)
+        else:
+            self._draw_density(geo)
+            for i in visible[~small]:
+                shapes[i].draw(self)
+
+        if self.hovered is not None:
+            self.hovered.draw(self)
+
+    # Mask of the shapes of the given half dims that are drawn smaller than
+    # LOD_PIXELS on screen
+    def _lod_small(self, half_dims: np.ndarray,
+                   pixels_per_meter: float) -> np.ndarray:
+        size = half_dims.max(axis=1, initial=0.0) * 2.0 * pixels_per_meter
+        size[size <= 0.0] = self.POINT_PIXELS
+        return size < self.LOD_PIXELS
+
+    def _draw_density(self, geo: ShapeGeometry) -> None:
+        # Bucket by zoom step so that the cached images survive panning
+        bucket: int = round(self.zoom / self.ZOOM_STEP)
+        m_per_pix: float = self._meters_per_pixel(bucket * self.ZOOM_STEP)
+        bin_size: float = self.LOD_BIN_PIXELS * m_per_pix
+
+        selected = self.selection_mask
+        if selected is None or len(selected) != len(geo):
+            selected = np.zeros(len(geo), dtype=bool)
+
+        key = (geo.version, self.selection_version, bucket, self.ui_scale)
+        layers = ((self.density, ~selected),
+                  (self.density_selected, selected))
+
+        small = None
+        for layer, mask in layers:
+            if layer.key != key or not layer.covers(self.rect):
+                if small is None:
+                    small = self._lod_small(geo.half_dims, 1.0 / m_per_pix)
+                layer.rebuild(key, geo.centers[small & mask], self.rect,
+                              bin_size)
+            layer.draw(self)
+
+    # Screen-space box that primitives are clipped to, grown by a margin so
+    # that thick outlines do not end visibly at the edge of the screen
+    def _clip_box(self, margin: float) -> tuple[float, float, float, float]:
+        margin += 2.0
+        return (-margin, -margin, self.width + margin, self.height + margin)
+
+    # Number of segments needed to approximate an arc of the given on-screen
+    # radius (in pixels) and span (in radians) to within a fraction of a pixel
+    def _arc_segments(self, radius: float, span: float) -> int:
+        step: float = 2.0 * math.sqrt(2.0 * self.ARC_TOLERANCE / max(radius, 1e-9))
+        step = min(step, math.tau / 8)
+        return clamp(math.ceil(span / step), 1, self.MAX_ARC_SEGMENTS)
+
     # Draw a line defined in global coordinate space (in meters)
     def draw_line(self, start: Vec2, end: Vec2, color: int = IMGUI_WHITE,
                   thickness: float = 1.0):
         dl = imgui.get_background_draw_list()
 
-        # TODO: are there clipping issues for big shapes?
         start = self.to_screen(start)
         end = self.to_screen(end)
 
-        dl.add_line(start.x, start.y, end.x, end.y, color, thickness)
+        clipped = clip_line(start.x, start.y, end.x, end.y,
+                            *self._clip_box(thickness))
+        if clipped is not None:
+            dl.add_line(*clipped, color, thickness)
 
     # Draw a circle defined in global coordinate space (in meters)
     def draw_circle(self, center: Vec2, radius: float, color: int = IMGUI_WHITE,
                     filled: bool = False, thickness: float = 1.0):
         dl = imgui.get_background_draw_list()
 
-        # TODO: are there clipping issues for big shapes?
         center = self.to_screen(center)
         radius *= self.pixels_per_meter
-
-        # TODO: derive segments in some smarter way, maybe?
-        segments: int = clamp(round(radius * 2), 8, 512)
+        cx, cy = float(center.x), float(center.y)
+        # Outlines are expected to be a few pixels thick at most, so the box
+        # is not grown by them: that would move the clipped arcs off screen
+        margin: float = 0.0 if filled else thickness * 0.5
+        box = self._clip_box(0.0)
+        min_x, min_y, max_x, max_y = box
+
+        # Entirely on screen, let imgui tessellate the whole circle
+        if (cx - radius - margin >= min_x and cx + radius + margin <= max_x and
+            cy - radius - margin >= min_y and cy + radius + margin <= max_y):
+            segments: int = self._arc_segments(radius, math.tau)
+            if filled:
+                dl.add_circle_filled(cx, cy, radius, color, segments)
+            else:
+                dl.add_circle(cx, cy, radius, color, segments, thickness)
+            return
+
+        # Distances from the center to the nearest and farthest point of box
+        near_x: float = clamp(cx, min_x, max_x) - cx
+        near_y: float = clamp(cy, min_y, max_y) - cy
+        far_x: float = max(abs(min_x - cx), abs(max_x - cx))
+        far_y: float = max(abs(min_y - cy), abs(max_y - cy))
+        near: float = math.hypot(near_x, near_y)
+        far: float = math.hypot(far_x, far_y)
+
+        if near > radius + margin:
+            return  # Entirely off screen
+        if filled and far <= radius:
+            dl.add_rect_filled(*box, color)
+            return
+        if not filled and near >= radius - margin and far <= radius + margin:
+            dl.add_rect_filled(*box, color)  # Thick outline covers the screen
+            return
+
+        spans = circle_arcs_in_box(cx, cy, radius, *box)
+        points = []
+        for a, b in spans:
+            segments: int = self._arc_segments(radius, b - a)
+            for i in range(segments + 1):
+                angle: float = a + (b - a) * i / segments
+                points.append((cx + radius * math.cos(angle),
+                               cy + radius * math.sin(angle)))
+            if not filled:
+                dl.path_clear()
+                for x, y in points:
+                    dl.path_line_to(x, y)
+                dl.path_stroke(color, 0, thickness)
+                points.clear()
 
         if filled:
-            dl.add_circle_filled(center.x, center.y, radius, color, segments)
-        else:
-            dl.add_circle(center.x, center.y, radius, color, segments, thickness)
+            # The visible part of the disc is convex and bounded by the
+            # visible arcs and the box corners inside the circle
+            for x, y in ((min_x, min_y), (max_x, min_y),
+                         (max_x, max_y), (min_x, max_y)):
+                if math.hypot(x - cx, y - cy) < radius:
+                    points.append((x, y))
+            self._fill_convex(points, color)
+
+    # Draw the filled ring between two circles defined in global coordinate
+    # space (in meters). Along every ray from the center the part of the ring
+    # inside of the clip box is one stretch, so the visible ring is covered
+    # by quads between rays: at the angles where either circle crosses the
+    # box or the box has a corner, and in between as often as the arcs need.
+    # Every vertex stays inside of the clip box at any zoom.
+    def draw_annulus(self, center: Vec2, radius: float, inner_radius: float,
+                     color: int = IMGUI_WHITE):
+        if inner_radius <= 0.0:
+            self.draw_circle(center, radius, color, True)
+            return
+        dl = imgui.get_background_draw_list()
+
+        screen = self.to_screen(center)
+        cx, cy = float(screen.x), float(screen.y)
+        outer: float = radius * self.pixels_per_meter
+        inner: float = inner_radius * self.pixels_per_meter
+        box = self._clip_box(0.0)
+        min_x, min_y, max_x, max_y = box
+
+        # Entirely on screen, a thick outline is exact enough
+        if (cx - outer >= min_x and cx + outer <= max_x and
+            cy - outer >= min_y and cy + outer <= max_y):
+            segments: int = self._arc_segments(outer, math.tau)
+            dl.add_circle(cx, cy, (outer + inner) * 0.5, color, segments,
+                          outer - inner)
+            return
+
+        near: float = math.hypot(clamp(cx, min_x, max_x) - cx,
+                                 clamp(cy, min_y, max_y) - cy)
+        far: float = math.hypot(max(abs(min_x - cx), abs(max_x - cx)),
+                                max(abs(min_y - cy), abs(max_y - cy)))
+        if near > outer or far <= inner:
+            return  # Off screen, or the screen is inside of the hole
+        if near >= inner and far <= outer:
+            dl.add_rect_filled(*box, color)
+            return
+
+        corners = ((min_x, min_y), (max_x, min_y), (max_x, max_y), (min_x, max_y))
+        breaks = [math.atan2(y - cy, x - cx) % math.tau for x, y in corners]
+        for r in (inner, outer):
+            for span in circle_arcs_in_box(cx, cy, r, *box):
+                breaks.extend(a % math.tau for a in span)
+        breaks = sorted(set(breaks))
+        breaks.append(breaks[0] + math.tau)
+
+        # Quads between neighboring rays would show seams when antialiased
+        flags = dl.flags
+        dl.flags = flags & ~imgui.DRAW_LIST_ANTI_ALIASED_FILL
+        for a, b in zip(breaks, breaks[1:]):
+            stretch = _ray_stretch(cx, cy, (a + b) * 0.5, inner, outer, box)
+            if b <= a or stretch is None or stretch[1] <= stretch[0]:
+                continue
+            # Stretches end on the box edges or on the same circle all along,
+            # and box edges need no segments in between
+            arc: float = outer if stretch[1] == outer else \
+                inner if stretch[0] == inner else 0.0
+            segments: int = self._arc_segments(arc, b - a) if arc > 0.0 else 1
+            last = None
+            for i in range(segments + 1):
+                angle: float = a + (b - a) * i / segments
+                stretch = _ray_stretch(cx, cy, angle, inner, outer, box)
+                if stretch is None:
+                    last = None
+                    continue
+                dx, dy = math.cos(angle), math.sin(angle)
+                lo, hi = stretch
+                points = (cx + dx * lo, cy + dy * lo, cx + dx * hi, cy + dy * hi)
+                if last is not None:
+                    dl.add_quad_filled(*last[0:2], *points[0:2], *points[2:4],
+                                       *last[2:4], color)
+                last = points
+        dl.flags = flags
 
     # Draw a quad defined in global coordinate space (in meters)
     def draw_quad(self, points: list[Vec2], color: int = IMGUI_WHITE,
                   filled: bool = False, thickness: float = 1.0):
         dl = imgui.get_background_draw_list()
 
-        # TODO: are there clipping issues for big shapes?
         p = [self.to_screen(points[i]) for i in range(4)]
-
-        if filled:
-            dl.add_quad_filled(p[0].x, p[0].y, p[1].x, p[1].y,
-                               p[2].x, p[2].y, p[3].x, p[3].y, color)
+        p = [(float(v.x), float(v.y)) for v in p]
+        min_x, min_y, max_x, max_y = self._clip_box(thickness)
+
+        inside: bool = all(min_x <= x <= max_x and min_y <= y <= max_y
+                           for x, y in p)
+        if inside:
+            if filled:
+                dl.add_quad_filled(*p[0], *p[1], *p[2], *p[3], color)
+            else:
+                dl.add_quad(*p[0], *p[1], *p[2], *p[3], color, thickness)
+        elif filled:
+            self._fill_convex(clip_polygon(p, min_x, min_y, max_x, max_y),
+                              color)
         else:
-            dl.add_quad(p[0].x, p[0].y, p[1].x, p[1].y,
-                        p[2].x, p[2].y, p[3].x, p[3].y, color, thickness)
+            for i in range(4):
+                clipped = clip_line(*p[i], *p[(i + 1) % 4],
+                                    min_x, min_y, max_x, max_y)
+                if clipped is not None:
+                    dl.add_line(*clipped, color, thickness)
+
+    # Fills a convex polygon given as an unordered list of screen points
+    def _fill_convex(self, points: list[tuple[float, float]],
+                     color: int) -> None:
+        if len(points) < 3:
+            return
+        mx: float = sum(x for x, _ in points) / len(points)
+        my: float = sum(y for _, y in points) / len(points)
+        points.sort(key=lambda p: math.atan2(p[1] - my, p[0] - mx))
+
+        dl = imgui.get_background_draw_list()
+        dl.path_clear()
+        for x, y in points:
+            dl.path_line_to(x, y)
+        dl.path_fill_convex(color)
+
+    # Screen-space positions of the visible gridlines at the given world
+    # spacing along one axis (0 for X, 1 for Y), skipping every skip-th line
+    # (the ones covered by major lines)
+    def _grid_positions(self, axis: int, spacing: float,
+                        skip: int = 0) -> np.ndarray:
+        r: Rect = self.rect
+        low, high = (r.left, r.right) if axis == 0 else (r.bottom, r.top)
+        k = np.arange(math.ceil(low / spacing), math.ceil(high / spacing))
+        if skip > 0:
+            k = k[k % skip != 0]
+        points = np.zeros((len(k), 2))
+        points[:, axis] = k * spacing
+        return np.round(self.to_screen_array(points)[:, axis])
+
+    # Spacing of the minor grid lines in meters, major lines are 10x apart
+    def grid_spacing(self) -> float:
+        min_grid_pixels = 6
+        return larger_pow(min_grid_pixels * self.meters_per_pixel, 10)
+
+    def _grid_lines(self) -> list[tuple[int, list]]:
+        key = (self.zoom, float(self.offset[0]), float(self.offset[1]),
+               self.width, self.height, self.ui_scale)
+        if key == self._grid_key:
+            return self._grid_cache
 
-    def _draw_grid(self) -> None:
         color_minor = imgui.get_color_u32_rgba(0.1, 0.1, 0.1, 1)
         color_major = imgui.get_color_u32_rgba(0.2, 0.2, 0.2, 1)
 
-        min_grid_pixels = 6
-        minor_scale = min_grid_pixels * self.meters_per_pixel
-        minor_scale = larger_pow(minor_scale, 10)
+        minor_scale = self.grid_spacing()
         major_scale = minor_scale * 10
 
-        # Vertical minor gridlines
-        x = round_to_next(self.rect.left, minor_scale)
-        while x < self.rect.right:
-            self.draw_line(Vec2(x, self.rect.top), Vec2(x, self.rect.bottom),
-                            color_minor)
-            x += minor_scale
-
-        # Horizontal minor gridlines
-        y = round_to_next(self.rect.bottom, minor_scale)
-        while y < self.rect.top:
-            self.draw_line(Vec2(self.rect.left, y), Vec2(self.rect.right, y),
-                            color_minor)
-            y += minor_scale
-
-        # Vertical major gridlines
-        x = round_to_next(self.rect.left, major_scale)
-        while x < self.rect.right:
-            self.draw_line(Vec2(x, self.rect.top), Vec2(x, self.rect.bottom),
-                            color_major)
-            x += major_scale
-
-        # Horizontal major gridlines
-        y = round_to_next(self.rect.bottom, major_scale)
-        while y < self.rect.top:
-            self.draw_line(Vec2(self.rect.left, y), Vec2(self.rect.right, y),
-                            color_major)
-            y += major_scale
+        w: float = float(self.width)
+        h: float = float(self.height)
+
+        lines = []
+        for color, scale, skip in ((color_minor, minor_scale, 10),
+                                   (color_major, major_scale, 0)):
+            xs = self._grid_positions(0, scale, skip)
+            ys = self._grid_positions(1, scale, skip)
+            segments = [(x, 0.0, x, h) for x in xs.tolist()]
+            segments += [(0.0, y, w, y) for y in ys.tolist()]
+            lines.append((color, segments))
+
+        self._grid_key = key
+        self._grid_cache = lines
+        return lines
+
+    def _draw_grid(self) -> None:
+        dl = imgui.get_background_draw_list()
+        for color, segments in self._grid_lines():
+            for x0, y0, x1, y1 in segments:
+                dl.add_line(x0, y0, x1, y1, color)
 
     def _draw_axes(self) -> None:
         color_axes = imgui.get_color_u32_rgba(0.25, 0.25, 0.25, 1)
@@ -256,4 +628,26 @@ class Viewport:
         text_left = right + 10 * self.ui_scale
         text_size = imgui.calc_text_size(text)
         text_top = bottom - text_size[1] + 4 * self.ui_scale
-        dl.add_text(text_left, text_top, color, text)
\ No newline at end of file
+        dl.add_text(text_left, text_top, color, text)
+
+
+# Distances (lo, hi) from the center along the ray at the given angle between
+# which the ray is inside of both the ring between the radii and the box, lo
+# equal to hi where the ring is outside of the box, or None if the ray misses
+# the box
+def _ray_stretch(cx: float, cy: float, angle: float, inner: float,
+                 outer: float, box: tuple[float, float, float, float]
+                 ) -> tuple[float, float]:
+    t0, t1 = 0.0, math.inf
+    for c, d, lo, hi in ((cx, math.cos(angle), box[0], box[2]),
+                         (cy, math.sin(angle), box[1], box[3])):
+        if abs(d) < 1e-12:
+            if not lo <= c <= hi:
+                return None
+            continue
+        a, b = (lo - c) / d, (hi - c) / d
+        t0 = max(t0, min(a, b))
+        t1 = min(t1, max(a, b))
+    if t0 > t1:
+        return None
+    return clamp(inner, t0, t1), clamp(outer, t0, t1)
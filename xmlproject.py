@@ -1,9 +1,19 @@
+import os
 import logging as log
-from xml.dom.minidom import Node, Document, Element, parse
+from xml.dom.minidom import Node, Document, Element
+from xml.parsers import expat
 from collections import OrderedDict
 from __version__ import __version__
 from io import IOBase
+from typing import Callable, Iterable, Iterator
 from project import *
+from geometry import flattened
+
+
+# Shapes written between progress reports of to_file()
+PROGRESS_STEP: int = 4096
+# Bytes (or characters) read at a time by from_file()
+READ_SIZE: int = 1 << 16
 
 
 def _append_children(node: Node, children: list[Node]) -> Node:
@@ -94,29 +104,33 @@ def _shape_to_dom(shape: ShapeObject, name: str, doc: Document) -> Element:
     return elem
 
 
-def _parse_xml_str(elem: Element, attr: str) -> str:
-    a = elem.attributes[attr]
-    return a.value
+# Attributes of an element by name, as the parsers below read them
+def _xml_attributes(elem: Element) -> dict[str, str]:
+    return dict(elem.attributes.items())
+
+
+def _parse_xml_str(attrs: dict[str, str], attr: str) -> str:
+    return attrs[attr]
 
 
-def _parse_xml_vec2(elem: Element, attr: str) -> Vec2:
-    a: str = _parse_xml_str(elem, attr)
+def _parse_xml_vec2(attrs: dict[str, str], attr: str) -> Vec2:
+    a: str = _parse_xml_str(attrs, attr)
     x, y = a.split(' ')
     return Vec2(float(x), float(y))
 
 
-def _parse_xml_float(elem: Element, attr: str) -> float:
-    a: str = _parse_xml_str(elem, attr)
+def _parse_xml_float(attrs: dict[str, str], attr: str) -> float:
+    a: str = _parse_xml_str(attrs, attr)
     return float(a)
 
 
-def _parse_xml_int(elem: Element, attr: str) -> int:
-    a: str = _parse_xml_str(elem, attr)
+def _parse_xml_int(attrs: dict[str, str], attr: str) -> int:
+    a: str = _parse_xml_str(attrs, attr)
     return int(a)
 
 
-def _parse_xml_bool(elem: Element, attr: str) -> bool:
-    a: str = _parse_xml_str(elem, attr)
+def _parse_xml_bool(attrs: dict[str, str], attr: str) -> bool:
+    a: str = _parse_xml_str(attrs, attr)
     if a.lower() == 'false':
         return False
     elif a.lower() == 'true':
@@ -125,47 +139,51 @@ def _parse_xml_bool(elem: Element, attr: str) -> bool:
 
 
 def _shape_from_dom(elem: Element) -> tuple[str, ShapeObject]:
-    shape: ShapeObject = _xml_tag_shape(elem.tagName)
+    return _shape_from_xml(elem.tagName, _xml_attributes(elem))
+
+
+def _shape_from_xml(tag: str, attrs: dict[str, str]) -> tuple[str, ShapeObject]:
+    shape: ShapeObject = _xml_tag_shape(tag)
     if shape is None:
-        log.warning(f'Skipping unparseable elememnt: {elem}')
+        log.warning(f'Skipping unparseable elememnt: {tag}')
         return (None, None)
 
-    name: str = _parse_xml_str(elem, 'Name')
-    depth_unit: str = _parse_xml_str(elem, 'DepthUnit')
+    name: str = _parse_xml_str(attrs, 'Name')
+    depth_unit: str = _parse_xml_str(attrs, 'DepthUnit')
     if depth_unit != 'scan':
-        log.warning(f'Unexpected DepthUnit ({depth_unit}) for elem: {elem}')
-    shape.depth = _parse_xml_int(elem, 'Depth')
+        log.warning(f'Unexpected DepthUnit ({depth_unit}) for element: {tag}')
+    shape.depth = _parse_xml_int(attrs, 'Depth')
 
     if isinstance(shape, (PointShape, RectangleShape, CircleShape)):
-        shape.center = _parse_xml_vec2(elem, 'Center')
+        shape.center = _parse_xml_vec2(attrs, 'Center')
 
     if isinstance(shape, LineShape):
         l: LineShape = shape
-        l.begin = _parse_xml_vec2(elem, 'Begin')
-        l.end = _parse_xml_vec2(elem, 'End')
+        l.begin = _parse_xml_vec2(attrs, 'Begin')
+        l.end = _parse_xml_vec2(attrs, 'End')
 
     if isinstance(shape, CrossShape):
         x: CrossShape = shape
-        x.width = _parse_xml_float(elem, 'Width')
+        x.width = _parse_xml_float(attrs, 'Width')
 
     if isinstance(shape, RectangleShape):
         r: RectangleShape = shape
-        r.dimensions.x = _parse_xml_float(elem, 'Width')
-        r.dimensions.y = _parse_xml_float(elem, 'Height')
-        r.angle = _parse_xml_float(elem, 'Angle')
-        r.settle_time_line = _parse_xml_float(elem, 'SettleTimeLine')
+        r.dimensions.x = _parse_xml_float(attrs, 'Width')
+        r.dimensions.y = _parse_xml_float(attrs, 'Height')
+        r.angle = _parse_xml_float(attrs, 'Angle')
+        r.settle_time_line = _parse_xml_float(attrs, 'SettleTimeLine')
 
     if isinstance(shape, CircleShape):
         if isinstance(shape, AnnulusShape):
             a: AnnulusShape = shape
-            a.radius = _parse_xml_float(elem, 'RadiusA')
-            a.inner_radius = _parse_xml_float(elem, 'RadiusB')
+            a.radius = _parse_xml_float(attrs, 'RadiusA')
+            a.inner_radius = _parse_xml_float(attrs, 'RadiusB')
         else:
             c: CircleShape = shape
-            c.radius = _parse_xml_float(elem, 'Radius')
+            c.radius = _parse_xml_float(attrs, 'Radius')
 
     if not isinstance(shape, CrossShape):
-        shape.settle_time_frame = _parse_xml_float(elem, 'SettleTimeFrame')
+        shape.settle_time_frame = _parse_xml_float(attrs, 'SettleTimeFrame')
 
     return (name, shape)
 
@@ -192,6 +210,12 @@ def _settings_to_dom(s: ProjectSettings, doc: Document) -> list[Element]:
 
 
 def _settings_from_dom(material: Element, settings: Element) -> ProjectSettings:
+    return _settings_from_xml(_xml_attributes(material),
+                              _xml_attributes(settings))
+
+
+def _settings_from_xml(material: dict[str, str],
+                       settings: dict[str, str]) -> ProjectSettings:
     ps = ProjectSettings()
     ps.process = _parse_xml_str(material, 'proc')
     ps.material_name = _parse_xml_str(material, 'name')
@@ -215,7 +239,7 @@ def _project_to_dom(proj: Project, doc: Document) -> Element:
     _append_children(elem, settings)
 
     objlist = doc.createElement('ObjectList')
-    for name, obj in proj.objects.items():
+    for name, obj in flattened(proj.ordered_objects()):
         objlist.appendChild(_shape_to_dom(obj, name, doc))
 
     elem.appendChild(objlist)
@@ -243,7 +267,7 @@ def _project_from_dom(elem: Element) -> Project:
         if child.nodeType == Node.ELEMENT_NODE:
             name, obj = _shape_from_dom(child)
             if obj is not None:
-                project.objects[name] = obj
+                project.insert_shape(name, obj)
 
     return project
 
@@ -272,12 +296,93 @@ def from_dom(doc: Document) -> Project:
     return _project_from_dom(pelem)
 
 
-def to_file(project: Project, file: IOBase):
-    doc = to_dom(project)
-    doc.writexml(file, indent='', addindent=' ', newl='\n', standalone=True)
-
-
-def from_file(file: IOBase) -> Project:
-    doc = parse(file)
-    proj = from_dom(doc)
-    return proj
+# Instances of shape groups are written as copies of the group's shapes.
+# progress is called with the fraction of the shapes written so far, and
+# stops the write if it raises.
+def to_file(project: Project, file: IOBase,
+            progress: Callable[[float], None] = None):
+    objects = project.ordered_objects()
+    if progress is not None:
+        objects = _reporting(objects, len(project.order), progress)
+    write_objects(file, project.settings, flattened(objects))
+
+
+def _reporting(objects: Iterable[tuple[str, ShapeObject]], count: int,
+               progress: Callable[[float], None]) \
+        -> Iterator[tuple[str, ShapeObject]]:
+    for i, item in enumerate(objects):
+        if i % PROGRESS_STEP == 0:
+            progress(i / max(count, 1))
+        yield item
+    progress(1.0)
+
+
+# Writes a project file from settings and (name, shape) pairs, one element
+# at a time, so the document of a large project is never held at once. The
+# output is the same as writing the DOM of to_dom().
+def write_objects(file: IOBase, settings: ProjectSettings,
+                  objects: Iterable[tuple[str, ShapeObject]]) -> None:
+    doc = Document()
+    file.write('<?xml version="1.0" standalone="yes"?>\n')
+    doc.createComment(f' Generated by LyraTool v{__version__} ') \
+        .writexml(file, '', ' ', '\n')
+    file.write('<Project ver="1.0">\n')
+    for elem in _settings_to_dom(settings, doc):
+        elem.writexml(file, ' ', ' ', '\n')
+
+    empty: bool = True
+    for name, obj in objects:
+        if empty:
+            file.write(' <ObjectList>\n')
+            empty = False
+        _shape_to_dom(obj, name, doc).writexml(file, '  ', ' ', '\n')
+    file.write(' <ObjectList/>\n' if empty else ' </ObjectList>\n')
+    file.write('</Project>\n')
+
+
+# Reads a project file element by element, making each shape as its element
+# is read, so the document of a large project is never built. The result is
+# the same as from_dom() of the parsed document. progress is called with the
+# fraction of the file read so far, and stops the load if it raises.
+def from_file(file: IOBase,
+              progress: Callable[[float], None] = None) -> Project:
+    project = Project()
+    found: list[str] = []  # Tags of the elements on the way to the current
+    material: dict[str, str] = None
+    settings: dict[str, str] = None
+
+    def start(tag: str, attrs: dict[str, str]) -> None:
+        nonlocal material, settings
+        if found == ['Project', 'ObjectList']:
+            name, obj = _shape_from_xml(tag, attrs)
+            if obj is not None:
+                project.insert_shape(name, obj)
+        elif found == ['Project']:
+            if tag == 'Material':
+                material = attrs
+            if tag == 'Settings':
+                settings = attrs
+        elif len(found) == 0 and tag != 'Project':
+            raise RuntimeError('Failed to find Project XML element')
+        found.append(tag)
+
+    def end(tag: str) -> None:
+        found.pop()
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    size: int = 1
+    if progress is not None:
+        size = max(os.fstat(file.fileno()).st_size, 1)
+    read: int = 0
+    while True:
+        data = file.read(READ_SIZE)
+        parser.Parse(data, len(data) == 0)
+        if len(data) == 0:
+            break
+        read += len(data)
+        if progress is not None:
+            progress(min(read / size, 1.0))
+    project.settings = _settings_from_xml(material, settings)
+    return project